@@ -0,0 +1,264 @@
+"""
+End-to-end benchmark of files2md on a synthetic tree (see synth_tree).
+
+    python -m benchmarks.bench --files 5000 --json results.json
+
+Each stage of the pipeline is timed on its own, and the results are
+written as JSON, with throughput in files/s and MB/s and the peak RSS of
+the process after each stage, so that they can be compared across
+releases.
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable
+
+import files2md
+from files2md import md_transform
+from files2md.cli import cli_args, cli_impl, gitutil
+
+from benchmarks import synth_tree
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+# substitution rules for the "substitutions" stage; see files2md.subrules
+SUB_RULES = "\n".join(
+    [
+        "# synthetic rules, one literal and two regular expressions",
+        "password\t********",
+        r"\bbuffer\b" + "\t" + "buf",
+        r"[0-9a-f]{32}" + "\t" + "<hash>",
+    ]
+)
+
+
+@dataclass
+class StageResult:
+    seconds: float
+    files: int
+    bytes: int
+    # high-water mark of the process's RSS after the stage, if known
+    peak_rss_bytes: int | None
+
+    def as_dict(self) -> dict:
+        seconds = max(self.seconds, 1e-9)
+        return {
+            **asdict(self),
+            "files_per_s": self.files / seconds,
+            "mb_per_s": self.bytes / seconds / 1e6,
+        }
+
+
+class Bench:
+    def __init__(self, tree: synth_tree.SynthTree, work_dir: Path):
+        self.tree = tree
+        self.work_dir = work_dir
+        rules_file = work_dir / "sub-rules.txt"
+        rules_file.write_text(SUB_RULES)
+        self.mdfmt = md_transform.MdFormatter(
+            tag_str="",
+            exclude_empty=True,
+            max_lines_per_file=0,
+            mlpf_approx_pct=25,
+            sub_rules_file=str(rules_file),
+        )
+        self.sizes = {file: file.stat().st_size for file in tree.files}
+        # filled in by the detect_encoding and read_file_lines stages
+        self.encodings: dict[Path, str] = {}
+        self.contents: list[str] = []
+
+    def stages(self) -> dict[str, Callable[[], tuple[int, int]]]:
+        stages = {
+            "collect_paths": self.collect_paths,
+            "git_lsfiles_dirs": self.git_lsfiles_dirs,
+            "detect_encoding": self.detect_encoding,
+            "read_file_lines": self.read_file_lines,
+            "substitutions": self.substitutions,
+            "write_single_file": self.write_single_file,
+            "write_split_files": self.write_split_files,
+        }
+        if not self.tree.spec.git:
+            del stages["git_lsfiles_dirs"]
+        return stages
+
+    def run(self) -> dict[str, StageResult]:
+        results = {}
+        for name, stage in self.stages().items():
+            started = time.perf_counter()
+            files, nbytes = stage()
+            seconds = time.perf_counter() - started
+            results[name] = StageResult(seconds, files, nbytes, peak_rss_bytes())
+        return results
+
+    def text_files(self) -> list[Path]:
+        return [f for f in self.tree.files if self.encodings.get(f) != "binary"]
+
+    def collect_paths(self) -> tuple[int, int]:
+        args = cli_args.parse(
+            [str(self.tree.root), "-g", "*", "-f", "-o", str(self.out_file())]
+        )
+        files, _, _ = cli_impl.collect_paths(args)
+        return len(files), 0
+
+    def git_lsfiles_dirs(self) -> tuple[int, int]:
+        files = gitutil.git_lsfiles_dirs([self.tree.root])
+        return len(files), 0
+
+    def detect_encoding(self) -> tuple[int, int]:
+        nbytes = 0
+        for file in self.tree.files:
+            self.encodings[file] = self.mdfmt.detect_encoding(file)
+            nbytes += min(self.sizes[file], md_transform.DETECT_ENCODING_MAX_BYTES)
+        return len(self.tree.files), nbytes
+
+    def read_file_lines(self) -> tuple[int, int]:
+        files = self.text_files()
+        for file in files:
+            lines, _ = self.mdfmt.read_file_lines(file, self.encodings[file])
+            self.contents.append("".join(lines))
+        return len(files), sum(self.sizes[f] for f in files)
+
+    def substitutions(self) -> tuple[int, int]:
+        nbytes = 0
+        for content in self.contents:
+            self.mdfmt.sub_rules.apply(content)
+            nbytes += len(content)
+        return len(self.contents), nbytes
+
+    def write_single_file(self) -> tuple[int, int]:
+        out_file = self.out_file()
+        with open(out_file, "w", encoding="utf-8") as ofh:
+            writer = self.make_writer(md_transform.SingleFileOutputHandler(ofh))
+            with writer:
+                writer.make_md()
+        return len(self.tree.files), self.tree.total_bytes
+
+    def write_split_files(self) -> tuple[int, int]:
+        handler = md_transform.SplitFileOutputHandler(
+            initial_path=self.out_file(), bytes_per_file=2**20
+        )
+        with self.make_writer(handler) as writer:
+            writer.make_md()
+        return len(self.tree.files), self.tree.total_bytes
+
+    def make_writer(self, output: md_transform.OutputHandler) -> md_transform.MdWriter:
+        return md_transform.MdWriter(
+            output=output,
+            project_name=self.tree.root.name,
+            in_dirs=[self.tree.root],
+            files=self.tree.files,
+            sub_rules_file="",
+        )
+
+    def out_file(self) -> Path:
+        return self.work_dir / "out" / "out.md"
+
+
+def peak_rss_bytes() -> int | None:
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes, except on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def run_bench(spec: synth_tree.TreeSpec, work_dir: Path) -> dict:
+    tree = synth_tree.generate_tree(work_dir / "tree", spec)
+    work_dir.joinpath("out").mkdir(exist_ok=True)
+    bench = Bench(tree, work_dir)
+    stages = bench.run()
+    return {
+        "files2md_version": files2md.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "tree": {
+            **asdict(spec),
+            "total_bytes": tree.total_bytes,
+        },
+        "stages": {name: result.as_dict() for name, result in stages.items()},
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def build_argparser() -> argparse.ArgumentParser:
+    defaults = synth_tree.TreeSpec()
+    parser = argparse.ArgumentParser(
+        description="Benchmark files2md on a synthetic tree.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--files", type=int, default=defaults.file_count)
+    parser.add_argument("--median-size", type=int, default=defaults.median_size)
+    parser.add_argument("--size-sigma", type=float, default=defaults.size_sigma)
+    parser.add_argument("--binary-ratio", type=float, default=defaults.binary_ratio)
+    parser.add_argument("--max-depth", type=int, default=defaults.max_depth)
+    parser.add_argument("--ignored-files", type=int, default=defaults.ignored_files)
+    parser.add_argument(
+        "--encodings",
+        type=str,
+        default=",".join(f"{e}:{w:g}" for e, w in defaults.encodings),
+        metavar="ENC:WEIGHT,...",
+        help="Relative weights of the encodings of text files.",
+    )
+    parser.add_argument(
+        "--git",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Commit the tree to git and time git_lsfiles_dirs.",
+    )
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument(
+        "--work-dir",
+        type=Path,
+        help="Generate the tree here and keep it (default: a temporary directory).",
+    )
+    parser.add_argument(
+        "--json", type=Path, metavar="FILE", help="Write the results to FILE."
+    )
+    return parser
+
+
+def parse_encodings(s: str) -> tuple[tuple[str, float], ...]:
+    encodings = []
+    for item in s.split(","):
+        encoding, _, weight = item.partition(":")
+        encodings.append((encoding, float(weight or 1)))
+    return tuple(encodings)
+
+
+def main(argv: list[str] = sys.argv[1:]):
+    args = build_argparser().parse_args(argv)
+    spec = synth_tree.TreeSpec(
+        file_count=args.files,
+        median_size=args.median_size,
+        size_sigma=args.size_sigma,
+        encodings=parse_encodings(args.encodings),
+        binary_ratio=args.binary_ratio,
+        max_depth=args.max_depth,
+        ignored_files=args.ignored_files,
+        git=args.git and shutil.which("git") is not None,
+        seed=args.seed,
+    )
+    if args.work_dir:
+        args.work_dir.mkdir(parents=True, exist_ok=True)
+        results = run_bench(spec, args.work_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="files2md-bench-") as tmp:
+            results = run_bench(spec, Path(tmp))
+    text = json.dumps(results, indent=2)
+    if args.json:
+        args.json.write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Startup time regression benchmark, based on `python -X importtime`.
+
+    python -m benchmarks.startup --repeat 5 --max-ms 150
+
+Runs `files2md --help` and `files2md --version` in fresh interpreters and
+reports the time spent importing modules, and whether any module that
+should only be imported on first use (HEAVY_MODULES) was imported. Exits
+with status 1 if one was, or if the import time exceeds --max-ms.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# modules that `--help` and `--version` must not import
+HEAVY_MODULES = (
+    "charset_normalizer",
+    "pathspec",
+    "mimetypes",
+    "sqlite3",
+    "concurrent.futures",
+)
+
+STARTUP_ARGVS = (["--help"], ["--version"])
+
+
+def measure_imports(argv: list[str]) -> dict[str, int]:
+    """
+    Runs files2md with `argv` under -X importtime, and returns the time
+    in microseconds spent importing each module, excluding its imports.
+    """
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, sys.path))}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "files2md.cli", *argv],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    self_us: dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line.removeprefix("import time:").split("|")
+        if not fields[0].strip().isdigit():
+            continue  # the header line
+        self_us[fields[2].strip()] = int(fields[0])
+    return self_us
+
+
+def heavy_imports(self_us: dict[str, int]) -> list[str]:
+    return sorted(
+        name
+        for name in self_us
+        if any(name == m or name.startswith(m + ".") for m in HEAVY_MODULES)
+    )
+
+
+def bench_startup(argv: list[str], repeat: int) -> dict:
+    runs = [measure_imports(argv) for _ in range(repeat)]
+    best = min(runs, key=lambda run: sum(run.values()))
+    return {
+        "import_ms": sum(best.values()) / 1000,
+        "modules": len(best),
+        "heavy_imports": heavy_imports(best),
+    }
+
+
+def main(argv: list[str] = sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description="Measure the import time of files2md --help/--version.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--repeat", type=int, default=5, metavar="N")
+    parser.add_argument(
+        "--max-ms", type=float, default=0, help="Fail above this. 0 = no limit."
+    )
+    args = parser.parse_args(argv)
+    results = {
+        " ".join(startup_argv): bench_startup(startup_argv, args.repeat)
+        for startup_argv in STARTUP_ARGVS
+    }
+    print(json.dumps(results, indent=2))
+    failed = any(
+        result["heavy_imports"] or (args.max_ms and result["import_ms"] > args.max_ms)
+        for result in results.values()
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import random
+import subprocess
+from dataclasses import dataclass, field
+from pathlib import Path
+
+IGNORED_DIR = "node_modules"
+
+TEXT_SUFFIXES = [
+    (".py", 30),
+    (".md", 15),
+    (".txt", 15),
+    (".js", 15),
+    (".json", 10),
+    (".c", 10),
+    (".yaml", 5),
+]
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog def class return import "
+    "while for if else self value result index count error path file line "
+    "buffer encoding render section output input config cache worker"
+).split()
+
+# characters mixed into text files of these encodings, so that they are
+# not plain ASCII
+ENCODING_ACCENTS = {
+    "utf-8": "é → ✓",
+    "utf-16": "é → ✓",
+    "latin-1": "é à ü",
+    "cp1252": "é € ü",
+}
+
+
+@dataclass(frozen=True)
+class TreeSpec:
+    # number of files outside the ignored directory
+    file_count: int = 1000
+    # file sizes are log-normally distributed around this median
+    median_size: int = 4000
+    size_sigma: float = 1.0
+    max_size: int = 4 * 2**20
+    # relative weights of the encodings of the text files
+    encodings: tuple[tuple[str, float], ...] = (
+        ("ascii", 70),
+        ("utf-8", 25),
+        ("latin-1", 3),
+        ("utf-16", 2),
+    )
+    # fraction of files that are binary
+    binary_ratio: float = 0.05
+    # files are placed between 0 and max_depth directories deep, with
+    # dir_fanout subdirectories per directory
+    max_depth: int = 4
+    dir_fanout: int = 4
+    # files in an IGNORED_DIR directory, which .gitignore excludes
+    ignored_files: int = 0
+    # commit the tree to a new git repository
+    git: bool = False
+    seed: int = 0
+
+
+@dataclass
+class SynthTree:
+    root: Path
+    spec: TreeSpec
+    # the files outside the ignored directory
+    files: list[Path] = field(default_factory=list)
+    ignored_files: list[Path] = field(default_factory=list)
+    # total size of `files`
+    total_bytes: int = 0
+
+
+def generate_tree(root: Path, spec: TreeSpec) -> SynthTree:
+    """
+    Writes a tree of files described by `spec` beneath `root`. The same
+    spec always produces the same tree.
+    """
+    rng = random.Random(spec.seed)
+    line_pool = make_line_pool(rng)
+    tree = SynthTree(root=root, spec=spec)
+    root.mkdir(parents=True, exist_ok=True)
+    root.joinpath(".gitignore").write_text(f"{IGNORED_DIR}/\n")
+    for i in range(spec.file_count):
+        path = root / random_dir(rng, spec) / random_name(rng, spec, i)
+        size = write_random_file(rng, spec, line_pool, path)
+        tree.files.append(path)
+        tree.total_bytes += size
+    for i in range(spec.ignored_files):
+        path = root / IGNORED_DIR / random_dir(rng, spec) / random_name(rng, spec, i)
+        write_random_file(rng, spec, line_pool, path)
+        tree.ignored_files.append(path)
+    tree.files.sort()
+    if spec.git:
+        git_commit_tree(root)
+    return tree
+
+
+def make_line_pool(rng: random.Random, size: int = 1000) -> list[str]:
+    pool = []
+    for _ in range(size):
+        indent = " " * 4 * rng.randrange(4)
+        words = rng.choices(WORDS, k=rng.randrange(16))
+        pool.append(indent + " ".join(words) + "\n")
+    return pool
+
+
+def random_dir(rng: random.Random, spec: TreeSpec) -> Path:
+    depth = rng.randint(0, spec.max_depth)
+    return Path(*[f"d{rng.randrange(spec.dir_fanout)}" for _ in range(depth)])
+
+
+def random_name(rng: random.Random, spec: TreeSpec, index: int) -> str:
+    if rng.random() < spec.binary_ratio:
+        return f"f{index:06d}.dat"
+    suffixes, weights = zip(*TEXT_SUFFIXES)
+    return f"f{index:06d}{rng.choices(suffixes, weights)[0]}"
+
+
+def random_size(rng: random.Random, spec: TreeSpec) -> int:
+    size = int(rng.lognormvariate(0, spec.size_sigma) * spec.median_size)
+    return min(size, spec.max_size)
+
+
+def write_random_file(
+    rng: random.Random, spec: TreeSpec, line_pool: list[str], path: Path
+) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    size = random_size(rng, spec)
+    if path.suffix == ".dat":
+        blob = b"\0" + rng.randbytes(max(size - 1, 0))
+    else:
+        encodings, weights = zip(*spec.encodings)
+        encoding = rng.choices(encodings, weights)[0]
+        blob = random_text(rng, line_pool, size, encoding).encode(encoding)
+    path.write_bytes(blob)
+    return len(blob)
+
+
+def random_text(
+    rng: random.Random, line_pool: list[str], size: int, encoding: str
+) -> str:
+    accents = ENCODING_ACCENTS.get(encoding, "")
+    lines = []
+    length = 0
+    while length < size:
+        line = rng.choice(line_pool)
+        if accents and rng.random() < 0.2:
+            line = f"{accents} {line}"
+        lines.append(line)
+        length += len(line)
+    return "".join(lines)
+
+
+def git_commit_tree(root: Path):
+    def git(*args: str):
+        subprocess.run(
+            ["git", "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+            + list(args),
+            cwd=root,
+            check=True,
+            capture_output=True,
+        )
+
+    git("init", "-q")
+    git("add", "-A")
+    git("commit", "-q", "-m", "synthetic tree")
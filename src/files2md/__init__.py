@@ -1,3 +1,4 @@
-from .md_transform import MdFormatter
+from .md_transform import MdFormatter, MemoryOutputHandler
+from .sections import Section, iter_sections
 
 __version__ = "1.0.2"
@@ -0,0 +1,351 @@
+"""
+`files2md batch MANIFEST` renders many projects into separate outputs in
+one process: the jobs share one worker pool, one render cache and the
+caches of the process (compiled patterns, file classification), run
+concurrently from the largest (by the size of its files) to the smallest,
+and are summarized in one report.
+
+The manifest is TOML, or JSON of the same structure:
+
+    [defaults]
+    glob_patterns = ["*"]
+    max_lines_per_file = 500
+
+    [[jobs]]
+    in_dirs = ["projects/a"]
+    out_file = "out/a.md"
+
+    [[jobs]]
+    in_dirs = ["projects/b", "projects/c"]
+    out_file = "out/bc.md"
+    project_name = "b and c"
+    split = "500KiB"
+
+A job takes the options of `files2md` listed in MANIFEST_OPTIONS, named as
+in cli_args.Args, with the same values (`split` as in -p); `defaults`
+apply to every job. Relative paths are relative to the manifest.
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Sequence
+
+from files2md import md_transform, render_cache
+from files2md.cli import cli_args, cli_impl, msg
+from files2md.cli.cli_args import ArgType
+from files2md.cli.humansize import humansize_to_size
+
+if TYPE_CHECKING:
+    import concurrent.futures
+
+MANIFEST_OPTIONS = (
+    "in_dirs",
+    "out_file",
+    "project_name",
+    "glob_patterns",
+    "exclude_patterns",
+    "use_default_patterns",
+    "git_ls_files",
+    "changed_since",
+    "staged",
+    "list_removed",
+    "max_lines_per_file",
+    "mlpf_approx_pct",
+    "include_empty",
+    "sub_rules_file",
+    "split",
+    "output_encoding",
+    "dedupe",
+    "read_threads",
+    "walk_threads",
+)
+
+
+@dataclass
+class BatchJob:
+    # position in the manifest
+    index: int
+    # the options of the job, as for `files2md`
+    args: cli_args.Args
+    project_name: str
+    files: Sequence[Path] = ()
+    removed: list[md_transform.RemovedFile] = field(default_factory=list)
+    # total size of the files, by which the jobs are scheduled
+    nbytes: int = 0
+    # why collecting the files failed, if it did
+    error: str = ""
+
+
+@dataclass
+class JobResult:
+    job: BatchJob
+    seconds: float
+    # None if the job failed
+    summary: md_transform.TransformSummary | None
+    output_files: list[Path] = field(default_factory=list)
+    error: str = ""
+
+
+def load_manifest(path: Path) -> dict[str, Any]:
+    if path.suffix == ".toml":
+        import tomllib
+
+        with open(path, "rb") as fh:
+            return tomllib.load(fh)
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def manifest_jobs(
+    manifest: dict[str, Any], base_dir: Path, batch_args: argparse.Namespace
+) -> list[BatchJob]:
+    """
+    The jobs of `manifest`, with the options of the batch (pool, output
+    overwriting) applied. Raises ValueError for invalid options.
+    """
+    defaults = manifest.get("defaults", {})
+    jobs: list[BatchJob] = []
+    out_files: set[Path] = set()
+    for index, job_options in enumerate(manifest.get("jobs", [])):
+        options = {**defaults, **job_options}
+        try:
+            job = make_job(index, options, base_dir, batch_args)
+        except (ValueError, argparse.ArgumentTypeError) as e:
+            raise ValueError(f"job {index + 1}: {e}") from e
+        if job.args.out_file in out_files:
+            raise ValueError(f"job {index + 1}: {job.args.out_file} is written twice")
+        out_files.add(job.args.out_file)
+        jobs.append(job)
+    if not jobs:
+        raise ValueError("no jobs")
+    return jobs
+
+
+def make_job(
+    index: int, options: dict[str, Any], base_dir: Path, batch_args: argparse.Namespace
+) -> BatchJob:
+    unknown = sorted(set(options) - set(MANIFEST_OPTIONS))
+    if unknown:
+        raise ValueError(f"unknown options: {', '.join(unknown)}")
+    if not options.get("in_dirs") or not options.get("out_file"):
+        raise ValueError("in_dirs and out_file are required")
+    args = cli_args.default_args()
+    for name, value in options.items():
+        setattr(args, name, value)
+    args.in_dirs = [ArgType.existing_dir(str(base_dir / d)) for d in args.in_dirs]
+    args.out_file = base_dir.joinpath(args.out_file).absolute()
+    if not batch_args.force and args.out_file.exists():
+        raise ValueError(f"{args.out_file} exists. Use -f to overwrite.")
+    if args.sub_rules_file:
+        args.sub_rules_file = str(
+            ArgType.existing_file(str(base_dir / args.sub_rules_file))
+        )
+    args.split = ArgType.split_size(str(args.split))
+    if args.list_removed and not (args.changed_since or args.staged):
+        raise ValueError("list_removed requires changed_since or staged")
+    args.jobs = batch_args.jobs
+    args.executor = batch_args.executor
+    project_name = options.get("project_name") or cli_impl.make_project_name(args)
+    return BatchJob(index, args, project_name)
+
+
+def collect_job(job: BatchJob) -> BatchJob:
+    try:
+        job.files, _, job.removed = cli_impl.collect_paths(job.args)
+    except Exception as e:
+        # reported by run_job(), like a failure to render
+        job.error = error_message(e)
+        return job
+    job.nbytes = sum(map(file_size, job.files))
+    return job
+
+
+def error_message(e: Exception) -> str:
+    return f"{type(e).__name__}: {e}"
+
+
+def file_size(file: Path) -> int:
+    try:
+        return os.stat(file).st_size
+    except OSError:
+        return 0
+
+
+def run_job(
+    job: BatchJob,
+    *,
+    cache: render_cache.RenderCache | None,
+    pool: "concurrent.futures.Executor | None",
+) -> JobResult:
+    if job.error:
+        return JobResult(job, 0.0, None, error=job.error)
+    start = time.perf_counter()
+    try:
+        writer = cli_impl.main_file_output(
+            job.args,
+            job.files,
+            job.project_name,
+            cache,
+            removed=job.removed,
+            pool=pool,
+        )
+    except Exception as e:
+        # a failed job is reported, and the others carry on
+        return JobResult(job, time.perf_counter() - start, None, error=error_message(e))
+    return JobResult(
+        job,
+        time.perf_counter() - start,
+        writer.summary,
+        writer.output_handler.get_filepaths(),
+    )
+
+
+def run_jobs(jobs: list[BatchJob], batch_args: argparse.Namespace) -> list[JobResult]:
+    """
+    Collects the files of all jobs, then runs them largest first, as many
+    at a time as there are workers, all rendering on one pool of workers.
+    """
+    import concurrent.futures
+
+    workers = batch_args.jobs if batch_args.jobs > 0 else (os.cpu_count() or 1)
+    with contextlib.ExitStack() as stack:
+        pool = None
+        if workers > 1:
+            # before any thread is started, see make_shared_pool
+            pool = stack.enter_context(
+                md_transform.make_shared_pool(workers, batch_args.executor)
+            )
+        job_threads = stack.enter_context(
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="files2md-job"
+            )
+        )
+        jobs = list(job_threads.map(collect_job, jobs))
+        jobs.sort(key=lambda job: job.nbytes, reverse=True)
+        cache = None
+        if batch_args.use_cache:
+            cache = stack.enter_context(
+                render_cache.RenderCache(
+                    batch_args.cache_dir, max_bytes=batch_args.cache_size
+                )
+            )
+        run = functools.partial(run_job, cache=cache, pool=pool)
+        return list(job_threads.map(run, jobs))
+
+
+def report(results: list[JobResult], batch_args: argparse.Namespace, seconds: float):
+    results = sorted(results, key=lambda result: result.job.index)
+    summaries = [r.summary for r in results if r.summary is not None]
+    failed = [r for r in results if r.summary is None]
+    output_size = sum(f.stat().st_size for r in results for f in r.output_files)
+    totals: dict[str, Any] = {
+        "Jobs": len(results),
+        "Failed jobs": len(failed),
+        "Number of files included": sum(len(r.job.files) for r in results),
+        "Output file size": output_size,
+        "Seconds": f"{seconds:.2f}",
+    }
+    if batch_args.use_cache:
+        hits = sum(s.cache_hits for s in summaries)
+        misses = sum(s.cache_misses for s in summaries)
+        totals["Render cache hits/misses"] = f"{hits}/{misses}"
+    if any(r.job.args.dedupe for r in results):
+        totals["Duplicate files"] = sum(s.duplicate_files for s in summaries)
+        totals["Bytes of duplicate content not written"] = sum(
+            s.duplicate_bytes for s in summaries
+        )
+    with msg.VPrinter(batch_args.verbosity) as vprint:
+        vprint.section(2, "jobs", map(job_line, results), "\n")
+        if failed:
+            vprint.section(
+                0,
+                "failed-jobs",
+                (f"{r.job.args.out_file}: {r.error}" for r in failed),
+                "\n",
+            )
+        vprint.section(1, "summary", totals)
+
+
+def job_line(result: JobResult) -> str:
+    status = "ok  " if result.summary is not None else "FAIL"
+    return (
+        f"{status} {len(result.job.files):8,} files {result.job.nbytes:14,} bytes "
+        f"{result.seconds:8.2f}s: {result.job.args.out_file}"
+    )
+
+
+def build_argparser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="files2md batch",
+        description="Render the jobs of a manifest (TOML or JSON) in one process.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("manifest", type=ArgType.existing_file, metavar="MANIFEST")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Render N files, and up to N jobs, in parallel. 0 = one per CPU.",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=md_transform.EXECUTORS,
+        default=md_transform.EXECUTOR_PROCESS,
+        help="Worker pool shared by the jobs when --jobs is not 1.",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Overwrite existing output files.",
+    )
+    parser.add_argument(
+        "--cache",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        dest="use_cache",
+        help="Reuse rendered sections of unchanged files from previous runs.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=ArgType.dir_or_nonexistant,
+        default=render_cache.default_cache_dir(),
+        metavar="DIR",
+        help="Directory of the render cache.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=humansize_to_size,
+        default=render_cache.DEFAULT_CACHE_MAX_BYTES,
+        metavar="SIZE",
+        help="Evict least recently used sections beyond SIZE (e.g. 256MiB).",
+    )
+    parser.add_argument("-v", "--verbose", action="count", default=5, dest="verbosity")
+    parser.add_argument("-q", "--quiet", action="count", default=0, dest="quietosity")
+    return parser
+
+
+def main_batch(argv: list[str]):
+    batch_args = build_argparser().parse_args(argv)
+    batch_args.verbosity -= batch_args.quietosity
+    manifest_path: Path = batch_args.manifest
+    try:
+        manifest = load_manifest(manifest_path)
+        jobs = manifest_jobs(manifest, manifest_path.parent, batch_args)
+    except (OSError, ValueError) as e:
+        # tomllib.TOMLDecodeError and json.JSONDecodeError are ValueErrors
+        sys.exit(f"files2md batch: {manifest_path}: {e}")
+    start = time.perf_counter()
+    results = run_jobs(jobs, batch_args)
+    report(results, batch_args, time.perf_counter() - start)
+    if any(result.summary is None for result in results):
+        sys.exit(1)
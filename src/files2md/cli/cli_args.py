@@ -6,9 +6,20 @@ import typing
 import types
 import re
 
+import files2md
+from files2md import md_transform, profiling, readahead, render_cache
+from files2md.cli import watch
+from files2md.cli.humansize import humansize_to_size
+
 
 class Args:
     autoname_output: bool
+    cache_dir: pathlib.Path
+    cache_size: int
+    changed_since: str | None
+    compact: bool
+    dedupe: bool
+    use_cache: bool
     exclude_patterns: list[str]
     first_pass: pathlib.Path
     force: bool
@@ -16,17 +27,30 @@ class Args:
     glob_patterns: list[str]
     in_dirs: list[pathlib.Path]
     include_empty: bool
+    jobs: int
+    executor: str
+    list_removed: bool
     max_lines_per_file: int
     mlpf_approx_pct: int
     out_dir: pathlib.Path
     out_file: pathlib.Path
     output_encoding: str
     output_extension: str
+    profile: pathlib.Path | None
+    profile_top: int
     use_default_patterns: bool
     split: int
+    staged: bool
     sub_rules_file: str
     verbosity: int
     quietosity: int
+    read_ahead: int
+    read_threads: int
+    walk_threads: int
+    watch: bool
+    watch_interval: float
+    watch_debounce: float
+
 
 def parse(argv: list[str]) -> Args:
     parser = build_argparser()
@@ -48,14 +72,29 @@ def parse(argv: list[str]) -> Args:
         parser.error(f"{args.out_file} exists. Use -f to overwrite.")
     args.out_file = args.out_file.absolute()
 
+    if args.compact and args.watch:
+        parser.error("--compact cannot be used with --watch")
+    if args.list_removed and not (args.changed_since or args.staged):
+        parser.error("--list-removed requires --changed-since or --staged")
+    if args.list_removed and args.watch:
+        parser.error("--list-removed cannot be used with --watch")
+
     args.verbosity = args.verbosity - args.quietosity
 
     return args
 
 
+def default_args() -> Args:
+    """The Args of a run without options, other than an output file."""
+    return build_argparser().parse_args(["-o", os.devnull], namespace=Args())
+
+
 def build_argparser():
     parser = argparse.ArgumentParser(
         description="Convert file structure to markdown.",
+        epilog="To render repeatedly with warm caches, run 'files2md serve --socket PATH' "
+        "and use 'files2md client --socket PATH' with the options above. "
+        "To render many projects in one process, run 'files2md batch MANIFEST'.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
     parser.add_argument(
@@ -65,6 +104,12 @@ def build_argparser():
         metavar="DIR",
         help="Specify one or more input directories.",
     )
+    parser.add_argument(
+        "-V",
+        "--version",
+        action="version",
+        version=f"files2md {files2md.__version__}",
+    )
 
     def add_output_options():
         parser.add_argument(
@@ -187,13 +232,31 @@ def build_argparser():
         default=False,
         help="Use 'git ls-files' to list files in input directories.",
     )
+    parser.add_argument(
+        "--changed-since",
+        metavar="REV",
+        help="Only include files changed in the git work trees since REV "
+        "(a commit, or a range such as main...HEAD), as listed by 'git diff REV'.",
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        help="Only include files with changes staged in the git index "
+        "(since REV with --changed-since, else since HEAD).",
+    )
+    parser.add_argument(
+        "--list-removed",
+        action="store_true",
+        help="With --changed-since or --staged, also list deleted and renamed "
+        "files, without content.",
+    )
     parser.add_argument(
         "-p",
         "--split",
-        type=int,
-        metavar="KB",
+        type=ArgType.split_size,
+        metavar="SIZE",
         default=0,
-        help="Split output into multiple files of [approximate] size `KB` kilobytes each.",
+        help="Split output into multiple files of at most SIZE each (e.g. 500KiB). A plain number is in kilobytes.",
     )
     parser.add_argument(
         "-s",
@@ -202,6 +265,113 @@ def build_argparser():
         metavar="FILE",
         help="Specify a file containing text substitution rules.",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Render N files in parallel. 0 = one job per CPU.",
+    )
+    parser.add_argument(
+        "--executor",
+        type=str,
+        choices=md_transform.EXECUTORS,
+        default=md_transform.EXECUTOR_PROCESS,
+        help="Worker pool used when --jobs is not 1.",
+    )
+    parser.add_argument(
+        "--walk-threads",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Scan directories with N threads (for high-latency filesystems).",
+    )
+    parser.add_argument(
+        "--read-threads",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Read files ahead of rendering with N threads (if --jobs is 1), e.g. "
+        f"{readahead.DEFAULT_READ_THREADS} on network or cold storage. 0 = off.",
+    )
+    parser.add_argument(
+        "--read-ahead",
+        type=humansize_to_size,
+        default=readahead.DEFAULT_READ_AHEAD_BYTES,
+        metavar="SIZE",
+        help="Pause reading ahead while SIZE of read files wait to be rendered.",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        default=False,
+        help="Write files whose content was already written as a reference to the "
+        "first such file.",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        default=False,
+        help="Save memory on trees of millions of files: store paths compactly, "
+        "and the per-file summary in a temporary database. Not with --watch.",
+    )
+    parser.add_argument(
+        "--cache",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        dest="use_cache",
+        help="Reuse rendered sections of unchanged files from previous runs.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=ArgType.dir_or_nonexistant,
+        default=render_cache.default_cache_dir(),
+        metavar="DIR",
+        help="Directory of the render cache.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=humansize_to_size,
+        default=render_cache.DEFAULT_CACHE_MAX_BYTES,
+        metavar="SIZE",
+        help="Evict least recently used sections beyond SIZE (e.g. 256MiB).",
+    )
+    parser.add_argument(
+        "--profile",
+        type=ArgType.file_or_nonexistant,
+        default=None,
+        metavar="FILE",
+        help="Write a Chrome trace (for Perfetto) of the time spent per stage and file to FILE.",
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=profiling.DEFAULT_TOP_N,
+        metavar="N",
+        help="With --profile, list the N slowest files in the summary.",
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Keep running, and update the output whenever input files change.",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=watch.DEFAULT_POLL_INTERVAL_S,
+        metavar="SECONDS",
+        help="How often --watch checks the input files for changes.",
+    )
+    parser.add_argument(
+        "--watch-debounce",
+        type=float,
+        default=watch.DEFAULT_DEBOUNCE_S,
+        metavar="SECONDS",
+        help="Wait until files have not changed for SECONDS before updating.",
+    )
     return parser
 
 
@@ -227,6 +397,12 @@ class ArgType:
             raise argparse.ArgumentTypeError(f"exists and is not a file: {path}")
         return path.absolute()
 
+    @staticmethod
+    def split_size(size_str: str) -> int:
+        if size_str.strip().isdigit():
+            return int(size_str) * 1000
+        return humansize_to_size(size_str)
+
     @staticmethod
     def dir_or_nonexistant(path_str: str) -> Path:
         path = Path(path_str)
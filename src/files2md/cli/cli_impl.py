@@ -1,123 +1,362 @@
 import argparse
+import contextlib
+import functools
 import os
 import sys
 from pathlib import Path
-from typing import Iterable
+from typing import TYPE_CHECKING, Any, Iterable, Sequence
 
-import pathspec
-from pathspec.patterns.gitwildmatch import GitWildMatchPattern
-
-from files2md import fileinfo, md_transform
+from files2md import compact, fileinfo, md_transform, profiling, render_cache
 from files2md.cli import cli_args, msg
-import files2md.cli.gitutil as gitutil
+from files2md.subrules import TextSubstituter
+
+if TYPE_CHECKING:
+    import concurrent.futures
+
+    import pathspec
+
+# compiled pattern lists kept by compile_patterns(), for `files2md serve`
+COMPILED_PATTERNS_CACHED = 64
+
+
+@functools.lru_cache(maxsize=COMPILED_PATTERNS_CACHED)
+def compile_patterns(patterns: tuple[str, ...]) -> "pathspec.PathSpec":
+    import pathspec
+
+    return pathspec.PathSpec.from_lines("gitwildmatch", patterns)
 
 
 def collect_paths_git(
     args: cli_args.Args, patterns: list[str]
-) -> tuple[list[Path], list[str]]:
+) -> tuple[Sequence[Path], list[str]]:
+    import files2md.cli.gitutil as gitutil
+
     all_paths: list[Path] = gitutil.git_lsfiles_dirs(args.in_dirs)
-    pathspec_obj = pathspec.PathSpec.from_lines("gitwildmatch", patterns)
+    pathspec_obj = compile_patterns(tuple(patterns))
     all_paths = [p for p in all_paths if pathspec_obj.match_file(p)]
+    if args.compact:
+        return compact.PathTable.from_paths(all_paths, args.in_dirs), patterns
     return all_paths, patterns
 
 
-def collect_paths(args: cli_args.Args) -> tuple[list[Path], list[str]]:
+def collect_paths_git_diff(
+    args: cli_args.Args, patterns: list[str]
+) -> tuple[Sequence[Path], list[str], list[md_transform.RemovedFile]]:
+    """
+    The files changed since args.changed_since and/or staged, without
+    listing the rest of the tree, and the deleted and renamed files if
+    args.list_removed. Patterns match paths relative to the input directory,
+    as in a walk.
+    """
+    import files2md.cli.gitutil as gitutil
+
+    try:
+        changes = gitutil.git_diff_dirs(
+            args.in_dirs, rev=args.changed_since, staged=args.staged
+        )
+    except gitutil.GitError as e:
+        rev = args.changed_since
+        option = f"--changed-since {rev}" if rev else "--staged"
+        raise ValueError(f"{option}: {e}") from e
+    spec = compile_patterns(tuple(patterns))
+    in_dir_prefixes = [(compact.root_prefix(d), d) for d in args.in_dirs]
+
+    def selected(path: Path) -> bool:
+        s = str(path)
+        for prefix, in_dir in in_dir_prefixes:
+            if s.startswith(prefix):
+                return spec.match_file(path.relative_to(in_dir).as_posix())
+        return False
+
+    paths: list[Path] = []
+    removed: list[md_transform.RemovedFile] = []
+    for change in changes:
+        if change.status == gitutil.DIFF_RENAMED_STATUS and args.list_removed:
+            assert change.old_path is not None
+            if selected(change.old_path):
+                removed.append(md_transform.RemovedFile(change.old_path, change.path))
+        if change.status == gitutil.DIFF_DELETED_STATUS:
+            if args.list_removed and selected(change.path):
+                removed.append(md_transform.RemovedFile(change.path))
+        # submodules are listed as changed directories; staged files may
+        # have been deleted from the work tree since
+        elif selected(change.path) and change.path.is_file():
+            paths.append(change.path)
+    removed.sort(key=lambda r: r.path)
+    if args.compact:
+        return compact.PathTable.from_paths(paths, args.in_dirs), patterns, removed
+    return paths, patterns, removed
 
-    use_default_patterns: bool = args.use_default_patterns
-    include_patterns: list[str] = args.glob_patterns
-    exclude_patterns: list[str] = args.exclude_patterns
 
-    patterns = []
-    if use_default_patterns:
-        patterns.extend(fileinfo.DEFAULT_PATTERNS)
-    exclude_patterns = [f"!{pattern}" for pattern in exclude_patterns]
-    patterns.extend(exclude_patterns)
-    patterns.extend(include_patterns)
+def collect_paths(
+    args: cli_args.Args,
+) -> tuple[Sequence[Path], list[str], list[md_transform.RemovedFile]]:
+    patterns = fileinfo.build_patterns(
+        args.glob_patterns,
+        args.exclude_patterns,
+        use_default_patterns=args.use_default_patterns,
+    )
 
+    if args.changed_since or args.staged:
+        return collect_paths_git_diff(args, patterns)
     if args.git_ls_files:
-        return collect_paths_git(args, patterns)
+        return (*collect_paths_git(args, patterns), [])
+
+    import files2md.cli.walker as walker
 
+    spec = compile_patterns(tuple(patterns))
+    if args.compact:
+        table = compact.PathTable()
+        for in_dir in args.in_dirs:
+            root_id = table.add_root(in_dir)
+            walked = walker.iter_walk_tree(in_dir, spec, threads=args.walk_threads)
+            for x in walked:
+                table.append_rel(root_id, x.rel)
+        return table, patterns, []
     all_paths: list[Path] = []
     for in_dir in args.in_dirs:
-        spec = pathspec.PathSpec.from_lines("gitwildmatch", patterns)
-        specced = [in_dir.joinpath(x) for x in spec.match_tree(in_dir)]
-        all_paths.extend(specced)
-    return all_paths, patterns
+        walked = walker.walk_tree(in_dir, spec, threads=args.walk_threads)
+        all_paths.extend(in_dir.joinpath(x.rel) for x in walked)
+    return all_paths, patterns, []
+
+
+def make_project_name(args: cli_args.Args) -> str:
+    return ", ".join(d.name for d in args.in_dirs) or "No directories specified."
 
 
 def file_sizes_and_names(summary: md_transform.TransformSummary) -> Iterable[str]:
-    lst = summary.included_files
-    sizes = summary.files_to_char_count
-    for item in sorted(lst, key=lambda x: sizes[x]):
-        flags = "x" if item in summary.content_excluded_files else " "
-        flags += "t" if item in summary.truncated_files else " "
-        size = sizes.get(item, -1)
-        yield f"{flags} {size:12,} chars: {item}"
+    for record in summary.iter_by_char_count():
+        flags = "x" if record.excluded else " "
+        flags += "t" if record.truncated else " "
+        tier = record.encoding_tier or "-"
+        yield f"{flags} {record.char_count:12,} chars {tier:>18}: {record.path}"
+
+
+def sub_rule_stats(
+    rules: list[TextSubstituter], summary: md_transform.TransformSummary
+) -> Iterable[str]:
+    for i, rule in enumerate(rules):
+        matches = summary.sub_rule_matches.get(i, 0)
+        seconds = summary.sub_rule_seconds.get(i, 0.0)
+        yield f"{matches:8,} matches {seconds:9.3f}s: {rule.pattern_str}"
 
 
 def main(argv: list[str] = sys.argv[1:]):
+    if argv[:1] in (["serve"], ["client"]):
+        import files2md.cli.serve as serve
+
+        if argv[0] == "serve":
+            return serve.main_serve(argv[1:])
+        return serve.main_client(argv[1:])
+    if argv[:1] == ["batch"]:
+        import files2md.cli.batch as batch
+
+        return batch.main_batch(argv[1:])
     args = cli_args.parse(argv)
-    files, applied_patterns = collect_paths(args)
-    project_name = (
-        ", ".join(d.name for d in args.in_dirs) or "No directories specified."
-    )
+    if args.watch:
+        return main_watch(args)
+    profiler = profiling.Profiler() if args.profile else None
+    with profiling.maybe_stage(profiler, "collect_paths") as stage:
+        try:
+            files, applied_patterns, removed = collect_paths(args)
+        except ValueError as e:
+            # a git error, e.g. an unknown --changed-since revision
+            sys.exit(f"files2md: {e}")
+        stage.items = len(files)
+    project_name = make_project_name(args)
+
+    with contextlib.ExitStack() as stack:
+        cache = stack.enter_context(open_render_cache(args))
+        spill = stack.enter_context(open_summary_spill(args))
+        transform = main_file_output(
+            args, files, project_name, cache, profiler, spill, removed
+        )
+        report(args, files, applied_patterns, transform, profiler)
+    if profiler is not None:
+        assert args.profile is not None
+        profiler.write(args.profile)
 
-    if not args.split:
-        transform = main_singlefile_output(args, files, project_name)
-    else:
-        transform = main_splitfile_output(args, files, project_name)
 
-    output_file_size = args.out_file.stat().st_size
+def report(
+    args: cli_args.Args,
+    files: Sequence[Path],
+    applied_patterns: list[str],
+    transform: md_transform.MdWriter,
+    profiler: profiling.Profiler | None,
+):
+    output_files = transform.output_handler.get_filepaths()
+    output_file_size = sum(f.stat().st_size for f in output_files)
     with msg.VPrinter(args.verbosity) as vprint:
         summary = transform.summary
         vprint.section(2, "arguments", vars(args))
         vprint.section(3, "applied-patterns", applied_patterns)
         vprint.section(3, "file-count-by-suffix", summary.suffix_to_file_count)
+        vprint.section(
+            3, "file-count-by-encoding-tier", summary.encoding_tier_to_file_count
+        )
+        vprint.section(
+            3,
+            "substitution-rules",
+            sub_rule_stats(transform.mdfmt.compiled_sub_rules, summary),
+            "\n",
+        )
         vprint.section(4, "files", file_sizes_and_names(summary), "\n")
         vprint.section(
             1,
             "summary",
             {
                 "Number of files included": len(files),
+                **removed_summary(args, transform),
                 "Output file size": output_file_size,
-                "Output file": args.out_file,
+                "Output file": ", ".join(map(str, output_files)),
+                **cache_summary(args, summary),
+                **dedupe_summary(args, summary),
             },
         )
+        if profiler is not None:
+            vprint.section(
+                1,
+                "slowest-files",
+                slowest_files(profiler, args.profile_top),
+                "\n",
+            )
 
 
-def main_splitfile_output(args: cli_args.Args, files: list[Path], project_name: str):
-    initial_path = Path(args.out_file)
-    output_handler = md_transform.SplitFileOutputHandler(
-        initial_path=initial_path,
-        kb_per_file=args.split,
-        output_encoding=args.output_encoding,
-    )
-    transform = md_transform.MdWriter(
+def slowest_files(profiler: profiling.Profiler, n: int) -> Iterable[str]:
+    for stat in profiler.slowest_files(n):
+        yield (
+            f"{stat.wall_s * 1000:9.1f}ms wall {stat.cpu_s * 1000:9.1f}ms cpu "
+            f"{stat.nbytes:12,} bytes: {stat.pathname}"
+        )
+
+
+def main_watch(args: cli_args.Args):
+    import files2md.cli.watch as watch
+
+    project_name = make_project_name(args)
+    with open_render_cache(args) as cache:
+        watcher = watch.Watcher(
+            collect_files=lambda: collect_paths(args)[0],
+            writer_kwargs=lambda files: mdwriter_kwargs(
+                args, files, project_name, cache
+            ),
+            out_file=args.out_file,
+            split_bytes=args.split,
+            output_encoding=args.output_encoding,
+            render_cache=cache,
+            interval=args.watch_interval,
+            debounce=args.watch_debounce,
+            verbosity=args.verbosity,
+        )
+        watcher.run()
+
+
+def open_render_cache(
+    args: cli_args.Args,
+) -> contextlib.AbstractContextManager[render_cache.RenderCache | None]:
+    if not args.use_cache:
+        return contextlib.nullcontext()
+    return render_cache.RenderCache(args.cache_dir, max_bytes=args.cache_size)
+
+
+def open_summary_spill(
+    args: cli_args.Args,
+) -> contextlib.AbstractContextManager[compact.SummarySpill | None]:
+    if not args.compact:
+        return contextlib.nullcontext()
+    return compact.SummarySpill()
+
+
+def cache_summary(
+    args: cli_args.Args, summary: md_transform.TransformSummary
+) -> dict[str, Any]:
+    if not args.use_cache:
+        return {}
+    return {
+        "Render cache hits/misses": f"{summary.cache_hits}/{summary.cache_misses}",
+    }
+
+
+def dedupe_summary(
+    args: cli_args.Args, summary: md_transform.TransformSummary
+) -> dict[str, Any]:
+    if not args.dedupe:
+        return {}
+    return {
+        "Duplicate files": summary.duplicate_files,
+        "Bytes of duplicate content not written": summary.duplicate_bytes,
+    }
+
+
+def removed_summary(
+    args: cli_args.Args, transform: md_transform.MdWriter
+) -> dict[str, Any]:
+    if not args.list_removed:
+        return {}
+    return {"Deleted or renamed files listed": len(transform.removed_files)}
+
+
+def mdwriter_kwargs(
+    args: cli_args.Args,
+    files: Sequence[Path],
+    project_name: str,
+    cache: render_cache.RenderCache | render_cache.MemoryRenderCache | None,
+    profiler: profiling.Profiler | None = None,
+    spill: compact.SummarySpill | None = None,
+    removed: Sequence[md_transform.RemovedFile] = (),
+) -> dict[str, Any]:
+    return dict(
         project_name=project_name,
         in_dirs=args.in_dirs,
         files=files,
-        output=output_handler,
         max_lines_per_file=args.max_lines_per_file,
         include_empty=args.include_empty,
         mlpf_approx_pct=args.mlpf_approx_pct,
         sub_rules_file=args.sub_rules_file,
+        jobs=args.jobs,
+        executor=args.executor,
+        render_cache=cache,
+        profiler=profiler,
+        read_threads=args.read_threads,
+        read_ahead_bytes=args.read_ahead,
+        summary_spill=spill,
+        dedupe=args.dedupe,
+        removed_files=removed,
     )
-    transform.make_md()
-    return transform
 
 
-def main_singlefile_output(args: cli_args.Args, files: list[Path], project_name: str):
-    with open(args.out_file, "w", encoding=args.output_encoding) as ofh:
-        output_handler = md_transform.SingleFileOutputHandler(ofh)
+def open_output(args: cli_args.Args) -> md_transform.OutputHandler:
+    """The output file, or files with --split, of `args`."""
+    if args.split:
+        return md_transform.SplitFileOutputHandler(
+            initial_path=Path(args.out_file),
+            bytes_per_file=args.split,
+            output_encoding=args.output_encoding,
+        )
+    ofh = open(args.out_file, "w", encoding=args.output_encoding)
+    return md_transform.SingleFileOutputHandler(ofh)
+
+
+def main_file_output(
+    args: cli_args.Args,
+    files: Sequence[Path],
+    project_name: str,
+    cache: render_cache.RenderCache | None,
+    profiler: profiling.Profiler | None = None,
+    spill: compact.SummarySpill | None = None,
+    removed: Sequence[md_transform.RemovedFile] = (),
+    pool: "concurrent.futures.Executor | None" = None,
+) -> md_transform.MdWriter:
+    output_handler = open_output(args)
+    # completes (and closes) the output, also if MdWriter() fails
+    with contextlib.ExitStack() as stack:
+        stack.callback(output_handler.on_complete)
         transform = md_transform.MdWriter(
-            project_name=project_name,
-            in_dirs=args.in_dirs,
-            files=files,
+            **mdwriter_kwargs(
+                args, files, project_name, cache, profiler, spill, removed
+            ),
             output=output_handler,
-            max_lines_per_file=args.max_lines_per_file,
-            include_empty=args.include_empty,
-            mlpf_approx_pct=args.mlpf_approx_pct,
-            sub_rules_file=args.sub_rules_file,
+            pool=pool,
         )
         transform.make_md()
     return transform
@@ -1,22 +1,90 @@
+import concurrent.futures
+import os
+import re
 import subprocess
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Iterable
 
-from pathspec.util import StrPath
-
+StrPath = str | os.PathLike[str]
 StrPathIter = Iterable[StrPath]
 
-
-def rglob_abs(root: StrPath, pattern: str) -> list[Path]:
-    root = validate_dir_path(root)
-    return [root.joinpath(p) for p in root.rglob(pattern)]
+DEFAULT_GIT_JOBS = 8
+
+# One invocation lists cached, untracked and deleted files, each prefixed
+# with a status tag (see `git ls-files -t`).
+GIT_LSFILES_CMD = [
+    "git",
+    "ls-files",
+    "-z",
+    "-t",
+    "--exclude-standard",
+    "--cached",
+    "--others",
+    "--deleted",
+]
+# cached, unmerged, modified and untracked files exist in the work tree;
+# "S" (skip-worktree) entries do not, and "R" marks deleted files.
+LSFILES_PRESENT_TAGS = frozenset("HMC?")
+LSFILES_DELETED_TAG = "R"
+
+# Lists the paths changed between two trees, each preceded by its status
+# (see `git diff --name-status`); renames and copies have two paths, the
+# source and the destination.
+GIT_DIFF_CMD = ["git", "diff", "--name-status", "-z", "--find-renames"]
+DIFF_TWO_PATH_STATUSES = frozenset("RC")
+DIFF_DELETED_STATUS = "D"
+DIFF_RENAMED_STATUS = "R"
+
+RE_GITMODULES_PATH = re.compile(r"^\s*path\s*=\s*(.+?)\s*$", re.MULTILINE)
+
+
+class GitError(ValueError):
+    """A git command failed; the message is the repository and git's error."""
+
+
+@dataclass
+class GitListing:
+    # files of the repository that exist in the work tree
+    paths: list[Path] = field(default_factory=list)
+    # work trees of submodules and of untracked repositories nested within
+    nested_repos: list[Path] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class GitChange:
+    # first letter of the `git diff --name-status` status: A, C, D, M, R, T,
+    # U or X
+    status: str
+    # the changed file, or the destination of a rename or copy
+    path: Path
+    # the source of a rename or copy
+    old_path: Path | None = None
 
 
 def dir_find_dotgit_dirs(search_dir: StrPath) -> list[Path]:
+    """
+    Returns the git work trees at or beneath `search_dir`. Directories are
+    not descended into once they are found to be a work tree; repositories
+    nested within are reported by git_lsfiles_repo instead.
+    """
     search_dir = validate_dir_path(search_dir)
     dotgit_dirs: list[Path] = []
-    for dotgit_paths in rglob_abs(search_dir, ".git"):
-        dotgit_dirs.append(dotgit_paths.parent)
+    stack = [search_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as scan_iter:
+                entries = list(scan_iter)
+        except OSError:
+            continue
+        if any(entry.name == ".git" for entry in entries):
+            dotgit_dirs.append(current)
+            continue
+        subdirs = [
+            Path(entry.path) for entry in entries if entry.is_dir(follow_symlinks=False)
+        ]
+        stack.extend(sorted(subdirs, reverse=True))
     return dotgit_dirs
 
 
@@ -28,63 +96,133 @@ def dirs_find_dotgit_dirs(search_dirs: StrPathIter) -> list[Path]:
     return dotgit_dirs
 
 
-def git_lsfiles_dirs(dirs: StrPathIter) -> list[Path]:
+def git_lsfiles_dirs(dirs: StrPathIter, *, jobs: int = DEFAULT_GIT_JOBS) -> list[Path]:
+    """
+    Lists the files of all git work trees at or beneath `dirs`, including
+    submodules and nested untracked repositories. Each repository is
+    listed by one `git ls-files` process, and up to `jobs` of them run at
+    a time.
+    """
     dirs = validate_paths(dirs)
-    dotgit_dirs = dirs_find_dotgit_dirs(dirs)
-    all_results: list[Path] = []
-    for dotgit_dir in dotgit_dirs:
-        results = git_lsfiles_dir(dotgit_dir)
-        all_results.extend(results)
-    return all_results
+    repos = list(dict.fromkeys(dirs_find_dotgit_dirs(dirs)))
+    seen = set(repos)
+    all_results: set[Path] = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {executor.submit(git_lsfiles_repo, repo) for repo in repos}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                listing = future.result()
+                all_results.update(listing.paths)
+                for nested in listing.nested_repos:
+                    if nested not in seen:
+                        seen.add(nested)
+                        pending.add(executor.submit(git_lsfiles_repo, nested))
+    return sorted(all_results)
 
 
 def git_lsfiles_dir(root: StrPath) -> list[Path]:
-    validate_dir_path(root)
-
-    cached_paths = paths_from_git_cmd(
-        [
-            "git",
-            "ls-files",
-            "--exclude-standard",
-            "--no-recurse-submodules",
-            "--cached",
-        ],
-        root,
-    )
+    return git_lsfiles_repo(root).paths
 
-    unversioned_paths = paths_from_git_cmd(
-        [
-            "git",
-            "ls-files",
-            "--exclude-standard",
-            "--others",
-        ],
-        root,
-    )
 
-    deleted_paths = paths_from_git_cmd(
-        [
-            "git",
-            "ls-files",
-            "--exclude-standard",
-            "--deleted",
-        ],
-        root,
+def git_lsfiles_repo(root: StrPath) -> GitListing:
+    root = validate_dir_path(root)
+    submodules = gitmodules_paths(root)
+    present: set[str] = set()
+    deleted: set[str] = set()
+    nested_repos: list[Path] = []
+    for tag, path in lsfiles_entries(GIT_LSFILES_CMD, root):
+        if tag == LSFILES_DELETED_TAG:
+            deleted.add(path)
+        elif tag not in LSFILES_PRESENT_TAGS:
+            continue
+        elif path.endswith("/") or path in submodules:
+            # git does not list the files of nested repositories
+            nested = root.joinpath(path)
+            if nested.joinpath(".git").exists():
+                nested_repos.append(nested)
+        else:
+            present.add(path)
+    existing_paths = sorted(present - deleted)
+    return GitListing(
+        paths=[root.joinpath(path) for path in existing_paths],
+        nested_repos=nested_repos,
     )
 
-    existing_paths = (cached_paths | unversioned_paths) - deleted_paths
 
-    return list(sorted(existing_paths))
+def git_diff_dirs(
+    dirs: StrPathIter,
+    *,
+    rev: str | None = None,
+    staged: bool = False,
+    jobs: int = DEFAULT_GIT_JOBS,
+) -> list[GitChange]:
+    """
+    Lists the files changed in the git work trees at or beneath `dirs`: in
+    the work tree since `rev`, or if `staged`, in the index since `rev`
+    (default HEAD). `rev` may also be a range such as "main...HEAD", which
+    compares two commits. Each repository runs one `git diff` process, so
+    the time taken follows the size of the diff rather than of the tree.
+    Nested repositories and untracked files are not listed.
+    """
+    dirs = validate_paths(dirs)
+    repos = list(dict.fromkeys(dirs_find_dotgit_dirs(dirs)))
+    cmd = [*GIT_DIFF_CMD, *(["--cached"] if staged else []), *([rev] if rev else [])]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        listings = executor.map(lambda repo: git_diff_repo(repo, cmd), repos)
+        changes = [change for listing in listings for change in listing]
+    return sorted(changes, key=lambda change: change.path)
 
 
-def paths_from_git_cmd(cmd: list[str], root: StrPath) -> set[Path]:
+def git_diff_repo(root: StrPath, cmd: list[str]) -> list[GitChange]:
     root = validate_dir_path(root)
-    file_paths: set[Path] = set()
-    output = subprocess.run(cmd, text=True, check=True, capture_output=True, cwd=root)
-    for line in output.stdout.splitlines():
-        qualified_path = root.joinpath(line)
-        file_paths.add(qualified_path)
-    return file_paths
+    output = run_git([*cmd, "--"], root)
+    fields = iter(output.stdout.split(b"\0"))
+    changes: list[GitChange] = []
+    for status_field in fields:
+        if not status_field:
+            continue
+        # "R100" etc. carry the similarity of a rename or copy
+        status = os.fsdecode(status_field[:1])
+        path = root.joinpath(os.fsdecode(next(fields)))
+        if status in DIFF_TWO_PATH_STATUSES:
+            new_path = root.joinpath(os.fsdecode(next(fields)))
+            changes.append(GitChange(status, new_path, old_path=path))
+        else:
+            changes.append(GitChange(status, path))
+    return changes
+
+
+def lsfiles_entries(cmd: list[str], root: StrPath) -> Iterable[tuple[str, str]]:
+    """
+    Runs `git ls-files -z -t ...` and yields (tag, path) for each entry.
+    Paths are decoded like os.fsdecode, so that paths which are not valid
+    UTF-8 still name the right file.
+    """
+    output = run_git(cmd, root)
+    for record in output.stdout.split(b"\0"):
+        if not record:
+            continue
+        tag, _, path = record.partition(b" ")
+        yield os.fsdecode(tag), os.fsdecode(path)
+
+
+def run_git(cmd: list[str], root: StrPath) -> subprocess.CompletedProcess[bytes]:
+    try:
+        return subprocess.run(cmd, check=True, capture_output=True, cwd=root)
+    except subprocess.CalledProcessError as e:
+        message = e.stderr.decode("utf-8", "replace").strip()
+        raise GitError(f"{root}: {message or e}") from e
+
+
+def gitmodules_paths(root: Path) -> set[str]:
+    try:
+        text = root.joinpath(".gitmodules").read_text(encoding="utf-8")
+    except (OSError, UnicodeDecodeError):
+        return set()
+    return {match.strip('"') for match in RE_GITMODULES_PATH.findall(text)}
 
 
 def validate_paths(paths: StrPathIter) -> list[Path]:
@@ -0,0 +1,372 @@
+"""
+`files2md serve --socket PATH` keeps a process running on a Unix socket
+that renders for `files2md client --socket PATH [files2md options]`. The
+client takes the options of `files2md` and writes the same output, so the
+server's warm state is reused across runs:
+
+- sections rendered before, in a render_cache.MemoryRenderCache that is
+  checked against each file's stat (so charset detection and decoding
+  are skipped for unchanged files),
+- compiled patterns (cli_impl.compile_patterns),
+- file classification by suffix (fileinfo.classify_file),
+- the worker pool (--jobs), started before the server's threads, which
+  requests with --jobs other than 1 render on,
+- the imports and the interpreter itself.
+
+The tree is still walked (or listed by git) on every request.
+
+Protocol: the client sends one request per connection, a JSON object on
+one line with the REQUEST_OPTIONS of its parsed arguments. The server
+answers with frames of a kind byte and a 4-byte big-endian length: the
+output text (FRAME_TEXT), the ends of the header and of each section,
+which the client passes on to its own OutputHandler so that output is
+split as by `files2md`, and finally FRAME_DONE with the summary as JSON,
+or FRAME_ERROR with a message.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, BinaryIO, Iterator, override
+
+from files2md import md_transform, render_cache
+from files2md.cli import cli_args, cli_impl, msg
+from files2md.cli.humansize import humansize_to_size
+
+if TYPE_CHECKING:
+    import concurrent.futures
+
+FRAME_HEAD = struct.Struct(">cI")
+FRAME_TEXT = b"T"
+FRAME_HEADER_END = b"H"
+FRAME_SECTION_END = b"S"
+FRAME_DONE = b"D"
+FRAME_ERROR = b"E"
+# output text is sent as UTF-8; lone surrogates (from undecodable file
+# names) are kept so that the client encodes them as `files2md` would
+TEXT_ERRORS = "surrogatepass"
+
+# cli_args.Args attributes that a render request carries; the rest are the
+# client's (output, verbosity) or not supported (--watch, --profile)
+REQUEST_OPTIONS = (
+    "in_dirs",
+    "glob_patterns",
+    "exclude_patterns",
+    "use_default_patterns",
+    "git_ls_files",
+    "changed_since",
+    "staged",
+    "list_removed",
+    "max_lines_per_file",
+    "mlpf_approx_pct",
+    "include_empty",
+    "sub_rules_file",
+    "jobs",
+    "executor",
+    "walk_threads",
+    "read_threads",
+    "read_ahead",
+    "dedupe",
+)
+
+
+def write_frame(wfile: BinaryIO, kind: bytes, payload: bytes = b""):
+    wfile.write(FRAME_HEAD.pack(kind, len(payload)))
+    wfile.write(payload)
+
+
+def iter_frames(rfile: BinaryIO) -> Iterator[tuple[bytes, bytes]]:
+    """The (kind, payload) of each frame, until the connection is closed."""
+    while len(head := rfile.read(FRAME_HEAD.size)) == FRAME_HEAD.size:
+        kind, length = FRAME_HEAD.unpack(head)
+        payload = rfile.read(length)
+        if len(payload) < length:
+            return
+        yield kind, payload
+
+
+class FrameOutputHandler(md_transform.OutputHandler):
+    """Sends the output to a client as frames."""
+
+    def __init__(self, wfile: BinaryIO, output_ids: set[md_transform.FileId]):
+        self.wfile = wfile
+        # the client's output files, which are not rendered
+        self.output_ids = output_ids
+
+    @override
+    def write(self, s: str):
+        if s:
+            write_frame(self.wfile, FRAME_TEXT, s.encode("utf-8", TEXT_ERRORS))
+
+    @override
+    def on_after_md_header(self):
+        write_frame(self.wfile, FRAME_HEADER_END)
+
+    @override
+    def on_after_md_section(self):
+        write_frame(self.wfile, FRAME_SECTION_END)
+
+    @override
+    def on_complete(self):
+        self.wfile.flush()
+
+    @override
+    def get_filepaths(self) -> list[Path]:
+        return []
+
+    @override
+    def get_file_ids(self) -> set[md_transform.FileId]:
+        return self.output_ids
+
+
+def request_args(request: dict[str, Any]) -> cli_args.Args:
+    """The cli_args.Args of a request, with the defaults of `files2md` otherwise."""
+    args = cli_args.default_args()
+    for name in REQUEST_OPTIONS:
+        setattr(args, name, request[name])
+    args.in_dirs = [Path(d) for d in request["in_dirs"]]
+    return args
+
+
+def render(
+    args: cli_args.Args,
+    output: md_transform.OutputHandler,
+    cache: render_cache.MemoryRenderCache,
+    pool: "concurrent.futures.Executor | None" = None,
+) -> dict[str, Any]:
+    """
+    Renders a request. With jobs other than 1, files are rendered on `pool`,
+    or, if the server has none, on a thread pool of the request's own: the
+    server runs requests in threads, and forking worker processes from a
+    multi-threaded process may deadlock them (see md_transform.make_shared_pool).
+    """
+    if args.jobs == 1:
+        pool = None
+    elif pool is None:
+        args.executor = md_transform.EXECUTOR_THREAD
+    files, _, removed = cli_impl.collect_paths(args)
+    writer = md_transform.MdWriter(
+        **cli_impl.mdwriter_kwargs(
+            args, files, cli_impl.make_project_name(args), cache, removed=removed
+        ),
+        output=output,
+        pool=pool,
+    )
+    with writer:
+        writer.make_md()
+    summary = writer.summary
+    return {
+        "files": len(files),
+        "removed": len(removed),
+        "cache_hits": summary.cache_hits,
+        "cache_misses": summary.cache_misses,
+        "duplicate_files": summary.duplicate_files,
+        "duplicate_bytes": summary.duplicate_bytes,
+    }
+
+
+class RenderRequestHandler(socketserver.StreamRequestHandler):
+    server: "RenderServer"
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            args = request_args(request)
+            output_ids = {tuple(file_id) for file_id in request["output_ids"]}
+            output = FrameOutputHandler(self.wfile, output_ids)  # type: ignore
+            summary = render(args, output, self.server.render_cache, self.server.pool)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        except Exception as e:
+            message = f"{type(e).__name__}: {e}"
+            write_frame(self.wfile, FRAME_ERROR, message.encode("utf-8", "replace"))
+            return
+        write_frame(self.wfile, FRAME_DONE, json.dumps(summary).encode("utf-8"))
+
+
+class RenderServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: Path,
+        *,
+        cache_max_bytes: int,
+        pool: "concurrent.futures.Executor | None" = None,
+    ):
+        self.render_cache = render_cache.MemoryRenderCache(max_bytes=cache_max_bytes)
+        # shared by the requests, and shut down by the caller
+        self.pool = pool
+        super().__init__(str(socket_path), RenderRequestHandler)
+
+
+def remove_stale_socket(socket_path: Path):
+    """
+    Removes the socket file of a server that is no longer running, and
+    fails if one is.
+    """
+    if not socket_path.exists():
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except ConnectionRefusedError:
+            socket_path.unlink()
+            return
+    raise SystemExit(f"files2md serve: already serving on {socket_path}")
+
+
+def main_serve(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="files2md serve",
+        description="Render for `files2md client` on a Unix socket, with warm caches.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--socket", type=Path, required=True, metavar="PATH")
+    parser.add_argument(
+        "--cache-size",
+        type=humansize_to_size,
+        default=render_cache.DEFAULT_CACHE_MAX_BYTES,
+        metavar="SIZE",
+        help="Keep rendered sections in memory up to SIZE (e.g. 256MiB).",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Workers that requests with --jobs other than 1 share. 0 = one per CPU.",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=md_transform.EXECUTORS,
+        default=md_transform.EXECUTOR_PROCESS,
+        help="Worker pool shared by the requests.",
+    )
+    args = parser.parse_args(argv)
+    socket_path: Path = args.socket.absolute()
+    remove_stale_socket(socket_path)
+    # exit through the finally below, which removes the socket file
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    workers = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    with contextlib.ExitStack() as stack:
+        pool = None
+        if workers > 1:
+            # before serve_forever() starts any thread, see make_shared_pool
+            pool = stack.enter_context(
+                md_transform.make_shared_pool(workers, args.executor)
+            )
+        run_server(socket_path, cache_max_bytes=args.cache_size, pool=pool)
+
+
+def run_server(
+    socket_path: Path,
+    *,
+    cache_max_bytes: int,
+    pool: "concurrent.futures.Executor | None",
+):
+    with RenderServer(
+        socket_path, cache_max_bytes=cache_max_bytes, pool=pool
+    ) as server:
+        print(f"files2md serve: listening on {socket_path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            socket_path.unlink(missing_ok=True)
+
+
+def request_json(args: cli_args.Args, output: md_transform.OutputHandler) -> bytes:
+    request: dict[str, Any] = {name: getattr(args, name) for name in REQUEST_OPTIONS}
+    request["in_dirs"] = [str(d) for d in args.in_dirs]
+    if args.sub_rules_file:
+        request["sub_rules_file"] = str(Path(args.sub_rules_file).absolute())
+    request["output_ids"] = sorted(output.get_file_ids())
+    return json.dumps(request).encode("utf-8") + b"\n"
+
+
+def receive_output(
+    rfile: BinaryIO, output: md_transform.OutputHandler
+) -> dict[str, Any]:
+    """Passes the output frames on to `output`, and returns the summary."""
+    for kind, payload in iter_frames(rfile):
+        if kind == FRAME_TEXT:
+            output.write(payload.decode("utf-8", TEXT_ERRORS))
+        elif kind == FRAME_HEADER_END:
+            output.on_after_md_header()
+        elif kind == FRAME_SECTION_END:
+            output.on_after_md_section()
+        elif kind == FRAME_DONE:
+            return json.loads(payload)
+        elif kind == FRAME_ERROR:
+            raise RuntimeError(payload.decode("utf-8"))
+    raise ConnectionError("connection closed before the end of the output")
+
+
+def main_client(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="files2md client",
+        description="Run `files2md [options]` in a `files2md serve` process.",
+        add_help=False,
+    )
+    parser.add_argument("--socket", type=Path, required=True, metavar="PATH")
+    client_args, argv = parser.parse_known_args(argv)
+    args = cli_args.parse(argv)
+    if args.watch or args.profile:
+        sys.exit("files2md client: --watch and --profile need a local files2md run")
+    with contextlib.ExitStack() as stack:
+        sock = stack.enter_context(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM))
+        try:
+            sock.connect(str(client_args.socket))
+        except (FileNotFoundError, ConnectionRefusedError):
+            sys.exit(
+                f"files2md client: no server on {client_args.socket}; "
+                f"start one with `files2md serve --socket {client_args.socket}`"
+            )
+        output = cli_impl.open_output(args)
+        stack.callback(output.on_complete)
+        sock.sendall(request_json(args, output))
+        try:
+            result = receive_output(sock.makefile("rb"), output)
+        except (RuntimeError, ConnectionError) as e:
+            sys.exit(f"files2md client: {e}")
+    report(args, output, result)
+
+
+def report(
+    args: cli_args.Args, output: md_transform.OutputHandler, result: dict[str, Any]
+):
+    output_files = output.get_filepaths()
+    summary = md_transform.TransformSummary(
+        cache_hits=result["cache_hits"],
+        cache_misses=result["cache_misses"],
+        duplicate_files=result["duplicate_files"],
+        duplicate_bytes=result["duplicate_bytes"],
+    )
+    with msg.VPrinter(args.verbosity) as vprint:
+        vprint.section(2, "arguments", vars(args))
+        vprint.section(
+            1,
+            "summary",
+            {
+                "Number of files included": result["files"],
+                **(
+                    {"Deleted or renamed files listed": result["removed"]}
+                    if args.list_removed
+                    else {}
+                ),
+                "Output file size": sum(f.stat().st_size for f in output_files),
+                "Output file": ", ".join(map(str, output_files)),
+                "Render cache hits/misses": f"{summary.cache_hits}/{summary.cache_misses}",
+                **cli_impl.dedupe_summary(args, summary),
+            },
+        )
@@ -0,0 +1,207 @@
+import concurrent.futures
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator
+
+import pathspec
+import pathspec.util
+from pathspec.patterns.gitwildmatch import GitWildMatchPattern
+
+GLOB_CHARS = frozenset("*?[\\")
+
+
+@dataclass(frozen=True)
+class WalkedFile:
+    # absolute path of the file
+    path: Path
+    # path relative to the walked root, with "/" separators
+    rel: str
+    # stat of the file, following symlinks
+    stat: os.stat_result
+
+
+@dataclass(frozen=True)
+class _DirEntry:
+    name: str
+    rel: str
+    stat: os.stat_result | None
+    # real path of the directory, or "" for files
+    real: str = ""
+
+
+class TreePruner:
+    """
+    Decides whether a directory can be skipped because no file beneath it
+    can be selected by the spec.
+
+    Patterns are "last match wins". A file beneath directory D can only be
+    selected by an include pattern that may match beneath D. So D is pruned
+    if, going from the last pattern backwards, an exclude pattern covering
+    all of D is reached before any include pattern that may match beneath
+    D, or if there is no such include pattern at all. When in doubt, a
+    pattern is assumed to match, so pruning never changes the selection.
+    """
+
+    def __init__(self, spec: pathspec.PathSpec):
+        self.patterns: list[tuple[GitWildMatchPattern, list[str] | None]] = []
+        for pattern in spec.patterns:
+            if pattern.include is None:
+                continue
+            assert isinstance(pattern, GitWildMatchPattern)
+            self.patterns.append((pattern, anchored_literal_prefix(pattern)))
+        self.patterns.reverse()
+
+    def can_prune(self, dir_rel: str) -> bool:
+        dir_parts = dir_rel.split("/")
+        for pattern, literal_prefix in self.patterns:
+            if pattern.include:
+                if may_match_beneath(literal_prefix, dir_parts):
+                    return False
+            elif covers_dir(pattern, dir_rel):
+                return True
+        return True
+
+
+def anchored_literal_prefix(pattern: GitWildMatchPattern) -> list[str] | None:
+    """
+    For a pattern anchored to the root, such as "/dist/" or "docs/*.md",
+    returns its leading path segments that contain no wildcards. Returns
+    None for patterns that may match at any depth.
+    """
+    text = pattern.pattern
+    if not isinstance(text, str) or "\\" in text:
+        return None
+    text = text.strip()
+    if text.startswith("!"):
+        text = text[1:]
+    body = text.rstrip("/")
+    if body.startswith("**/") or "/" not in body:
+        return None
+    prefix = []
+    for segment in body.lstrip("/").split("/"):
+        if GLOB_CHARS.intersection(segment):
+            break
+        prefix.append(segment)
+    return prefix
+
+
+def may_match_beneath(literal_prefix: list[str] | None, dir_parts: list[str]) -> bool:
+    if literal_prefix is None:
+        return True
+    return all(a == b for a, b in zip(literal_prefix, dir_parts))
+
+
+def covers_dir(pattern: GitWildMatchPattern, dir_rel: str) -> bool:
+    assert pattern.regex is not None
+    match = pattern.regex.match(dir_rel + "/")
+    # A match through the directory group also matches everything beneath.
+    return match is not None and match.groupdict().get("ps_d") is not None
+
+
+def walk_tree(
+    root: Path,
+    spec: pathspec.PathSpec,
+    *,
+    prune: bool = True,
+    threads: int = 0,
+) -> list[WalkedFile]:
+    """
+    Returns the files beneath `root` that `spec` matches, in the same order
+    as `spec.match_tree(root)`, along with their stat data.
+
+    Directories are scanned with os.scandir, and those that cannot contain
+    a matching file (see TreePruner) are not descended into. With threads >
+    0, directories are scanned concurrently by a thread pool, which helps
+    on high-latency filesystems; the result is the same.
+    """
+    return list(iter_walk_tree(root, spec, prune=prune, threads=threads))
+
+
+def iter_walk_tree(
+    root: Path,
+    spec: pathspec.PathSpec,
+    *,
+    prune: bool = True,
+    threads: int = 0,
+) -> Iterator[WalkedFile]:
+    """walk_tree(), yielding each file as soon as it is found."""
+    root = Path(os.path.abspath(root))
+    pruner = TreePruner(spec) if prune else None
+
+    def scan(dir_rel: str, dir_real: str) -> list[_DirEntry]:
+        entries = []
+        with os.scandir(root.joinpath(dir_rel)) as scan_iter:
+            for entry in scan_iter:
+                rel = f"{dir_rel}/{entry.name}" if dir_rel else entry.name
+                if entry.is_dir():
+                    if pruner is not None and pruner.can_prune(rel):
+                        continue
+                    if entry.is_symlink():
+                        real = os.path.realpath(entry.path)
+                    else:
+                        real = os.path.join(dir_real, entry.name)
+                    entries.append(_DirEntry(entry.name, rel, None, real))
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    # e.g. a broken symlink, which pathspec skips as well
+                    continue
+                if entry.is_file() or entry.is_symlink():
+                    entries.append(_DirEntry(entry.name, rel, st))
+        return entries
+
+    def assemble(
+        dir_rel: str,
+        dir_real: str,
+        ancestors: dict[str, str],
+        get_scan: Callable[[str, str], list[_DirEntry]],
+    ) -> Iterator[WalkedFile]:
+        # the same recursion check as pathspec.util.iter_tree_entries
+        if dir_real in ancestors:
+            raise pathspec.util.RecursionError(
+                real_path=dir_real,
+                first_path=ancestors[dir_real],
+                second_path=dir_rel,
+            )
+        ancestors = {**ancestors, dir_real: dir_rel}
+        for entry in get_scan(dir_rel, dir_real):
+            if entry.real:
+                yield from assemble(entry.rel, entry.real, ancestors, get_scan)
+            elif spec.match_file(entry.rel):
+                assert entry.stat is not None
+                yield WalkedFile(
+                    path=root.joinpath(entry.rel), rel=entry.rel, stat=entry.stat
+                )
+
+    root_real = os.path.realpath(root)
+    if threads <= 0:
+        yield from assemble("", root_real, {}, scan)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        futures: dict[str, concurrent.futures.Future[list[_DirEntry]]] = {}
+
+        def scan_ahead(
+            dir_rel: str, dir_real: str, ancestor_reals: frozenset[str]
+        ) -> list[_DirEntry]:
+            entries = scan(dir_rel, dir_real)
+            ancestor_reals = ancestor_reals | {dir_real}
+            for entry in entries:
+                # assemble() raises on the loop before it needs this scan
+                if entry.real and entry.real not in ancestor_reals:
+                    futures[entry.rel] = executor.submit(
+                        scan_ahead, entry.rel, entry.real, ancestor_reals
+                    )
+            return entries
+
+        def get_scan(dir_rel: str, _dir_real: str) -> list[_DirEntry]:
+            return futures[dir_rel].result()
+
+        futures[""] = executor.submit(scan_ahead, "", root_real, frozenset())
+        try:
+            yield from assemble("", root_real, {}, get_scan)
+        finally:
+            for future in list(futures.values()):
+                future.cancel()
@@ -0,0 +1,238 @@
+import functools
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator, Sequence, override
+
+from files2md import md_transform
+from files2md.cli import msg
+from files2md.render_cache import RenderCache
+
+DEFAULT_POLL_INTERVAL_S = 1.0
+DEFAULT_DEBOUNCE_S = 0.3
+
+# (st_mtime_ns, st_size, st_ino) of a file; a section is re-rendered when
+# this changes
+FileState = tuple[int, int, int]
+
+
+def snapshot(files: list[Path]) -> dict[Path, FileState]:
+    states: dict[Path, FileState] = {}
+    for file in files:
+        try:
+            st = os.stat(file)
+        except OSError:
+            continue
+        states[file] = (st.st_mtime_ns, st.st_size, st.st_ino)
+    return states
+
+
+class IncrementalMdWriter(md_transform.MdWriter):
+    """
+    An MdWriter that re-renders only the files whose FileState differs from
+    the one their section in `rendered` was made from. `rendered` is
+    updated in place, so it can be handed to the writer of the next build.
+    """
+
+    def __init__(
+        self,
+        *,
+        states: dict[Path, FileState],
+        rendered: dict[Path, tuple[FileState, md_transform.RenderedFile]],
+        **kwargs: Any,
+    ):
+        super().__init__(**kwargs)
+        self.states = states
+        self.rendered = rendered
+        self.rerendered_count = 0
+
+    @override
+    def iter_renderers(
+        self, files: Sequence[Path], describe: Callable[[Path], str]
+    ) -> Iterator[tuple[Path, Callable[[], md_transform.RenderedFile]]]:
+        stale = [file for file in files if not self.is_fresh(file)]
+        stale_set = set(stale)
+        rendered_stale = super().iter_renderers(stale, describe)
+        for file in files:
+            if file in stale_set:
+                _, get_rendered = next(rendered_stale)
+                yield file, functools.partial(self.remember, file, get_rendered)
+            else:
+                yield file, functools.partial(self.recall, file)
+
+    @override
+    def renderer_copies(self) -> dict[str, str] | None:
+        # sections are kept for later builds, so they must show the content
+        return None
+
+    def is_fresh(self, file: Path) -> bool:
+        entry = self.rendered.get(file)
+        return entry is not None and entry[0] == self.states.get(file)
+
+    def recall(self, file: Path) -> md_transform.RenderedFile:
+        return self.rendered[file][1]
+
+    def remember(
+        self, file: Path, get_rendered: Callable[[], md_transform.RenderedFile]
+    ) -> md_transform.RenderedFile:
+        rendered = get_rendered()
+        self.rerendered_count += 1
+        if file in self.states:
+            self.rendered[file] = (self.states[file], rendered)
+        return rendered
+
+
+class Watcher:
+    """
+    Keeps the output up to date with the input directories.
+
+    The files are polled every `interval` seconds (list them with
+    `collect_files`, then stat them). Once a change is seen, polling
+    continues every `debounce` seconds until a poll sees no further
+    change, so that a burst of saves leads to a single build.
+
+    Each build re-renders only the changed files (see IncrementalMdWriter)
+    and writes the output into a temporary directory next to `out_file`.
+    Output files whose content changed are then moved into place with
+    os.replace(), so readers never see a partly written file; unchanged
+    split files are left alone, and split files no longer produced are
+    removed.
+    """
+
+    def __init__(
+        self,
+        *,
+        collect_files: Callable[[], list[Path]],
+        writer_kwargs: Callable[[list[Path]], dict[str, Any]],
+        out_file: Path,
+        split_bytes: int = 0,
+        output_encoding: str = "utf-8",
+        render_cache: RenderCache | None = None,
+        interval: float = DEFAULT_POLL_INTERVAL_S,
+        debounce: float = DEFAULT_DEBOUNCE_S,
+        verbosity: int = 1,
+    ):
+        self.collect_files = collect_files
+        self.writer_kwargs = writer_kwargs
+        self.out_file = out_file
+        self.split_bytes = split_bytes
+        self.output_encoding = output_encoding
+        self.render_cache = render_cache
+        self.interval = interval
+        self.debounce = debounce
+        self.vprint = msg.VPrinter(verbosity)
+        # output files written by the last build
+        self.published: list[Path] = []
+        self.states: dict[Path, FileState] = {}
+        self.rendered: dict[Path, tuple[FileState, md_transform.RenderedFile]] = {}
+
+    def run(self):
+        try:
+            states = self.poll()
+            while True:
+                failed = self.try_build(states)
+                states = self.wait_for_change(since=failed)
+        except KeyboardInterrupt:
+            pass
+
+    def try_build(self, states: dict[Path, FileState]) -> dict[Path, FileState] | None:
+        """
+        Builds from `states`. If a file cannot be read (e.g. it was removed
+        after the poll), the error is reported, the published output and
+        self.states are left as they were, and `states` is returned, so
+        that the next change of the files leads to another build.
+        """
+        try:
+            self.build(states)
+        except OSError as e:
+            self.vprint.print_fn(
+                0, f"[{time.strftime('%H:%M:%S')}] {self.out_file.name}: {e}"
+            )
+            return states
+        return None
+
+    def poll(self) -> dict[Path, FileState]:
+        outputs = {self.out_file, *self.published}
+        return snapshot([f for f in self.collect_files() if f not in outputs])
+
+    def wait_for_change(
+        self, since: dict[Path, FileState] | None = None
+    ) -> dict[Path, FileState]:
+        """
+        Waits until the files differ from `since` (by default, from the
+        last build) and stop changing.
+        """
+        if since is None:
+            since = self.states
+        states = self.poll()
+        while states == since:
+            time.sleep(self.interval)
+            states = self.poll()
+        while True:
+            time.sleep(self.debounce)
+            settled = self.poll()
+            if settled == states:
+                return states
+            states = settled
+
+    def build(self, states: dict[Path, FileState]) -> IncrementalMdWriter:
+        started = time.perf_counter()
+        files = list(states)
+        self.rendered = {f: r for f, r in self.rendered.items() if f in states}
+        out_dir = self.out_file.parent
+        import tempfile
+
+        with tempfile.TemporaryDirectory(dir=out_dir, prefix=".files2md-") as tmp:
+            staged_file = Path(tmp, self.out_file.name)
+            writer = IncrementalMdWriter(
+                **self.writer_kwargs(files),
+                output=self.make_output_handler(staged_file),
+                states=states,
+                rendered=self.rendered,
+            )
+            with writer:
+                writer.make_md()
+            staged = writer.output_handler.get_filepaths()
+            replaced = self.publish(staged, out_dir)
+        if self.render_cache is not None:
+            self.render_cache.flush()
+        self.states = states
+        elapsed = time.perf_counter() - started
+        self.vprint.print_fn(
+            1,
+            f"[{time.strftime('%H:%M:%S')}] {self.out_file.name}: "
+            f"{writer.rerendered_count} of {len(files)} sections rendered, "
+            f"{replaced} of {len(staged)} output files replaced ({elapsed:.2f}s)",
+        )
+        return writer
+
+    def make_output_handler(self, staged_file: Path) -> md_transform.OutputHandler:
+        if self.split_bytes:
+            return md_transform.SplitFileOutputHandler(
+                initial_path=staged_file,
+                bytes_per_file=self.split_bytes,
+                output_encoding=self.output_encoding,
+            )
+        ofh = open(staged_file, "w", encoding=self.output_encoding)
+        return md_transform.SingleFileOutputHandler(ofh)
+
+    def publish(self, staged: list[Path], out_dir: Path) -> int:
+        """
+        Moves the staged output files whose content differs from the
+        published ones into `out_dir`, and removes published files of the
+        previous build that were not produced again. Returns the number of
+        files moved.
+        """
+        import filecmp
+
+        published = [out_dir / path.name for path in staged]
+        replaced = 0
+        for src, dst in zip(staged, published):
+            if dst.is_file() and filecmp.cmp(src, dst, shallow=False):
+                continue
+            os.replace(src, dst)
+            replaced += 1
+        for stale in set(self.published) - set(published):
+            stale.unlink(missing_ok=True)
+        self.published = published
+        return replaced
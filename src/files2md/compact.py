@@ -0,0 +1,246 @@
+import array
+import contextlib
+import itertools
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, Sequence, overload
+
+# rows buffered by SummarySpill.add() before they are inserted
+SPILL_BATCH_ROWS = 10_000
+
+
+def root_prefix(root: Path) -> str:
+    """
+    The string that the str() of every path beneath `root` starts with:
+    str(root) followed by a separator, or "" for the current directory.
+    """
+    s = str(root)
+    if s == ".":
+        return ""
+    return s if s.endswith(os.sep) else s + os.sep
+
+
+class PathDescriber:
+    """
+    Describes a path as "<base name>/<path relative to base>" for the first
+    of `bases` the path is beneath, or as the path itself if it is beneath
+    none of them. Each base is tested with a single prefix comparison of
+    the path's string, so no parents or relative paths are built.
+    """
+
+    def __init__(self, bases: Iterable[Path]):
+        # (prefix, description prefix) of each base
+        self.prefixes = [(root_prefix(base), f"{base.name}/") for base in bases]
+
+    def __call__(self, path: Path) -> str:
+        s = str(path)
+        for prefix, desc_prefix in self.prefixes:
+            if s.startswith(prefix) and (prefix or not os.path.isabs(s)):
+                return desc_prefix + s[len(prefix) :].replace(os.sep, "/")
+        return path.as_posix()
+
+
+class PathTable(Sequence[Path]):
+    """
+    A list of paths beneath a few roots, stored in array-backed columns: the
+    root of each path as an index into `roots`, and its path relative to
+    the root as file system bytes (see os.fsencode) in one shared buffer.
+    A path takes its length plus 12 bytes, where a list of Path objects
+    takes several hundred; Path objects are made only when an item is
+    accessed.
+    """
+
+    def __init__(self, roots: Iterable[Path] = ()):
+        self.roots: list[Path] = []
+        self.root_prefixes: list[str] = []
+        # index into roots of each path
+        self.root_ids = array.array("I")
+        # end offset in data of each relative path
+        self.ends = array.array("Q")
+        self.data = bytearray()
+        for root in roots:
+            self.add_root(root)
+
+    @classmethod
+    def from_paths(cls, paths: Iterable[Path], roots: Iterable[Path]) -> "PathTable":
+        """
+        A table of `paths`, each stored relative to the first of `roots`
+        it is beneath, or else to its anchor.
+        """
+        table = cls(roots)
+        for path in paths:
+            table.append(path)
+        return table
+
+    def add_root(self, root: Path) -> int:
+        self.roots.append(root)
+        self.root_prefixes.append(root_prefix(root))
+        return len(self.roots) - 1
+
+    def append_rel(self, root_id: int, rel: str):
+        """Appends roots[root_id] joined with `rel`, a "/"-separated path."""
+        self.root_ids.append(root_id)
+        self.data += os.fsencode(rel)
+        self.ends.append(len(self.data))
+
+    def append(self, path: Path):
+        s = str(path)
+        for root_id, prefix in enumerate(self.root_prefixes):
+            if s.startswith(prefix) and (prefix or not os.path.isabs(s)):
+                return self.append_rel(root_id, s[len(prefix) :])
+        # a later path with the same anchor matches this root
+        root_id = self.add_root(Path(path.anchor))
+        self.append_rel(root_id, s[len(self.root_prefixes[root_id]) :])
+
+    def rel(self, index: int) -> str:
+        start = self.ends[index - 1] if index > 0 else 0
+        return os.fsdecode(bytes(self.data[start : self.ends[index]]))
+
+    def __len__(self) -> int:
+        return len(self.ends)
+
+    @overload
+    def __getitem__(self, index: int) -> Path: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Path]: ...
+
+    def __getitem__(self, index: int | slice) -> Path | list[Path]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("PathTable index out of range")
+        return self.roots[self.root_ids[index]].joinpath(self.rel(index))
+
+    def __iter__(self) -> Iterator[Path]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def sort_key(self, index: int) -> str:
+        """
+        The path's string with separators replaced by "\\0", which orders
+        like the path components compared by Path.__lt__.
+        """
+        s = self.root_prefixes[self.root_ids[index]] + self.rel(index)
+        return s.replace(os.sep, "\0")
+
+    def sorted(self) -> tuple["PathTable", set[Path]]:
+        """
+        A new table of the same paths in the order of sorted(self), and the
+        paths that it holds more than once.
+        """
+        keys = [self.sort_key(index) for index in range(len(self))]
+        table = PathTable(self.roots)
+        repeated: set[Path] = set()
+        previous = None
+        for index in sorted(range(len(self)), key=keys.__getitem__):
+            if keys[index] == previous:
+                repeated.add(self[index])
+            previous = keys[index]
+            table.append_rel(self.root_ids[index], self.rel(index))
+        return table, repeated
+
+
+def sort_paths(files: Sequence[Path]) -> tuple[Sequence[Path], set[Path]]:
+    """
+    sorted(files), without making Path objects of a PathTable's items, and
+    the paths that occur in `files` more than once.
+    """
+    if isinstance(files, PathTable):
+        return files.sorted()
+    sorted_files = sorted(files)
+    repeated = {a for a, b in itertools.pairwise(sorted_files) if a == b}
+    return sorted_files, repeated
+
+
+def iter_unique(files: Sequence[Path], repeated: set[Path]) -> Iterator[Path]:
+    """`files` without the repeats of the `repeated` paths, in order."""
+    if not repeated:
+        yield from files
+        return
+    seen: set[Path] = set()
+    for file in files:
+        if file in repeated:
+            if file in seen:
+                continue
+            seen.add(file)
+        yield file
+
+
+@dataclass(frozen=True)
+class FileRecord:
+    path: Path
+    char_count: int
+    truncated: bool
+    excluded: bool
+    # encoding_detect tier that decided the file's encoding, or ""
+    encoding_tier: str
+
+
+class SummarySpill(contextlib.AbstractContextManager):
+    """
+    Per-file summary records in a temporary SQLite database, which keeps
+    them on disk beyond a small page cache and is deleted on close(). Used
+    in place of the per-file fields of md_transform.TransformSummary on
+    runs over too many files to hold those in memory.
+    """
+
+    def __init__(self):
+        import sqlite3
+
+        # an empty name opens a private temporary on-disk database
+        self.db = sqlite3.connect("")
+        self.db.execute(
+            """
+            CREATE TABLE files (
+                path BLOB NOT NULL,
+                char_count INTEGER NOT NULL,
+                truncated INTEGER NOT NULL,
+                excluded INTEGER NOT NULL,
+                encoding_tier TEXT NOT NULL
+            )
+            """
+        )
+        self.pending: list[tuple[bytes, int, bool, bool, str]] = []
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, record: FileRecord):
+        self.pending.append(
+            (
+                os.fsencode(record.path),
+                record.char_count,
+                record.truncated,
+                record.excluded,
+                record.encoding_tier,
+            )
+        )
+        if len(self.pending) >= SPILL_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?)", self.pending
+            )
+        self.pending.clear()
+
+    def iter_by_char_count(self) -> Iterator[FileRecord]:
+        """The records by ascending char_count, in insertion order on ties."""
+        self.flush()
+        rows = self.db.execute("SELECT * FROM files ORDER BY char_count, rowid")
+        for path, char_count, truncated, excluded, encoding_tier in rows:
+            yield FileRecord(
+                Path(os.fsdecode(path)),
+                char_count,
+                bool(truncated),
+                bool(excluded),
+                encoding_tier,
+            )
+
+    def close(self):
+        self.db.close()
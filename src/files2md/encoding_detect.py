@@ -0,0 +1,97 @@
+import codecs
+import functools
+from types import ModuleType
+
+# The tier names double as keys of TransformSummary.encoding_tier_to_file_count
+TIER_BOM = "bom"
+TIER_BINARY = "nul-byte"
+TIER_ASCII = "ascii"
+TIER_UTF8 = "utf-8"
+TIER_CHARSET_NORMALIZER = "charset-normalizer"
+TIER_NO_DETECTOR = "no-detector"
+
+# Longest first: the UTF-32-LE BOM begins with the UTF-16-LE BOM. The UTF-8
+# BOM is decoded as "utf-8", so that it is kept in the output.
+BOM_TO_ENCODING = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+def detect_encoding(blob: bytes, *, complete: bool = True) -> tuple[str, str]:
+    """
+    Returns (encoding, tier) for the leading bytes of a file, where encoding
+    is "binary" for content that should not be decoded, and tier names the
+    check that decided. The checks run from cheapest to most expensive:
+
+    1. a UTF-8/16/32 byte order mark
+    2. a NUL byte, which text in any other supported encoding does not
+       contain; unless the NUL bytes could be those of UTF-16/32 text
+       without a BOM (see may_be_utf16_or_32), which is left to 5.
+    3. pure ASCII
+    4. strict UTF-8 validation
+    5. charset_normalizer, for everything else
+
+    Set complete=False when `blob` is a prefix of the file, so that a
+    multi-byte sequence cut off at the end of the prefix is not held against
+    UTF-8.
+    """
+    for bom, encoding in BOM_TO_ENCODING:
+        if blob.startswith(bom):
+            return encoding, TIER_BOM
+    if b"\0" in blob:
+        if not (may_be_utf16_or_32(blob) and load_charset_normalizer()):
+            return "binary", TIER_BINARY
+    elif blob.isascii():
+        return "utf-8", TIER_ASCII
+    elif is_utf8(blob, complete=complete):
+        return "utf-8", TIER_UTF8
+    charset_normalizer = load_charset_normalizer()
+    if not charset_normalizer:
+        return "utf-8", TIER_NO_DETECTOR
+    matches = charset_normalizer.from_bytes(blob)
+    if not matches:
+        return "binary", TIER_CHARSET_NORMALIZER
+    best = matches.best()
+    if not best:
+        return "binary", TIER_CHARSET_NORMALIZER
+    return best.encoding, TIER_CHARSET_NORMALIZER
+
+
+@functools.cache
+def load_charset_normalizer() -> ModuleType | None:
+    """
+    Imports charset_normalizer on first use rather than with this module:
+    it takes longer to import than most runs spend detecting encodings, and
+    the cheaper tiers decide for most files.
+    """
+    try:
+        import charset_normalizer
+    except ImportError:
+        return None
+    return charset_normalizer
+
+
+def may_be_utf16_or_32(blob: bytes) -> bool:
+    """
+    Whether the NUL bytes of `blob` fall where they would in UTF-16 or
+    UTF-32 text: in UTF-16 text of Latin script, on every other byte only,
+    and in UTF-32 text, on at least the highest byte of every code unit.
+    Binary content rarely has either pattern.
+    """
+    if b"\0" not in blob[0::2] or b"\0" not in blob[1::2]:
+        return True
+    end = len(blob) - len(blob) % 4
+    return not blob[0:end:4].strip(b"\0") or not blob[3:end:4].strip(b"\0")
+
+
+def is_utf8(blob: bytes, *, complete: bool = True) -> bool:
+    decoder = codecs.getincrementaldecoder("utf-8")("strict")
+    try:
+        decoder.decode(blob, final=complete)
+    except UnicodeDecodeError:
+        return False
+    return True
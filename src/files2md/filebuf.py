@@ -0,0 +1,210 @@
+import codecs
+import contextlib
+import functools
+import io
+import mmap
+import os
+from pathlib import Path
+from typing import Callable, Iterator
+
+# Files at least this large are mapped into memory rather than read.
+MMAP_THRESHOLD = 16 * 2**20
+# a multiple of mmap.PAGESIZE, as required by release_pages()
+DECODE_CHUNK_SIZE = 2**20
+
+FileBuffer = bytes | mmap.mmap
+# (st_size, st_mtime_ns) of a file, which changes when the file is written
+FileStamp = tuple[int, int]
+
+
+def file_stamp(st: os.stat_result) -> FileStamp:
+    return (st.st_size, st.st_mtime_ns)
+
+
+@contextlib.contextmanager
+def open_file_buffer(file: Path) -> Iterator[FileBuffer]:
+    """
+    Yields the whole content of `file` from a single open(): as bytes for
+    small files, or as a read-only mmap for large ones. The mmap is closed
+    on exit, so slices must be copied out of it before then.
+    """
+    with open(file, "rb") as fh:
+        with fh_buffer(fh) as buf:
+            yield buf
+
+
+@contextlib.contextmanager
+def fh_buffer(fh: io.BufferedReader) -> Iterator[FileBuffer]:
+    """open_file_buffer() of the file open as `fh`, from its start."""
+    fh.seek(0)
+    size = os.fstat(fh.fileno()).st_size
+    mapped = None
+    if size >= MMAP_THRESHOLD:
+        try:
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            mapped = None
+    if mapped is None:
+        yield fh.read()
+        return
+    with mapped:
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        yield mapped
+
+
+def release_pages(buf: FileBuffer, offset: int, length: int):
+    """
+    Drops already-consumed pages of a mapped file from the process's
+    resident set, so that streaming through a large file keeps memory use
+    flat. The pages are read again from the page cache if touched later.
+    """
+    if isinstance(buf, mmap.mmap) and hasattr(mmap, "MADV_DONTNEED"):
+        buf.madvise(mmap.MADV_DONTNEED, offset, min(length, len(buf) - offset))
+
+
+def iter_decoded_chunks(
+    buf: FileBuffer,
+    encoding: str,
+    *,
+    errors: str = "replace",
+    chunk_size: int = DECODE_CHUNK_SIZE,
+) -> Iterator[str]:
+    """
+    Decodes `buf` chunk by chunk and yields the decoded text of each chunk,
+    with "\\r\\n" and "\\r" translated to "\\n" as open() would. Empty
+    strings are not yielded.
+    """
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder(encoding)(errors), translate=True
+    )
+    size = len(buf)
+    for offset in range(0, size, chunk_size):
+        final = offset + chunk_size >= size
+        text = decoder.decode(buf[offset : offset + chunk_size], final=final)
+        release_pages(buf, offset, chunk_size)
+        if text:
+            yield text
+
+
+def iter_decoded_lines(
+    buf: FileBuffer,
+    encoding: str,
+    *,
+    errors: str = "replace",
+    chunk_size: int = DECODE_CHUNK_SIZE,
+) -> Iterator[str]:
+    """
+    Decodes `buf` chunk by chunk and yields its lines, the same lines as
+    iterating over open(file, encoding=encoding, errors=errors) would:
+    "\\r\\n" and "\\r" are translated to "\\n", and each line keeps its
+    line ending.
+    """
+    partial = ""
+    for text in iter_decoded_chunks(
+        buf, encoding, errors=errors, chunk_size=chunk_size
+    ):
+        lines = text.split("\n")
+        lines[0] = partial + lines[0]
+        partial = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if partial:
+        yield partial
+
+
+def copy_file_to_fd(file: Path, out_fd: int) -> int:
+    """
+    Writes the content of `file` to `out_fd` at its current offset. The
+    bytes are copied inside the kernel with os.copy_file_range() or, where
+    that is not possible (e.g. to a pipe, or across file systems on older
+    kernels), os.sendfile(); what is left is copied through a buffer.
+    Returns the number of bytes the kernel copied.
+    """
+    in_fd = os.open(file, os.O_RDONLY)
+    try:
+        return copy_fd_to_fd(in_fd, out_fd, os.fstat(in_fd).st_size)
+    finally:
+        os.close(in_fd)
+
+
+def copy_fd_to_fd(in_fd: int, out_fd: int, count: int) -> int:
+    """
+    copy_file_to_fd() of `count` bytes from the current offset of `in_fd`,
+    or fewer if it ends first. Returns the number of bytes the kernel copied.
+    """
+    copied = kernel_copy(in_fd, out_fd, count)
+    remaining = count - copied
+    while remaining > 0 and (
+        chunk := os.read(in_fd, min(remaining, DECODE_CHUNK_SIZE))
+    ):
+        remaining -= len(chunk)
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(out_fd, view) :]
+    return copied
+
+
+def kernel_copy(in_fd: int, out_fd: int, count: int) -> int:
+    """
+    Copies up to `count` bytes from the current offset of `in_fd` to that of
+    `out_fd`, advancing both, without passing them through user space.
+    Returns the number of bytes copied, which is less than `count` if the
+    kernel cannot copy between these files or `in_fd` ends early.
+    """
+    copies: list[Callable[[int], int]] = []
+    if hasattr(os, "copy_file_range"):
+        copies.append(lambda n: os.copy_file_range(in_fd, out_fd, n))
+    if hasattr(os, "sendfile"):
+        copies.append(lambda n: os.sendfile(out_fd, in_fd, None, n))
+    copied = 0
+    for copy in copies:
+        try:
+            while copied < count:
+                n = copy(count - copied)
+                if not n:
+                    return copied
+                copied += n
+            return copied
+        except OSError:
+            continue
+    return copied
+
+
+def count_lines(buf: FileBuffer, *, chunk_size: int = DECODE_CHUNK_SIZE) -> int:
+    """
+    Counts the lines iter_decoded_lines would yield for `buf`, without
+    decoding it. Only valid for encodings where is_ascii_compatible() holds.
+    """
+    newlines = 0
+    last = b""
+    for offset in range(0, len(buf), chunk_size):
+        chunk = buf[offset : offset + chunk_size]
+        release_pages(buf, offset, chunk_size)
+        newlines += chunk.count(b"\n") + chunk.count(b"\r") - chunk.count(b"\r\n")
+        if last == b"\r" and chunk[:1] == b"\n":
+            newlines -= 1
+        last = chunk[-1:]
+    if last and last not in b"\r\n":
+        newlines += 1
+    return newlines
+
+
+@functools.cache
+def is_ascii_compatible(encoding: str) -> bool:
+    """
+    True if, in `encoding`, "\\r" and "\\n" are always encoded as the single
+    bytes 0x0D and 0x0A, and those bytes never occur inside another
+    character, so that lines can be counted on the raw bytes.
+    """
+    try:
+        codec = codecs.lookup(encoding)
+    except LookupError:
+        return False
+    if codec.name.startswith(("utf-16", "utf-32")):
+        return False
+    try:
+        # endswith(): the "utf-8-sig" encoder prepends a BOM
+        return "a\r\nb".encode(codec.name).endswith(b"a\r\nb")
+    except (UnicodeError, LookupError):
+        return False
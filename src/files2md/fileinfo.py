@@ -1,3 +1,8 @@
+import functools
+from dataclasses import dataclass
+from pathlib import PurePath
+from typing import Iterable
+
 DEFAULT_PATTERNS = [
     ## exclude text files
     "!.env",
@@ -171,19 +176,19 @@ FILEEXT_TO_MDLANG = {
     ".8": "troff",
     ".9": "troff",
     ".apl": "apl",
-    ".asc": "asciiarmor",
+    ".asc": "text",
     ".asn": "asn1",
     ".asn1": "asn1",
     ".b": "brainfuck",
-    ".bash": "shell",
+    ".bash": "bash",
     ".bat": "batch",
     ".bf": "brainfuck",
     ".build": "python",
     ".bzl": "python",
-    ".c": "cpp",
+    ".c": "c",
     ".c++": "cpp",
     ".cc": "cpp",
-    ".cfg": "ttcn-cfg",
+    ".cfg": "ini",
     ".cjs": "javascript",
     ".cl": "lisp",
     ".clj": "clojure",
@@ -199,7 +204,7 @@ FILEEXT_TO_MDLANG = {
     ".cpy": "cobol",
     ".cql": "sql",
     ".cr": "crystal",
-    ".cs": "clike",
+    ".cs": "csharp",
     ".css": "css",
     ".cxx": "cpp",
     ".cyp": "cypher",
@@ -225,7 +230,7 @@ FILEEXT_TO_MDLANG = {
     ".feature": "gherkin",
     ".for": "fortran",
     ".forth": "forth",
-    ".fs": "mllike",
+    ".fs": "fsharp",
     ".fth": "forth",
     ".gemspec": "ruby",
     ".go": "go",
@@ -245,7 +250,7 @@ FILEEXT_TO_MDLANG = {
     ".hxml": "haxe",
     ".hxx": "cpp",
     ".in": "properties",
-    ".ini": "properties",
+    ".ini": "ini",
     ".ino": "cpp",
     ".intr": "dylan",
     ".irb": "ruby",
@@ -260,11 +265,11 @@ FILEEXT_TO_MDLANG = {
     ".jsonld": "javascript",
     ".jsx": "javascript",
     ".ksh": "shell",
-    ".kt": "clike",
+    ".kt": "kotlin",
     ".less": "css",
     ".lisp": "lisp",
     ".ls": "livescript",
-    ".ltx": "stex",
+    ".ltx": "latex",
     ".lua": "lua",
     ".m": "clike",
     ".map": "json",
@@ -278,7 +283,7 @@ FILEEXT_TO_MDLANG = {
     ".mll": "mllike",
     ".mly": "mllike",
     ".mm": "clike",
-    ".mo": "modelica",
+    ".mo": "gettext",
     ".mps": "mumps",
     ".msc": "mscgen",
     ".mscgen": "mscgen",
@@ -308,7 +313,7 @@ FILEEXT_TO_MDLANG = {
     ".podspec": "ruby",
     ".pp": "puppet",
     ".pro": "idl",
-    ".properties": "properties",
+    ".properties": "ini",
     ".proto": "protobuf",
     ".ps1": "powershell",
     ".psd1": "powershell",
@@ -320,19 +325,17 @@ FILEEXT_TO_MDLANG = {
     ".pyx": "python",
     ".q": "q",
     ".r": "r",
-    ".r": "r",
     ".rake": "ruby",
     ".rb": "ruby",
-    ".rb": "ruby",
     ".rbw": "ruby",
     ".rq": "sparql",
     ".rs": "rust",
     ".s": "gas",
     ".sas": "sas",
-    ".scala": "clike",
+    ".scala": "scala",
     ".scm": "scheme",
     ".scss": "css",
-    ".sh": "shell",
+    ".sh": "bash",
     ".sieve": "sieve",
     ".sig": "asciiarmor",
     ".siv": "sieve",
@@ -345,19 +348,19 @@ FILEEXT_TO_MDLANG = {
     ".svg": "xml",
     ".swift": "swift",
     ".tcl": "tcl",
-    ".tex": "stex",
+    ".tex": "latex",
     ".text": "stex",
     ".textile": "textile",
     ".thor": "ruby",
     ".toml": "toml",
-    ".ts": "javascript",
-    ".tsx": "javascript",
+    ".ts": "typescript",
+    ".tsx": "typescript",
     ".ttcn": "ttcn",
     ".ttcn3": "ttcn",
     ".ttcnpp": "ttcn",
     ".ttl": "turtle",
     ".v": "verilog",
-    ".vb": "vb",
+    ".vb": "vbscript",
     ".vbe": "vbscript",
     ".vbs": "vbscript",
     ".vhd": "vhdl",
@@ -379,47 +382,11 @@ FILEEXT_TO_MDLANG = {
     ".ys": "yacas",
     ".z80": "z80",
     # ---------------------
-    ".md": "markdown",
-    ".py": "python",
-    ".json": "json",
-    ".yml": "yaml",
-    ".yaml": "yaml",
-    ".toml": "toml",
-    ".sh": "bash",
-    ".bash": "bash",
     ".zsh": "bash",
     ".fish": "fish",
-    ".c": "c",
-    ".cpp": "cpp",
-    ".h": "cpp",
-    ".hpp": "cpp",
-    ".html": "html",
-    ".css": "css",
-    ".js": "javascript",
-    ".ts": "typescript",
-    ".tsx": "typescript",
-    ".jsx": "javascript",
-    ".java": "java",
-    ".kt": "kotlin",
-    ".rs": "rust",
-    ".go": "go",
-    ".php": "php",
-    ".sql": "sql",
-    ".rb": "ruby",
-    ".r": "r",
-    ".lua": "lua",
-    ".swift": "swift",
-    ".scala": "scala",
-    ".groovy": "groovy",
-    ".gradle": "groovy",
-    ".xml": "xml",
-    ".svg": "xml",
     ".csv": "csv",
     ".tsv": "csv",
-    ".ini": "ini",
-    ".cfg": "ini",
     ".conf": "ini",
-    ".properties": "ini",
     ".env": "ini",
     ".gitignore": "ini",
     ".dockerignore": "ini",
@@ -449,15 +416,11 @@ FILEEXT_TO_MDLANG = {
     ".flow": "json",
     ".graphql": "graphql",
     ".gql": "graphql",
-    ".proto": "protobuf",
     ".asciidoc": "asciidoc",
     ".adoc": "asciidoc",
     ".ad": "asciidoc",
-    ".asc": "asciidoc",
-    ".tex": "latex",
     ".latex": "latex",
     ".bib": "latex",
-    ".ltx": "latex",
     ".sty": "latex",
     ".cls": "latex",
     ".dtx": "latex",
@@ -466,41 +429,24 @@ FILEEXT_TO_MDLANG = {
     ".makefile": "makefile",
     ".make": "makefile",
     ".mkfile": "makefile",
-    ".mkfile": "makefile",
-    ".mk": "makefile",
     ".ninja": "ninja",
     ".gn": "ninja",
     ".gninja": "ninja",
-    ".ninja": "ninja",
-    ".gninja": "ninja",
-    ".cmake": "cmake",
-    ".cmake.in": "cmake",
     ".cmakecache": "cmmake",
-    ".pl": "perl",
-    ".pm": "perl",
     ".t": "perl",
     ".pod": "perl",
     ".cgi": "perl",
     ".po": "gettext",
     ".pot": "gettext",
-    ".mo": "gettext",
-    ".cs": "csharp",
     ".csproj": "xml",
     ".sln": "xml",
-    ".fs": "fsharp",
     ".fsproj": "xml",
     ".fsi": "fsharp",
     ".fsx": "fsharp",
-    ".fsi": "fsharp",
     ".dsw": "xml",
     ".dsp": "xml",
-    ".vbs": "vbscript",
     ".vba": "vbscript",
-    ".vbe": "vbscript",
-    ".vb": "vbscript",
     ".vbscript": "vbscript",
-    ".jse": "javascript",
-    ".vbe": "vbscript",
     ".wsf": "xml",
     ".bashrc": "bash",
     ".zshrc": "bash",
@@ -516,7 +462,6 @@ FILEEXT_TO_MDLANG = {
     ".gvimrc": "vim",
     ".nvim": "vim",
     ".nvimrc": "vim",
-    ".env": "ini",
     ".envrc": "ini",
     ".env.example": "ini",
     ".envrc.example": "ini",
@@ -525,26 +470,115 @@ FILEEXT_TO_MDLANG = {
     ".env.local": "ini",
     ".envrc.local": "ini",
     ".env.dev": "ini",
-    ".swift": "swift",
     ".swiftui": "swift",
     ".swiftplayground": "swift",
     ".swiftmodule": "swift",
     ".swiftsource": "swift",
-    ".el": "lisp",
     ".erlang": "erlang",
     ".hrl": "erlang",
     ".es": "erlang",
     ".escript": "erlang",
     ".haskell": "haskell",
-    ".hs": "haskell",
     ".lhs": "haskell",
     ".cabal": "haskell",
     ".hie": "haskell",
     ".cargo": "rust",
     ".pem": "text",
-    ".asc": "text",
     ".crt": "text",
     ".csr": "text",
     ".key": "text",
     ".htaccess": "apache",
 }
+
+
+# Decisions of classify_file(), made from the name of a file alone
+# content excluded due to its MIME type, without reading the file
+DECISION_SKIP_BY_MIME = "skip-by-mime"
+# text with a known markdown language, unless the content says otherwise
+DECISION_TEXT = "text"
+# the content has to be sniffed to tell text from binary
+DECISION_SNIFF = "sniff"
+
+
+def build_patterns(
+    include_patterns: Iterable[str],
+    exclude_patterns: Iterable[str],
+    *,
+    use_default_patterns: bool = True,
+) -> list[str]:
+    """
+    The gitwildmatch patterns that select the input files: DEFAULT_PATTERNS
+    if used, then `exclude_patterns` negated, then `include_patterns`; the
+    last pattern that matches a file decides.
+    """
+    patterns = list(DEFAULT_PATTERNS) if use_default_patterns else []
+    patterns.extend(f"!{pattern}" for pattern in exclude_patterns)
+    patterns.extend(include_patterns)
+    return patterns
+
+
+@dataclass(frozen=True)
+class FileClass:
+    decision: str
+    # markdown language of the code block, "" if unknown
+    mdlang: str
+    # MIME type guessed from the name, "" if unknown
+    mimetype: str
+
+
+def excluded_by_mime(mimetype: str) -> bool:
+    if mimetype in OK_MIMETYPES:
+        return False
+    return mimetype.split("/")[0] in IGNORE_MIME_SUPERTYPES
+
+
+def classify_file(file: PurePath) -> FileClass:
+    """
+    Classifies a file by its name. This is a single lookup in a table keyed
+    by the lowercase suffix (see file_class_key()), which is filled in on
+    first use of each key.
+    """
+    return file_class(file_class_key(file))
+
+
+def file_class_key(file: PurePath) -> str:
+    """
+    The part of the name of `file` that its FileClass depends on: the
+    lowercase suffix, or the lowercase name of a file without a suffix that
+    FILEEXT_TO_MDLANG lists (such as ".bashrc"). The MIME type of a
+    compressed file depends on the suffix before the compression suffix,
+    which is then included, e.g. ".tar.gz"; mimetypes treats compression
+    suffixes case-sensitively, so they are not lowercased.
+    """
+    suffix = file.suffix
+    if not suffix:
+        name = file.name.lower()
+        return name if name in FILEEXT_TO_MDLANG else ""
+    if suffix in compression_suffixes():
+        return PurePath(file.stem).suffix.lower() + suffix
+    return suffix.lower()
+
+
+@functools.cache
+def file_class(key: str) -> FileClass:
+    import mimetypes
+
+    mimetype, _ = mimetypes.guess_type("_" + key)
+    mimetype = mimetype or ""
+    mdlang = FILEEXT_TO_MDLANG.get(PurePath("_" + key).suffix.lower() or key, "")
+    if mdlang:
+        decision = DECISION_TEXT
+    elif excluded_by_mime(mimetype):
+        decision = DECISION_SKIP_BY_MIME
+    else:
+        decision = DECISION_SNIFF
+    return FileClass(decision=decision, mdlang=mdlang, mimetype=mimetype)
+
+
+@functools.cache
+def compression_suffixes() -> frozenset[str]:
+    import mimetypes
+
+    if not mimetypes.inited:
+        mimetypes.init()
+    return frozenset(mimetypes.encodings_map)
@@ -1,24 +1,47 @@
 import io
-import mimetypes
+import itertools
+import os
 import re
+import time
+import warnings
 from abc import ABC, abstractmethod
+import codecs
+import collections
 import contextlib
+import dataclasses
+import functools
+import pickle
 from dataclasses import dataclass, field
 from pathlib import Path
 from string import Template
 from types import ModuleType
-from typing import TYPE_CHECKING, Iterable, final, override
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Iterable,
+    Iterator,
+    Sequence,
+    final,
+    override,
+)
 import typing
 
 import files2md
+import files2md.compact as compact
+import files2md.encoding_detect as encoding_detect
+import files2md.filebuf as filebuf
 import files2md.fileinfo as fileinfo
+import files2md.profiling as profiling
+import files2md.readahead as readahead
+import files2md.subrules as subrules
+from files2md.subrules import RETextSubstituter, SubRuleStat, TextSubstituter
 
-try:
-    import charset_normalizer as charset_normalizer_
+# concurrent.futures and hashlib are imported where they are
+# used, so that importing this module (e.g. for `files2md --help`) is fast.
+if TYPE_CHECKING:
+    import concurrent.futures
 
-    charset_normalizer = charset_normalizer_
-except ImportError:
-    charset_normalizer = None  # type: ignore
+    from files2md.render_cache import CacheKey, MemoryRenderCache, RenderCache
 
 TEMPLATE_PROJECT = Template("""# Project: ${project_name}""")
 
@@ -30,6 +53,18 @@ ${files_listing}
 """
 )
 
+# TEMPLATE_FILELIST before and after the listing, so that the header can be
+# written without building the listing as one string
+TEMPLATE_FILELIST_HEAD, TEMPLATE_FILELIST_TAIL = (
+    Template(part) for part in TEMPLATE_FILELIST.template.split("${files_listing}")
+)
+# listing lines per string yielded by MdFormatter.iter_header_md()
+HEADER_LISTING_BATCH = 1000
+
+# listing lines of files that are listed without a section (RemovedFile)
+TEMPLATE_LISTING_DELETED = Template("`${pathname}` (deleted)")
+TEMPLATE_LISTING_RENAMED = Template("`${pathname}` (renamed to `${new_pathname}`)")
+
 TEMPLATE_FILE = Template(
     """
 ### `${pathname}`
@@ -39,6 +74,11 @@ ${fence}${omission_msg}
 
 """
 )
+# TEMPLATE_FILE before and after the content, so that sections can be
+# written without copying the content into them
+TEMPLATE_FILE_HEAD, TEMPLATE_FILE_TAIL = (
+    Template(part) for part in TEMPLATE_FILE.template.split("${content}")
+)
 
 TEMPLATE_BINARY_FILE = Template(
     """### `${pathname}`
@@ -46,6 +86,12 @@ TEMPLATE_BINARY_FILE = Template(
 """
 )
 
+TEMPLATE_COPY = Template(
+    """### `${pathname}`
+(same content as `${original}`)
+"""
+)
+
 TEMPLATE_UNSUPPORTED_MIMETYPE = Template(
     """### `${pathname}`
 (content excluded due to unsupported MIME type: ${mimetype})
@@ -53,6 +99,13 @@ TEMPLATE_UNSUPPORTED_MIMETYPE = Template(
 )
 
 
+TEMPLATE_CONTINUATION = Template(
+    """
+${heading} (continued)
+${opener}
+"""
+)
+
 TEMPLATE_OMISSION = Template(
     """
 (NB: ${omitted_line_count} lines omitted for brevity)
@@ -79,12 +132,288 @@ TEMPLATE_GENERATOR_TAG = Template(
 
 MIN_FENCE_LEN = 3
 MAX_FENCE_LEN = 12
+# how much of a file is looked at to detect its encoding
+DETECT_ENCODING_MAX_BYTES = 100_000
+# the content of text files at least this large is not held in memory but
+# read again when written, if it is written unchanged; see StreamedContent
+STREAM_CONTENT_MIN_BYTES = filebuf.MMAP_THRESHOLD
+
+# split_section() cuts lines into pieces of no less than this
+MIN_SPLIT_PIECE_BYTES = 256
+RE_SECTION_HEAD = re.compile(r"\A\n?(### `[^\n]*`)\n(`{3,}[^\n]*)\n")
+
+EXECUTOR_PROCESS = "process"
+EXECUTOR_THREAD = "thread"
+EXECUTORS = [EXECUTOR_PROCESS, EXECUTOR_THREAD]
+# how many files each worker may have rendered ahead of the writer
+JOBS_PREFETCH_FACTOR = 4
+# files looked up in the render cache ahead of the one being written, so that
+# the misses among them are rendered ahead too; see MdWriter.iter_renderers()
+CACHE_LOOKUP_AHEAD = 1000
+# formatters of the writers sharing a process pool that each worker keeps;
+# see _render_in_shared_worker()
+SHARED_FORMATTERS_KEPT = 64
+
+
+class ContentChangedError(OSError):
+    """The file of a StreamedContent changed after its content was analyzed."""
+
+
+@dataclass(frozen=True)
+class StreamedContent:
+    """
+    The content of a file section, decoded from the file again chunk by
+    chunk as it is written rather than held in memory.
+
+    The file is checked against its stamp when it is opened again, since a
+    file changed in between may no longer fit the fence and line count
+    worked out for the content: MdWriter renders such a file again (see
+    MdWriter.open_streamed()), and iterating raises ContentChangedError.
+    """
+
+    file: Path
+    encoding: str
+    # length of the decoded content
+    char_count: int
+    # True if the bytes of the file are the UTF-8 encoding of the content,
+    # so that they can be copied as they are; see
+    # SingleFileOutputHandler.write_section()
+    passthrough: bool = False
+    # the file's size and mtime when the content was analyzed
+    stamp: filebuf.FileStamp | None = None
+    # the file, opened again by opened() and checked against the stamp
+    fh: io.BufferedReader | None = field(default=None, compare=False, repr=False)
+
+    @property
+    def nbytes(self) -> int:
+        """The size of the file."""
+        if self.stamp is not None:
+            return self.stamp[0]
+        return self.file.stat().st_size
+
+    @contextlib.contextmanager
+    def opened(self) -> Iterator["StreamedContent | None"]:
+        """
+        This content, read from the file opened now; or None if the file
+        no longer matches the stamp.
+        """
+        with open(self.file, "rb") as fh:
+            st = os.fstat(fh.fileno())
+            if self.stamp is not None and filebuf.file_stamp(st) != self.stamp:
+                yield None
+            else:
+                yield dataclasses.replace(self, fh=fh)
+
+    def __iter__(self) -> Iterator[str]:
+        if self.fh is not None:
+            with filebuf.fh_buffer(self.fh) as buf:
+                yield from filebuf.iter_decoded_chunks(buf, self.encoding)
+            return
+        with self.opened() as content:
+            if content is None:
+                raise ContentChangedError(f"{self.file} changed while being rendered")
+            yield from content
+
+    def copy_to_fd(self, out_fd: int):
+        """Copies the bytes of the file (see passthrough) to `out_fd`."""
+        if self.fh is None:
+            filebuf.copy_file_to_fd(self.file, out_fd)
+            return
+        self.fh.seek(0)
+        filebuf.copy_fd_to_fd(self.fh.fileno(), out_fd, self.nbytes)
+
+
+@dataclass(frozen=True)
+class Utf8Content:
+    """
+    The content of a file section as the bytes read from the file, which
+    are its UTF-8 encoding, so that they can be written as they are; see
+    SingleFileOutputHandler.write_section().
+    """
+
+    data: bytes
+    # length of the decoded content
+    char_count: int
+
+    def __iter__(self) -> Iterator[str]:
+        yield str(self.data, "utf-8")
+
+
+Fragment = str | Utf8Content | StreamedContent
+
+
+@dataclass(frozen=True)
+class RemovedFile:
+    """A file that no longer exists, listed in the header without a section."""
+
+    path: Path
+    # the path the file was renamed to, or None if it was deleted
+    renamed_to: Path | None = None
+
+
+@dataclass(frozen=True)
+class RenderedFile:
+    # the markdown content for the file, as fragments written one after the
+    # other; see iter_chunks(). Sections with a code block have three: the
+    # head, the content and the tail.
+    fragments: tuple[Fragment, ...]
+    # True if the content was truncated due to max_lines_per_file
+    truncated: bool
+    # True if the content was excluded (e.g. unsupported MIME type)
+    excluded: bool
+    # the encoding_detect tier that decided the file's encoding, if detected
+    encoding_tier: str = ""
+    # the substitution rules applied to the file, if any could match
+    sub_rule_stats: tuple[SubRuleStat, ...] = ()
+    # timings of the rendering, if MdFormatter.profile is set
+    trace: profiling.FileTrace | None = None
+    # digest and size of the file's bytes, if MdFormatter.dedupe is set and
+    # the section shows the content
+    content_hash: str = ""
+    content_nbytes: int = 0
+    # pathname of the earlier file with the same content, if the section
+    # refers to it instead of showing the content; see MdWriter.dedupe()
+    copy_of: str = ""
+
+    @property
+    def mdchunk(self) -> str:
+        """The whole section; this reads streamed content into memory."""
+        return "".join(self.iter_chunks())
+
+    @property
+    def char_count(self) -> int:
+        return sum(
+            len(fragment) if isinstance(fragment, str) else fragment.char_count
+            for fragment in self.fragments
+        )
+
+    @property
+    def content(self) -> Fragment | None:
+        """
+        The file content shown in the code block, or None if the section has
+        none (binary, excluded and copied files, and sections read from the
+        render cache, which are stored as one string).
+        """
+        if len(self.fragments) != 3:
+            return None
+        return self.fragments[1]
+
+    @property
+    def streamed(self) -> bool:
+        return any(isinstance(fragment, StreamedContent) for fragment in self.fragments)
+
+    def iter_chunks(self) -> Iterator[str]:
+        for fragment in self.fragments:
+            if isinstance(fragment, str):
+                yield fragment
+            else:
+                yield from fragment
+
+
+@dataclass(frozen=True)
+class ContentInfo:
+    # longest run of backticks in the content
+    longest_backtick_run: int
+    # True if the content is empty or whitespace only
+    is_blank: bool
+    # True if the content contains the generator tag
+    has_tag: bool
+    # number of lines, counting a final line without a line ending
+    line_count: int
+
+    @property
+    def fence(self) -> str:
+        fence_len = max(MIN_FENCE_LEN, self.longest_backtick_run + 1)
+        return "`" * min(fence_len, MAX_FENCE_LEN)
+
+
+@dataclass(frozen=True)
+class ContentScanner:
+    # the generator tag, "" for none
+    tag_str: str
+    # finds the backtick runs long enough to affect the fence
+    backtick_runs: re.Pattern
+
+
+def compile_content_scanner(tag_str: str) -> ContentScanner:
+    """
+    What analyze_content() looks for. Most content has neither a backtick
+    run long enough to affect the fence nor the tag, which substring
+    searches rule out many times faster than a regex scan, so the regex is
+    only run over content that has such a run, to measure it.
+    """
+    return ContentScanner(tag_str, re.compile(f"`{{{MIN_FENCE_LEN},}}"))
+
+
+def analyze_content(content: str, scanner: ContentScanner) -> ContentInfo:
+    longest_backtick_run = 0
+    if "`" * MIN_FENCE_LEN in content:
+        runs = scanner.backtick_runs.findall(content)
+        longest_backtick_run = max(map(len, runs))
+    has_tag = bool(scanner.tag_str) and scanner.tag_str in content
+    line_count = content.count("\n")
+    if content and content[-1] != "\n":
+        line_count += 1
+    return ContentInfo(
+        longest_backtick_run=longest_backtick_run,
+        is_blank=not content or content.isspace(),
+        has_tag=has_tag,
+        line_count=line_count,
+    )
+
+
+def analyze_chunks(
+    chunks: Iterable[str], scanner: ContentScanner
+) -> tuple[ContentInfo, int]:
+    """
+    Returns analyze_content() of the concatenated `chunks`, and its length,
+    without concatenating them. Neither backtick runs nor the tag span
+    lines, so the chunks are regrouped into whole lines and analyzed one
+    group at a time.
+    """
+    longest_backtick_run = 0
+    has_tag = False
+    is_blank = True
+    line_count = 0
+    char_count = 0
+    for lines in iter_line_groups(chunks):
+        info = analyze_content(lines, scanner)
+        longest_backtick_run = max(longest_backtick_run, info.longest_backtick_run)
+        has_tag = has_tag or info.has_tag
+        is_blank = is_blank and info.is_blank
+        line_count += info.line_count
+        char_count += len(lines)
+    content_info = ContentInfo(
+        longest_backtick_run=longest_backtick_run,
+        is_blank=is_blank,
+        has_tag=has_tag,
+        line_count=line_count,
+    )
+    return content_info, char_count
+
+
+def iter_line_groups(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Regroups `chunks` of text so that each group ends at the end of a line,
+    except possibly the last.
+    """
+    partial: list[str] = []
+    for chunk in chunks:
+        cut = chunk.rfind("\n") + 1
+        if not cut:
+            partial.append(chunk)
+            continue
+        partial.append(chunk[:cut])
+        yield "".join(partial)
+        partial = [chunk[cut:]] if cut < len(chunk) else []
+    if partial:
+        yield "".join(partial)
 
 
 @dataclass(kw_only=True)
 class TransformSummary:
     # files that were truncated due to max_lines_per_file
-    truncated_files: list[Path] = field(default_factory=list)
+    truncated_files: set[Path] = field(default_factory=set)
     # count of included files by suffix
     suffix_to_file_count: dict[str, int] = field(default_factory=dict)
     # list of included files
@@ -93,6 +422,133 @@ class TransformSummary:
     files_to_char_count: dict[Path, int] = field(default_factory=dict)
     # files that will be listed in the Markdown but have their content excluded (e.g. binary files)
     content_excluded_files: dict[Path, bool] = field(default_factory=dict)
+    # files whose section was taken from / missing in the render cache
+    cache_hits: int = 0
+    cache_misses: int = 0
+    # encoding_detect tier that decided each file's encoding, and their counts
+    files_to_encoding_tier: dict[Path, str] = field(default_factory=dict)
+    encoding_tier_to_file_count: dict[str, int] = field(default_factory=dict)
+    # replacements made by, and time spent in, each substitution rule by index
+    sub_rule_matches: dict[int, int] = field(default_factory=dict)
+    sub_rule_seconds: dict[int, float] = field(default_factory=dict)
+    # files written as a reference to an earlier file with the same content,
+    # and the size of their content
+    duplicate_files: int = 0
+    duplicate_bytes: int = 0
+    # if set, the per-file records are kept there instead of in the fields
+    # above (included_files, files_to_char_count, ...); counts stay here
+    spill: compact.SummarySpill | None = field(default=None, compare=False)
+
+    def iter_by_char_count(self) -> Iterator[compact.FileRecord]:
+        """The included files by ascending char_count, in output order on ties."""
+        if self.spill is not None:
+            yield from self.spill.iter_by_char_count()
+            return
+        sizes = self.files_to_char_count
+        for file in sorted(self.included_files, key=lambda x: sizes[x]):
+            yield compact.FileRecord(
+                file,
+                sizes[file],
+                file in self.truncated_files,
+                file in self.content_excluded_files,
+                self.files_to_encoding_tier.get(file, ""),
+            )
+
+
+def split_section(mdchunk: str, max_bytes: int, encoding: str = "utf-8") -> list[str]:
+    """
+    Splits a file section rendered from TEMPLATE_FILE into pieces of at
+    most `max_bytes` bytes in `encoding`, at line boundaries. The code block
+    is closed at the end of each piece and reopened in the next under a
+    TEMPLATE_CONTINUATION heading. Lines too long for any piece are cut.
+    Sections that fit, or that have no code block, are returned whole.
+    """
+    if len(mdchunk.encode(encoding, errors="replace")) <= max_bytes:
+        return [mdchunk]
+    return list(iter_split_section([mdchunk], max_bytes, encoding))
+
+
+def iter_split_section(
+    chunks: Iterable[str], max_bytes: int, encoding: str = "utf-8"
+) -> Iterator[str]:
+    """
+    Yields the pieces of split_section() for the section made of `chunks`,
+    whether or not it fits, reading the chunks a line group at a time, so
+    that only one piece of the section is held in memory.
+    """
+
+    def encoded_size(s: str) -> int:
+        return len(s.encode(encoding, errors="replace"))
+
+    groups = iter_line_groups(chunks)
+    head = ""
+    # RE_SECTION_HEAD spans at most three lines
+    while head.count("\n") < 3 and (group := next(groups, None)) is not None:
+        head += group
+    match = RE_SECTION_HEAD.match(head)
+    if match is None:
+        yield head + "".join(groups)
+        return
+    heading, opener = match.groups()
+    fence = opener[: len(opener) - len(opener.lstrip("`"))]
+    closer = f"{fence}\n"
+    continuation = TEMPLATE_CONTINUATION.substitute(heading=heading, opener=opener)
+    # + 1 for the line ending added to a cut line
+    closer_size = encoded_size(closer) + 1
+    line_budget = max(
+        max_bytes - encoded_size(continuation) - closer_size, MIN_SPLIT_PIECE_BYTES
+    )
+
+    piece = [match.group()]
+    piece_size = encoded_size(match.group())
+    for group in itertools.chain([head[match.end() :]], groups):
+        for line in iter_cut_lines(group, line_budget, encoding):
+            size = encoded_size(line)
+            if len(piece) > 1 and piece_size + size + closer_size > max_bytes:
+                text = "".join(piece)
+                if not text.endswith("\n"):
+                    text += "\n"
+                yield text + closer
+                piece = [continuation]
+                piece_size = encoded_size(continuation)
+            piece.append(line)
+            piece_size += size
+    yield "".join(piece)
+
+
+def iter_cut_lines(text: str, max_bytes: int, encoding: str) -> Iterator[str]:
+    for line in text.splitlines(True):
+        while len(line) > 1:
+            # no character encodes to less than a byte
+            encoded = line[: max_bytes + 1].encode(encoding, errors="replace")
+            if len(encoded) <= max_bytes:
+                break
+            # a character cut in half is dropped from the head, kept in the tail
+            head = encoded[:max_bytes].decode(encoding, errors="ignore") or line[0]
+            yield head
+            line = line[len(head) :]
+        yield line
+
+
+# (st_dev, st_ino) of a file, which identifies it across hard and symbolic links
+FileId = tuple[int, int]
+
+
+def file_id(path: Path) -> FileId | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+def open_file_id(fh: typing.IO) -> FileId | None:
+    try:
+        st = os.fstat(fh.fileno())
+    except (OSError, ValueError):
+        # e.g. an io.StringIO
+        return None
+    return (st.st_dev, st.st_ino)
 
 
 class OutputHandler(ABC):
@@ -100,6 +556,13 @@ class OutputHandler(ABC):
     def write(self, s: str):
         pass
 
+    def writelines(self, fragments: Iterable[str]):
+        for s in fragments:
+            self.write(s)
+
+    def write_section(self, rendered: RenderedFile):
+        self.writelines(rendered.iter_chunks())
+
     @abstractmethod
     def on_after_md_header(self):
         pass
@@ -116,14 +579,60 @@ class OutputHandler(ABC):
     def get_filepaths(self) -> list[Path]:
         pass
 
+    def get_file_ids(self) -> set[FileId]:
+        """
+        The FileIds of the output files created so far, which MdWriter
+        checks every input file against. Handlers that create files should
+        keep this set up to date as they go, rather than stat()ing the
+        get_filepaths() on every call as done here.
+        """
+        ids = (file_id(path) for path in self.get_filepaths())
+        return {id_ for id_ in ids if id_ is not None}
+
 
 class SingleFileOutputHandler(OutputHandler):
+    """
+    Writes the output to `ofh`. If `ofh` is a UTF-8 text file over a binary
+    one, everything is encoded here and written to the binary file, so that
+    the bytes of files that need no decoding (Utf8Content, passthrough
+    StreamedContent) can be written as they are, or copied by the kernel.
+    """
+
     def __init__(self, ofh: io.TextIOWrapper):
         self.ofh = ofh
+        self.binary = passthrough_buffer(ofh)
+        ofh_id = open_file_id(ofh)
+        self.file_ids: set[FileId] = set() if ofh_id is None else {ofh_id}
 
     @override
     def write(self, s: str):
-        self.ofh.write(s)
+        if self.binary is None:
+            self.ofh.write(s)
+        else:
+            self.binary.write(s.encode("utf-8", self.ofh.errors))
+
+    @override
+    def writelines(self, fragments: Iterable[str]):
+        if self.binary is None:
+            self.ofh.writelines(fragments)
+        else:
+            for s in fragments:
+                self.write(s)
+
+    @override
+    def write_section(self, rendered: RenderedFile):
+        if self.binary is None:
+            return super().write_section(rendered)
+        for fragment in rendered.fragments:
+            if isinstance(fragment, str):
+                self.write(fragment)
+            elif isinstance(fragment, Utf8Content):
+                self.binary.write(fragment.data)
+            elif fragment.passthrough:
+                self.binary.flush()
+                fragment.copy_to_fd(self.binary.fileno())
+            else:
+                self.writelines(fragment)
 
     @override
     def on_after_md_header(self):
@@ -143,17 +652,77 @@ class SingleFileOutputHandler(OutputHandler):
             return []
         return [Path(self.ofh.name)]
 
+    @override
+    def get_file_ids(self) -> set[FileId]:
+        return self.file_ids
+
+
+def passthrough_buffer(ofh: io.TextIOWrapper) -> io.BufferedIOBase | None:
+    """
+    The binary file under `ofh` if `ofh` writes text as UTF-8 and "\\n"
+    as it is, so that UTF-8 bytes can be written to the binary file
+    directly; otherwise None.
+    """
+    binary = getattr(ofh, "buffer", None)
+    if binary is None or os.linesep != "\n":
+        return None
+    try:
+        if codecs.lookup(ofh.encoding).name != "utf-8":
+            return None
+    except LookupError:
+        return None
+    ofh.flush()
+    return binary
+
 
 class SplitFileOutputHandler(OutputHandler):
+    """
+    Writes the header to the first part, then packs the file sections in
+    order into parts of at most `bytes_per_file` bytes (in the output
+    encoding). The size of a section is taken before it is placed: a
+    section that does not fit into the current part starts the next one,
+    and a section that does not fit into any part is split across parts by
+    iter_split_section(). Sections passed to write_section() are measured
+    and written through a chunk at a time (streamed content is read twice
+    unless its size is known from the file); text passed to write(), e.g.
+    by `files2md client`, is held back until the end of its section.
+
+    `kb_per_file` (parts of kb_per_file * 1000 bytes) is the deprecated
+    former name of the size.
+    """
+
     def __init__(
-        self, *, initial_path: Path, kb_per_file: int, output_encoding: str = "utf-8"
+        self,
+        *,
+        initial_path: Path,
+        bytes_per_file: int | None = None,
+        output_encoding: str = "utf-8",
+        kb_per_file: int | None = None,
     ):
+        if kb_per_file is not None:
+            if bytes_per_file is not None:
+                raise TypeError("pass bytes_per_file or kb_per_file, not both")
+            warnings.warn(
+                "kb_per_file is deprecated, use bytes_per_file",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+            bytes_per_file = kb_per_file * 1000
+        if bytes_per_file is None:
+            raise TypeError("missing keyword argument 'bytes_per_file'")
         self.initial_path = initial_path
-        self.kb_per_file = kb_per_file
+        self.bytes_per_file = bytes_per_file
         self.output_encoding = output_encoding
         self.output_paths: list[Path] = []
         self.current_split_num: int = 0
-        self.current_output_fh, self.current_output_path = self.split()
+        self.current_output_fh: io.TextIOWrapper | None = None
+        self.current_output_path: Path | None = None
+        # bytes written to the current part
+        self.current_size: int = 0
+        # the section being written, or None while the header is written
+        self.pending_section: list[str] | None = None
+        self.file_ids: set[FileId] = set()
+        self.split()
 
     def split(self) -> tuple[io.TextIOWrapper, Path]:
         if self.current_output_fh:
@@ -165,7 +734,11 @@ class SplitFileOutputHandler(OutputHandler):
         self.current_output_fh = open(
             current_split_path, "w", encoding=self.output_encoding
         )
+        fh_id = open_file_id(self.current_output_fh)
+        if fh_id is not None:
+            self.file_ids.add(fh_id)
         self.current_output_path = current_split_path
+        self.current_size = 0
         return self.current_output_fh, self.current_output_path
 
     def get_current_split_filepath(self):
@@ -176,45 +749,167 @@ class SplitFileOutputHandler(OutputHandler):
         then:
             * return == /tmp/data/foo-1.md
         """
-        stem = self.initial_path.parent / self.initial_path.stem
+        stem = self.initial_path.stem
         suffix = self.initial_path.suffix
-        new_suffix = f"-{self.current_split_num}.{suffix}"
-        return stem.with_suffix(new_suffix)
+        return self.initial_path.with_name(f"{stem}-{self.current_split_num}{suffix}")
+
+    def encoded_size(self, s: str) -> int:
+        return len(s.encode(self.output_encoding, errors="replace"))
+
+    def write_part(self, s: str):
+        assert self.current_output_fh is not None
+        self.current_output_fh.write(s)
+        self.current_size += self.encoded_size(s)
 
     @override
     def write(self, s: str):
-        self.current_output_fh.write(s)
+        if self.pending_section is None:
+            self.write_part(s)
+        else:
+            self.pending_section.append(s)
+
+    @override
+    def write_section(self, rendered: RenderedFile):
+        if self.pending_section is None:
+            return super().write_section(rendered)
+        self.on_after_md_section()
+        size = self.section_size(rendered)
+        if size > self.bytes_per_file:
+            chunks = rendered.iter_chunks()
+            for piece in iter_split_section(
+                chunks, self.bytes_per_file, self.output_encoding
+            ):
+                self.place(piece, self.encoded_size(piece))
+            return
+        self.make_room(size)
+        for chunk in rendered.iter_chunks():
+            self.write_part(chunk)
+
+    def section_size(self, rendered: RenderedFile) -> int:
+        """The size of `rendered` in the output encoding, without joining it."""
+        utf8 = codecs.lookup(self.output_encoding).name == "utf-8"
+        size = 0
+        for fragment in rendered.fragments:
+            if isinstance(fragment, str):
+                size += self.encoded_size(fragment)
+            elif utf8 and isinstance(fragment, Utf8Content):
+                size += len(fragment.data)
+            elif (
+                utf8 and isinstance(fragment, StreamedContent) and fragment.passthrough
+            ):
+                size += fragment.nbytes
+            else:
+                size += sum(map(self.encoded_size, fragment))
+        return size
+
+    def make_room(self, size: int):
+        """Starts the next part unless `size` more bytes fit into the current one."""
+        if self.current_size and self.current_size + size > self.bytes_per_file:
+            self.split()
+
+    def place(self, piece: str, size: int):
+        self.make_room(size)
+        self.write_part(piece)
 
     @override
     def on_after_md_header(self):
         self.split()
+        self.pending_section = []
 
     @override
     def on_after_md_section(self):
-        if not self.current_output_fh:
+        if not self.pending_section:
             return
-        tell = self.current_output_fh.tell()
-        if tell > self.kb_per_file * 1000:
-            self.split()
+        section = "".join(self.pending_section)
+        self.pending_section.clear()
+        pieces = split_section(section, self.bytes_per_file, self.output_encoding)
+        for piece in pieces:
+            self.place(piece, self.encoded_size(piece))
 
     @override
     def on_complete(self):
+        self.on_after_md_section()
         if self.current_output_fh:
             self.current_output_fh.close()
 
     @override
     def get_filepaths(self) -> list[Path]:
+        assert self.current_output_path is not None
         return self.output_paths + [self.current_output_path]
 
+    @override
+    def get_file_ids(self) -> set[FileId]:
+        return self.file_ids
+
+
+class MemoryOutputHandler(OutputHandler):
+    """
+    Passes the output to `sink` piece by piece, e.g. to the write() of an
+    HTTP response or the put() of a queue, or keeps it in memory for
+    getvalue() if no sink is given. No file is written; the content of
+    streamed sections is read from the input files as it is passed on.
+    """
+
+    def __init__(self, sink: Callable[[str], object] | None = None):
+        self.chunks: list[str] = []
+        self.sink = self.chunks.append if sink is None else sink
+
+    @override
+    def write(self, s: str):
+        self.sink(s)
+
+    def getvalue(self) -> str:
+        return "".join(self.chunks)
+
+    @override
+    def on_after_md_header(self):
+        pass
+
+    @override
+    def on_after_md_section(self):
+        pass
+
+    @override
+    def on_complete(self):
+        pass
+
+    @override
+    def get_filepaths(self) -> list[Path]:
+        return []
+
+    @override
+    def get_file_ids(self) -> set[FileId]:
+        return set()
+
 
 # if is type checking:
 
 if TYPE_CHECKING:
     SplitFileOutputHandler(
-        initial_path=Path(""), kb_per_file=0, output_encoding="utf-8"
+        initial_path=Path(""), bytes_per_file=0, output_encoding="utf-8"
     )
 
 
+class FileQueue:
+    """
+    Files queued by MdWriter.iter_renderers() as it finds them missing from
+    the render cache, for iter_pool_renderers() to render. Iteration stops
+    whenever the queue is empty and resumes with the files queued since,
+    which works because every file the caller waits for has been queued.
+    """
+
+    def __init__(self):
+        self.queue: collections.deque[Path] = collections.deque()
+
+    def __iter__(self) -> "FileQueue":
+        return self
+
+    def __next__(self) -> Path:
+        if not self.queue:
+            raise StopIteration
+        return self.queue.popleft()
+
+
 class MdWriter(contextlib.AbstractContextManager):
     def __init__(
         self,
@@ -225,9 +920,19 @@ class MdWriter(contextlib.AbstractContextManager):
         mlpf_approx_pct: int = 25,
         project_name: str,
         in_dirs: list[Path],
-        files: list[Path],
+        files: Sequence[Path],
         md_formatter: "MdFormatter | None" = None,
         sub_rules_file: str,
+        jobs: int = 1,
+        executor: str = EXECUTOR_PROCESS,
+        render_cache: "RenderCache | MemoryRenderCache | None" = None,
+        profiler: profiling.Profiler | None = None,
+        read_threads: int = 0,
+        read_ahead_bytes: int = readahead.DEFAULT_READ_AHEAD_BYTES,
+        summary_spill: compact.SummarySpill | None = None,
+        dedupe: bool = False,
+        removed_files: Sequence[RemovedFile] = (),
+        pool: "concurrent.futures.Executor | None" = None,
     ):
         if isinstance(output, Path):
             output = open(output, "w", encoding="utf-8")
@@ -238,13 +943,31 @@ class MdWriter(contextlib.AbstractContextManager):
             self.output_handler = output
         self.in_dirs = in_dirs
         self.files = files
+        self.removed_files = removed_files
         self.project_name = project_name
         self.max_lines_per_file = max_lines_per_file
         self.include_empty = include_empty
         self.mlpf_approx_pct = mlpf_approx_pct
+        self.jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+        if executor not in EXECUTORS:
+            raise ValueError(
+                f"unknown executor '{executor}', expected one of {EXECUTORS}"
+            )
+        self.executor = executor
+        # a worker pool shared with other writers (see make_shared_pool),
+        # used with jobs > 1 instead of one of this writer's own
+        self.pool = pool
+        # (key, pickled formatter) sent with each file to a shared process pool
+        self.shared_mdfmt: tuple[int, bytes] | None = None
+        self.render_cache = render_cache
+        self.profiler = profiler
+        self.read_threads = read_threads
+        self.read_ahead_bytes = read_ahead_bytes
         self.tag_substr = self.make_tag_substr()
         self.total_chars_written = 0
-        self.summary = TransformSummary()
+        self.summary = TransformSummary(spill=summary_spill)
+        # pathname of the first file written with each content_hash
+        self.first_copies: dict[str, str] = {}
 
         def build_md_formatter() -> MdFormatter:
             if md_formatter is not None:
@@ -255,6 +978,8 @@ class MdWriter(contextlib.AbstractContextManager):
                 max_lines_per_file=self.max_lines_per_file,
                 mlpf_approx_pct=self.mlpf_approx_pct,
                 sub_rules_file=sub_rules_file,
+                profile=profiler is not None,
+                dedupe=dedupe,
             )
 
         self.mdfmt: MdFormatter = build_md_formatter()
@@ -262,25 +987,292 @@ class MdWriter(contextlib.AbstractContextManager):
     def make_md(
         self,
     ):
-        in_dirs = self.in_dirs
+        with profiling.maybe_stage(self.profiler, "make_md") as stage:
+            self.write_md(stage)
+
+    def write_md(self, stage: profiling.StageStat):
+        profiler = self.profiler
+        describe = compact.PathDescriber(self.in_dirs)
+        sorted_files = self.write_header(describe)
+        for file, rendered in self.iter_rendered(sorted_files, describe, stage):
+            write_start_ns = time.perf_counter_ns() if profiler is not None else 0
+            with self.open_streamed(file, describe(file), rendered) as rendered:
+                self.output_handler.write_section(rendered)
+            self.output_handler.on_after_md_section()
+            if profiler is not None:
+                pathname = describe(file)
+                profiler.add_write(pathname, write_start_ns, rendered.char_count)
+
+    @contextlib.contextmanager
+    def open_streamed(
+        self, file: Path, pathname: str, rendered: RenderedFile
+    ) -> Iterator[RenderedFile]:
+        """
+        `rendered`, with its StreamedContent (if any) read from the file
+        opened now. A file that changed since it was rendered is rendered
+        again, in memory, so that the content written fits its fence and
+        line count.
+        """
+        content = rendered.content
+        if not isinstance(content, StreamedContent):
+            yield rendered
+            return
+        with content.opened() as opened:
+            if opened is None:
+                yield self.mdfmt.render_file(file, pathname, data=file.read_bytes())
+                return
+            fragments = (rendered.fragments[0], opened, rendered.fragments[2])
+            yield dataclasses.replace(rendered, fragments=fragments)
+
+    def write_header(self, describe: Callable[[Path], str]) -> Sequence[Path]:
+        """Writes the header, and returns the files in the order of their sections."""
         files = self.files
-        path_descs = {file: self.describe_path(file, in_dirs) for file in files}
-        header = self.mdfmt.make_header_md(self.project_name, path_descs.values())
-        self.output_handler.write(header)
+        sorted_files, repeated = compact.sort_paths(files)
+        header = self.mdfmt.iter_header_md(
+            self.project_name,
+            map(describe, compact.iter_unique(files, repeated)),
+            self.iter_removed_listing(describe),
+        )
+        self.output_handler.writelines(header)
         self.output_handler.on_after_md_header()
-        for file in sorted(files):
-            if any(
-                ofh_path.samefile(file)
-                for ofh_path in self.output_handler.get_filepaths()
-            ):
+        return sorted_files
+
+    def iter_rendered(
+        self,
+        files: Sequence[Path],
+        describe: Callable[[Path], str],
+        stage: profiling.StageStat,
+    ) -> Iterator[tuple[Path, RenderedFile]]:
+        """
+        Yields (file, rendered) for each of `files` in order, other than the
+        output files, with duplicates replaced (see dedupe()) and the file
+        recorded in the summary.
+        """
+        profiler = self.profiler
+        for file, get_rendered in self.iter_renderers(files, describe):
+            output_ids = self.output_handler.get_file_ids()
+            if output_ids and file_id(file) in output_ids:
                 continue
-            pathdesc = path_descs[file]
-            mdstr, content_truncated, content_excluded = self.mdfmt.file_to_md(
-                file, pathdesc
+            rendered = get_rendered()
+            if rendered.content_hash:
+                rendered = self.dedupe(rendered, describe(file))
+            if profiler is not None and rendered.trace is not None:
+                profiler.add_file(describe(file), rendered.trace)
+                stage.nbytes += rendered.trace.nbytes
+            stage.items += 1
+            self.summary_track_file(
+                file,
+                rendered.char_count,
+                rendered.truncated,
+                rendered.excluded,
+                encoding_tier=rendered.encoding_tier,
             )
-            self.output_handler.write(mdstr)
-            self.output_handler.on_after_md_section()
-            self.summary_track_file(file, mdstr, content_truncated, content_excluded)
+            self.summary_track_sub_rules(rendered.sub_rule_stats)
+            yield file, rendered
+
+    def iter_removed_listing(self, describe: Callable[[Path], str]) -> Iterator[str]:
+        for removed in self.removed_files:
+            pathname = describe(removed.path)
+            if removed.renamed_to is None:
+                yield TEMPLATE_LISTING_DELETED.substitute(pathname=pathname)
+            else:
+                yield TEMPLATE_LISTING_RENAMED.substitute(
+                    pathname=pathname, new_pathname=describe(removed.renamed_to)
+                )
+
+    def dedupe(self, rendered: RenderedFile, pathname: str) -> RenderedFile:
+        """
+        Records `rendered` as the first copy of its content, or returns a
+        reference to the first copy written in its place.
+        """
+        original = self.first_copies.setdefault(rendered.content_hash, pathname)
+        if original != pathname and not rendered.copy_of:
+            rendered = self.mdfmt.render_copy(
+                pathname, original, rendered.content_hash, rendered.content_nbytes
+            )
+        if rendered.copy_of:
+            self.summary.duplicate_files += 1
+            self.summary.duplicate_bytes += rendered.content_nbytes
+        return rendered
+
+    def renderer_copies(self) -> dict[str, str] | None:
+        """
+        The first_copies to pass to MdFormatter.render_file(), so that later
+        copies are rendered as references without decoding them; or None
+        where rendered sections are kept beyond this run (the render cache
+        stores full sections, whose content_hash dedupe() checks instead).
+        """
+        if not self.mdfmt.dedupe or self.render_cache is not None:
+            return None
+        return self.first_copies
+
+    def iter_renderers(
+        self, files: Sequence[Path], describe: Callable[[Path], str]
+    ) -> Iterator[tuple[Path, Callable[[], RenderedFile]]]:
+        """
+        Yields (file, get_rendered) pairs in the order of `files`.
+
+        Files found in the render cache are read from it when get_rendered()
+        is called; only the remaining files are handed to iter_pool_renderers,
+        and their results are stored in the cache. Files are looked up in the
+        cache up to CACHE_LOOKUP_AHEAD ahead of the caller rather than all at
+        once, so that memory use does not grow with the number of files (see
+        --compact).
+        """
+        cache = self.render_cache
+        if cache is None:
+            yield from self.iter_pool_renderers(files, describe)
+            return
+        fingerprint = self.mdfmt.options_fingerprint()
+        misses = FileQueue()
+        rendered_misses = self.iter_pool_renderers(misses, describe)
+        # (file, key, found in the cache) of the files looked up
+        looked_up: collections.deque[tuple[Path, "CacheKey | None", bool]] = (
+            collections.deque()
+        )
+        files_iter = iter(files)
+        while True:
+            for file in files_iter:
+                key = cache.key_for(file, describe(file), fingerprint)
+                hit = self.cache_contains(key)
+                looked_up.append((file, key, hit))
+                if not hit:
+                    misses.queue.append(file)
+                if len(looked_up) >= CACHE_LOOKUP_AHEAD:
+                    break
+            if not looked_up:
+                break
+            file, key, hit = looked_up.popleft()
+            if hit:
+                render = functools.partial(self.mdfmt.render_file, file, describe(file))
+                yield file, functools.partial(self.get_cached, key, render)
+            else:
+                _, get_rendered = next(rendered_misses)
+                yield file, functools.partial(self.render_and_cache, key, get_rendered)
+
+    def cache_contains(self, key: "CacheKey | None") -> bool:
+        assert self.render_cache is not None
+        return key is not None and self.render_cache.contains(key)
+
+    def get_cached(
+        self, key: "CacheKey", render: Callable[[], RenderedFile]
+    ) -> RenderedFile:
+        assert self.render_cache is not None
+        rendered = self.render_cache.get(key)
+        if rendered is not None:
+            self.summary.cache_hits += 1
+            return rendered
+        return self.render_and_cache(key, render)
+
+    def render_and_cache(
+        self, key: "CacheKey | None", render: Callable[[], RenderedFile]
+    ) -> RenderedFile:
+        assert self.render_cache is not None
+        rendered = render()
+        self.summary.cache_misses += 1
+        if key is not None and not rendered.copy_of:
+            self.render_cache.put(key, rendered)
+        return rendered
+
+    def iter_pool_renderers(
+        self, files: Iterable[Path], describe: Callable[[Path], str]
+    ) -> Iterator[tuple[Path, Callable[[], RenderedFile]]]:
+        """
+        Yields (file, get_rendered) pairs in the order of `files`, which are
+        iterated no further ahead than needed (see FileQueue).
+
+        With jobs == 1 each file is rendered lazily when get_rendered() is
+        called, from its content read ahead by read_threads threads (see
+        readahead.iter_read_ahead), if any. Otherwise files are rendered
+        ahead of the caller by a worker pool, whose workers read the files
+        themselves, and get_rendered() waits for the result of that file.
+        At most jobs * JOBS_PREFETCH_FACTOR results are held in memory at a
+        time.
+        """
+        if self.jobs <= 1 and self.read_threads > 0:
+            read_ahead = readahead.iter_read_ahead(
+                files,
+                threads=self.read_threads,
+                max_bytes=self.read_ahead_bytes,
+                should_read=self.mdfmt.needs_content,
+            )
+            for file, get_data in read_ahead:
+                yield file, functools.partial(
+                    self.render_read_ahead, file, describe(file), get_data
+                )
+            return
+        if self.jobs <= 1:
+            for file in files:
+                yield file, functools.partial(
+                    self.mdfmt.render_file,
+                    file,
+                    describe(file),
+                    copies=self.renderer_copies(),
+                )
+            return
+        with self.open_executor() as executor:
+            window = self.jobs * JOBS_PREFETCH_FACTOR
+            pending: collections.deque[
+                tuple[Path, "concurrent.futures.Future[RenderedFile]"]
+            ] = collections.deque()
+            files_iter = iter(files)
+            try:
+                while True:
+                    for file in files_iter:
+                        pending.append(
+                            (file, self.submit_render(executor, file, describe(file)))
+                        )
+                        if len(pending) >= window:
+                            break
+                    if not pending:
+                        break
+                    file, future = pending.popleft()
+                    yield file, future.result
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def render_read_ahead(
+        self, file: Path, pathdesc: str, get_data: Callable[[], bytes | None]
+    ) -> RenderedFile:
+        return self.mdfmt.render_file(
+            file, pathdesc, data=get_data(), copies=self.renderer_copies()
+        )
+
+    def open_executor(
+        self,
+    ) -> "contextlib.AbstractContextManager[concurrent.futures.Executor]":
+        """The shared pool, which is left running, or a pool of this writer's own."""
+        if self.pool is not None:
+            return contextlib.nullcontext(self.pool)
+        return self.make_executor()
+
+    def make_executor(self) -> "concurrent.futures.Executor":
+        import concurrent.futures
+
+        if self.executor == EXECUTOR_THREAD:
+            return concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs)
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.jobs,
+            initializer=_init_render_worker,
+            initargs=(self.mdfmt,),
+        )
+
+    def submit_render(
+        self, executor: "concurrent.futures.Executor", file: Path, pathdesc: str
+    ) -> "concurrent.futures.Future[RenderedFile]":
+        import concurrent.futures
+
+        if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            if executor is self.pool:
+                if self.shared_mdfmt is None:
+                    key = next(_shared_formatter_keys)
+                    self.shared_mdfmt = (key, pickle.dumps(self.mdfmt))
+                return executor.submit(
+                    _render_in_shared_worker, *self.shared_mdfmt, file, pathdesc
+                )
+            return executor.submit(_render_in_worker, file, pathdesc)
+        return executor.submit(self.mdfmt.render_file, file, pathdesc)
 
     def make_tag_substr(self):
         tpl = TEMPLATE_GENERATOR_TAG.template.strip()
@@ -295,46 +1287,47 @@ class MdWriter(contextlib.AbstractContextManager):
         return self.output_handler.on_complete()
 
     def describe_path(self, path: Path, bases: list[Path]) -> str:
-        for base in bases:
-            if base in path.parents:
-                relpos = path.relative_to(base).as_posix()
-                desc = f"{base.name}/{relpos}"
-                return desc
-        return path.as_posix()
+        return compact.PathDescriber(bases)(path)
+
+    def summary_track_sub_rules(self, stats: Iterable[SubRuleStat]):
+        matches = self.summary.sub_rule_matches
+        seconds = self.summary.sub_rule_seconds
+        for stat in stats:
+            matches[stat.rule_index] = matches.get(stat.rule_index, 0) + stat.matches
+            seconds[stat.rule_index] = seconds.get(stat.rule_index, 0.0) + stat.seconds
 
     def summary_track_file(
-        self, file: Path, content: str, content_truncated: bool, content_excluded: bool
+        self,
+        file: Path,
+        char_count: int,
+        content_truncated: bool,
+        content_excluded: bool,
+        *,
+        encoding_tier: str = "",
     ):
         ext = file.suffix
         if not ext:
             ext = file.name
         suffix2count = self.summary.suffix_to_file_count
         suffix2count[ext] = suffix2count.get(ext, 0) + 1
+        if encoding_tier:
+            tier2count = self.summary.encoding_tier_to_file_count
+            tier2count[encoding_tier] = tier2count.get(encoding_tier, 0) + 1
+        if self.summary.spill is not None:
+            self.summary.spill.add(
+                compact.FileRecord(
+                    file, char_count, content_truncated, content_excluded, encoding_tier
+                )
+            )
+            return
         self.summary.included_files.append(file)
         if content_excluded:
             self.summary.content_excluded_files[file] = True
         if content_truncated:
-            self.summary.truncated_files.append(file)
-        self.summary.files_to_char_count[file] = len(content)
-
-
-class TextSubstituter(ABC):
-    @abstractmethod
-    def substitute(self, s: str) -> str:
-        pass
-
-
-class RETextSubstituter(TextSubstituter):
-    def __init__(self, pattern: str, repl: str):
-        self.pattern = re.compile(pattern)
-        self.repl = repl
-        print(f"RETextSubstituter {pattern=}, {repl=}")
-
-    @override
-    def substitute(self, s: str) -> str:
-        result = self.pattern.sub(self.repl, s)
-        print(f"RETextSubstituter {self.pattern=}, {self.repl=}, {s=}, {result=}")
-        return result
+            self.summary.truncated_files.add(file)
+        self.summary.files_to_char_count[file] = char_count
+        if encoding_tier:
+            self.summary.files_to_encoding_tier[file] = encoding_tier
 
 
 class MdFormatter:
@@ -346,99 +1339,335 @@ class MdFormatter:
         max_lines_per_file: int,
         mlpf_approx_pct: int,
         sub_rules_file: str,
+        profile: bool = False,
+        dedupe: bool = False,
     ):
         self.tag_str = tag_str
+        self.content_scanner = compile_content_scanner(tag_str)
         self.exclude_empty = exclude_empty
         self.max_lines_per_file = max_lines_per_file
         self.mlpf_approx_pct = mlpf_approx_pct
         self.sub_rules_file = sub_rules_file
         self.compiled_sub_rules = self.compile_sub_rules()
+        self.sub_rules = subrules.SubRules(self.compiled_sub_rules)
+        # attach a profiling.FileTrace to each RenderedFile
+        self.profile = profile
+        # set RenderedFile.content_hash, see MdWriter.dedupe()
+        self.dedupe = dedupe
+
+    def options_fingerprint(self) -> str:
+        """
+        A digest of everything besides the file itself that affects the
+        rendered section, used to key the render cache.
+        """
+        import hashlib
+
+        hasher = hashlib.sha256()
+        options = [
+            files2md.__version__,
+            self.tag_str,
+            self.exclude_empty,
+            self.max_lines_per_file,
+            self.mlpf_approx_pct,
+            self.dedupe,
+        ]
+        hasher.update(repr(options).encode("utf-8"))
+        if self.sub_rules_file:
+            hasher.update(Path(self.sub_rules_file).read_bytes())
+        return hasher.hexdigest()
 
     def compile_sub_rules(self) -> list[TextSubstituter]:
-        # Linewise comments are supported in the substitution rules file via the `#` character.
-        # Inline comments are not supported.
-        # To begin a substitution with a literal `#` character, escape it with a backslash.
-        # This works because Python's regex parser treats `\#` as a literal `#`.
-        # Alternatively you could use a character class: `[#]`.
-        # Separate the pattern and replacement with one or more tabs.
-        re_comment_line = re.compile(r"^\s*#")
+        # See files2md.subrules for the format of the substitution rules file.
         if not self.sub_rules_file:
             return []
-        substituters = []
-        with open(self.sub_rules_file) as fh:
-            for line in fh:
-                if re_comment_line.match(line):
-                    continue
-                line = line.rstrip("\r\n")
-                split = re.split(r"\t+", line)
-                if len(split) != 2:
-                    continue
-                substituter = RETextSubstituter(split[0], split[1])
-                substituters.append(substituter)
-        return substituters
+        return subrules.parse_rules_file(self.sub_rules_file)
 
     def make_header_md(self, project_name: str, pathdescs: Iterable[str]):
-        files_listing = self.make_files_listing(pathdescs)
-        header_parts = [
-            TEMPLATE_PROJECT.substitute(project_name=project_name),
-            TEMPLATE_GENERATOR_TAG.substitute(files2md_version=files2md.__version__),
-            TEMPLATE_FILELIST.substitute(files_listing=files_listing),
-        ]
-        header = "\n".join(header_parts)
-        return header
+        return "".join(self.iter_header_md(project_name, pathdescs))
 
-    def make_files_listing(self, pathdescs):
-        files_lines = []
-        for pathdesc in pathdescs:
-            files_lines.append(f"`{pathdesc}`")
-        files_lines_str = "\n".join(files_lines)
-        return files_lines_str
+    def iter_header_md(
+        self,
+        project_name: str,
+        pathdescs: Iterable[str],
+        removed_lines: Iterable[str] = (),
+    ) -> Iterator[str]:
+        """
+        The header of make_header_md() in pieces, listing a batch of files
+        each, followed by `removed_lines` (see MdWriter.iter_removed_listing).
+        """
+        yield TEMPLATE_PROJECT.substitute(project_name=project_name) + "\n"
+        yield TEMPLATE_GENERATOR_TAG.substitute(
+            files2md_version=files2md.__version__
+        ) + "\n"
+        yield TEMPLATE_FILELIST_HEAD.substitute()
+        separator = ""
+        lines = itertools.chain(
+            (f"`{pathdesc}`" for pathdesc in pathdescs), removed_lines
+        )
+        for batch in itertools.batched(lines, HEADER_LISTING_BATCH):
+            yield separator + "\n".join(batch)
+            separator = "\n"
+        yield TEMPLATE_FILELIST_TAIL.substitute()
 
     def binfile_to_md(self, _file: Path, pathname: str):
         mdchunk = TEMPLATE_BINARY_FILE.substitute(pathname=pathname)
         return mdchunk
 
+    def analyze_content(self, content: str) -> ContentInfo:
+        return analyze_content(content, self.content_scanner)
+
     def fence_for_content(self, content: str):
-        fence = "`" * MIN_FENCE_LEN
-        for i in range(MIN_FENCE_LEN, MAX_FENCE_LEN + 1):
-            fence = "`" * i
-            if fence not in content:
-                break
-        return fence
+        return self.analyze_content(content).fence
 
     def textfile_to_md(
-        self, file: Path, pathname: str, encoding: str
+        self,
+        file: Path,
+        pathname: str,
+        encoding: str,
+        *,
+        buf: filebuf.FileBuffer | None = None,
     ) -> tuple[str, bool]:
-        included_lines, omitted_lines = self.read_file_lines(file, encoding)
-        for tuter in self.compiled_sub_rules:
-            included_lines = tuter.substitute("".join(included_lines)).splitlines(True)
+        rendered = self.render_textfile(file, pathname, encoding, buf=buf)
+        return rendered.mdchunk, rendered.truncated
+
+    def render_textfile(
+        self,
+        file: Path,
+        pathname: str,
+        encoding: str,
+        *,
+        buf: filebuf.FileBuffer | None = None,
+        encoding_tier: str = "",
+        mdlang: str | None = None,
+        trace: profiling.FileTrace | None = None,
+        stream: bool = True,
+    ) -> RenderedFile:
+        """
+        Renders a text file section, from `buf` if given. With `stream`,
+        the content of large files may be a StreamedContent, which reads the
+        file again when written; pass False if `buf` is not read from the
+        file as it is now.
+        """
+        if buf is not None and self.may_pass_through(buf, encoding):
+            rendered = self.render_passthrough_textfile(
+                file,
+                pathname,
+                encoding,
+                buf,
+                encoding_tier=encoding_tier,
+                mdlang=mdlang,
+                trace=trace,
+                stream=stream,
+            )
+            if rendered is not None:
+                return rendered
+        if buf is not None and stream and self.may_stream(buf, encoding):
+            rendered = self.render_streamed_textfile(
+                file,
+                pathname,
+                encoding,
+                buf,
+                encoding_tier=encoding_tier,
+                mdlang=mdlang,
+                trace=trace,
+            )
+            if rendered is not None:
+                return rendered
+        if buf is None:
+            included_lines, omitted_line_count = self.read_file_lines(file, encoding)
+        else:
+            included_lines, omitted_line_count = self.read_buffer_lines(buf, encoding)
+        content = "".join(included_lines)
+        if trace is not None:
+            trace.mark(profiling.PHASE_DECODE)
+        content, sub_rule_stats = self.sub_rules.apply(content)
+        if trace is not None:
+            trace.mark(profiling.PHASE_SUBSTITUTE)
         omission_msg = ""
         truncated = False
-        if omitted_lines:
+        if omitted_line_count:
             omission_msg = TEMPLATE_OMISSION.substitute(
-                omitted_line_count=len(omitted_lines)
+                omitted_line_count=omitted_line_count
             )
             truncated = True
-        content = "".join(included_lines)
-        if self.exclude_by_content(content):
-            return "", truncated
-        mdlang = self.guess_md_lang(file, content)
-        fence = self.fence_for_content(content)
-        mdchunk = TEMPLATE_FILE.substitute(
-            pathname=pathname,
-            fence=fence,
+        fragments: tuple[str, ...] = ()
+        content_info = self.analyze_content(content)
+        if not self.exclude_by_content_info(content_info):
+            if mdlang is None:
+                mdlang = self.guess_md_lang(file, content)
+            fragments = (
+                TEMPLATE_FILE_HEAD.substitute(
+                    pathname=pathname, fence=content_info.fence, mdlang=mdlang
+                ),
+                content,
+                TEMPLATE_FILE_TAIL.substitute(
+                    fence=content_info.fence, omission_msg=omission_msg
+                ),
+            )
+        if trace is not None:
+            trace.mark(profiling.PHASE_FORMAT)
+        return RenderedFile(
+            fragments=fragments,
+            truncated=truncated,
+            excluded=False,
+            encoding_tier=encoding_tier,
+            sub_rule_stats=tuple(sub_rule_stats),
+            trace=trace,
+        )
+
+    def may_stream(self, buf: filebuf.FileBuffer, encoding: str) -> bool:
+        """
+        Whether the content of `buf` is large enough to be streamed (see
+        StreamedContent) and is written unchanged: there are no substitution
+        rules, and it is not truncated, as far as can be told without
+        decoding it.
+        """
+        if len(buf) < STREAM_CONTENT_MIN_BYTES or self.sub_rules:
+            return False
+        max_lines = self.max_included_lines()
+        if max_lines and filebuf.is_ascii_compatible(encoding):
+            return filebuf.count_lines(buf) <= max_lines
+        return True
+
+    def render_streamed_textfile(
+        self,
+        file: Path,
+        pathname: str,
+        encoding: str,
+        buf: filebuf.FileBuffer,
+        *,
+        encoding_tier: str = "",
+        mdlang: str | None = None,
+        trace: profiling.FileTrace | None = None,
+    ) -> RenderedFile | None:
+        """
+        Renders a section whose content is a StreamedContent, after a pass
+        over the content that keeps only its ContentInfo. Returns None if
+        the content turns out to be truncated, or the file changed since
+        `buf` was read.
+        """
+        stamp = stream_stamp(file, buf)
+        if stamp is None:
+            return None
+        decoded_chunks = filebuf.iter_decoded_chunks(buf, encoding)
+        content_info, char_count = analyze_chunks(decoded_chunks, self.content_scanner)
+        max_lines = self.max_included_lines()
+        if max_lines and content_info.line_count > max_lines:
+            return None
+        return self.render_unchanged_content(
+            file,
+            pathname,
+            StreamedContent(file, encoding, char_count, stamp=stamp),
+            content_info,
+            encoding_tier=encoding_tier,
             mdlang=mdlang,
-            content=content,
-            omission_msg=omission_msg,
+            trace=trace,
+        )
+
+    def may_pass_through(self, buf: filebuf.FileBuffer, encoding: str) -> bool:
+        """
+        Whether the bytes of `buf` may be written to UTF-8 output as they
+        are: they are UTF-8 without line endings to translate, there are no
+        substitution rules, and the content is not truncated. Whether they
+        are valid UTF-8 is only known once they are decoded.
+        """
+        if encoding != "utf-8" or self.sub_rules or buf.find(b"\r") != -1:
+            return False
+        max_lines = self.max_included_lines()
+        return not max_lines or filebuf.count_lines(buf) <= max_lines
+
+    def render_passthrough_textfile(
+        self,
+        file: Path,
+        pathname: str,
+        encoding: str,
+        buf: filebuf.FileBuffer,
+        *,
+        encoding_tier: str = "",
+        mdlang: str | None = None,
+        trace: profiling.FileTrace | None = None,
+        stream: bool = True,
+    ) -> RenderedFile | None:
+        """
+        Renders a section whose content is the bytes of the file: a
+        Utf8Content, or a passthrough StreamedContent for files large enough
+        to be streamed (if `stream`). Returns None if the file is not valid
+        UTF-8.
+        """
+        content: Utf8Content | StreamedContent
+        stamp = None
+        if stream and len(buf) >= STREAM_CONTENT_MIN_BYTES:
+            stamp = stream_stamp(file, buf)
+        try:
+            if stamp is not None:
+                decoded_chunks = filebuf.iter_decoded_chunks(
+                    buf, encoding, errors="strict"
+                )
+                content_info, char_count = analyze_chunks(
+                    decoded_chunks, self.content_scanner
+                )
+                content = StreamedContent(
+                    file, encoding, char_count, passthrough=True, stamp=stamp
+                )
+            else:
+                text = str(buf, encoding)
+                content_info = self.analyze_content(text)
+                content = Utf8Content(bytes(buf), len(text))
+        except UnicodeDecodeError:
+            return None
+        return self.render_unchanged_content(
+            file,
+            pathname,
+            content,
+            content_info,
+            encoding_tier=encoding_tier,
+            mdlang=mdlang,
+            trace=trace,
+        )
+
+    def render_unchanged_content(
+        self,
+        file: Path,
+        pathname: str,
+        content: Utf8Content | StreamedContent,
+        content_info: ContentInfo,
+        *,
+        encoding_tier: str = "",
+        mdlang: str | None = None,
+        trace: profiling.FileTrace | None = None,
+    ) -> RenderedFile:
+        if trace is not None:
+            trace.mark(profiling.PHASE_DECODE)
+        fragments: tuple[Fragment, ...] = ()
+        if not self.exclude_by_content_info(content_info):
+            if mdlang is None:
+                mdlang = self.guess_md_lang(file, "")
+            fragments = (
+                TEMPLATE_FILE_HEAD.substitute(
+                    pathname=pathname, fence=content_info.fence, mdlang=mdlang
+                ),
+                content,
+                TEMPLATE_FILE_TAIL.substitute(
+                    fence=content_info.fence, omission_msg=""
+                ),
+            )
+        if trace is not None:
+            trace.mark(profiling.PHASE_FORMAT)
+        return RenderedFile(
+            fragments=fragments,
+            truncated=False,
+            excluded=False,
+            encoding_tier=encoding_tier,
+            trace=trace,
         )
-        return mdchunk, truncated
 
     def exclude_by_content(self, content: str):
-        content_without_ws = content.strip()
-        content_is_empty = not content_without_ws
-        if content_is_empty and self.exclude_empty:
+        return self.exclude_by_content_info(self.analyze_content(content))
+
+    def exclude_by_content_info(self, content_info: ContentInfo):
+        if content_info.is_blank and self.exclude_empty:
             return True
-        if self.tag_str and self.tag_str in content:
+        if content_info.has_tag:
             return True
         return False
 
@@ -449,24 +1678,156 @@ class MdFormatter:
         *,
         encoding_errors: str = "replace",
     ):
-        with open(file, encoding=encoding, errors=encoding_errors) as fh:
-            lines = []
-            omitted_lines = []
-            for i, line in enumerate(fh):
-                if i < self.max_lines_per_file or self.max_lines_per_file <= 0:
-                    lines.append(line)
-                else:
-                    omitted_lines.append(line)
+        with filebuf.open_file_buffer(file) as buf:
+            return self.read_buffer_lines(
+                buf, encoding, encoding_errors=encoding_errors
+            )
+
+    def max_included_lines(self) -> int:
+        """
+        The most lines of a file that are included without truncating it:
+        max_lines_per_file plus the mlpf_approx_pct grace lines, or 0 if
+        there is no limit.
+        """
+        if self.max_lines_per_file <= 0:
+            return 0
+        wiggleroom = 0
         if self.mlpf_approx_pct > 0:
             wiggleroom = self.max_lines_per_file * self.mlpf_approx_pct // 100
-            if len(omitted_lines) <= wiggleroom:
-                lines.extend(omitted_lines)
-                omitted_lines = []
-        return lines, omitted_lines
+        return self.max_lines_per_file + wiggleroom
+
+    def read_buffer_lines(
+        self,
+        buf: filebuf.FileBuffer,
+        encoding: str,
+        *,
+        encoding_errors: str = "replace",
+    ) -> tuple[list[str], int]:
+        """
+        Returns the lines to include and the number of lines omitted due to
+        max_lines_per_file.
+
+        Only the lines that may be included are decoded and kept: up to
+        max_lines_per_file plus the mlpf_approx_pct grace lines. The rest of
+        the file is counted on the raw bytes, or decoded without being kept
+        if the encoding does not allow that, so memory use does not grow
+        with the size of the file.
+        """
+        decoded_lines = filebuf.iter_decoded_lines(
+            buf, encoding, errors=encoding_errors
+        )
+        max_lines = self.max_included_lines()
+        if not max_lines:
+            return list(decoded_lines), 0
+        if filebuf.is_ascii_compatible(encoding):
+            line_count = filebuf.count_lines(buf)
+            if line_count <= max_lines:
+                return list(decoded_lines), 0
+            lines = list(itertools.islice(decoded_lines, self.max_lines_per_file))
+            return lines, line_count - len(lines)
+        lines = list(itertools.islice(decoded_lines, max_lines))
+        omitted_line_count = sum(1 for _ in decoded_lines)
+        if omitted_line_count:
+            omitted_line_count += len(lines) - self.max_lines_per_file
+            del lines[self.max_lines_per_file :]
+        return lines, omitted_line_count
+
+    def needs_content(self, file: Path) -> bool:
+        """False if render_file() renders `file` without reading it."""
+        return fileinfo.classify_file(file).decision != fileinfo.DECISION_SKIP_BY_MIME
+
+    def render_file(
+        self,
+        file: Path,
+        pathname: str,
+        *,
+        data: bytes | None = None,
+        copies: dict[str, str] | None = None,
+    ) -> RenderedFile:
+        """
+        Renders one file section. The file is opened and read once, unless
+        its content is passed as `data`; the same buffer is used for
+        hashing, encoding detection, decoding and line splitting.
+
+        With dedupe, a file whose content_hash is in `copies` (pathnames of
+        earlier files by content_hash) is rendered as a reference to that
+        file, without being decoded.
+        """
+        trace = profiling.FileTrace.start() if self.profile else None
+        fileclass = fileinfo.classify_file(file)
+        if trace is not None:
+            trace.mark(profiling.PHASE_CLASSIFY)
+        if fileclass.decision == fileinfo.DECISION_SKIP_BY_MIME:
+            mdchunk = TEMPLATE_UNSUPPORTED_MIMETYPE.substitute(
+                pathname=pathname,
+                mimetype=fileclass.mimetype,
+            )
+            return RenderedFile(
+                fragments=(mdchunk,), truncated=False, excluded=True, trace=trace
+            )
+        if data is None:
+            buffer = filebuf.open_file_buffer(file)
+        else:
+            buffer = contextlib.nullcontext(data)
+        with buffer as buf:
+            content_hash = content_digest(buf) if self.dedupe and len(buf) else ""
+            original = copies.get(content_hash) if copies and content_hash else None
+            if original is not None and original != pathname:
+                return self.render_copy(
+                    pathname, original, content_hash, len(buf), trace=trace
+                )
+            encoding, tier = self.detect_buffer_encoding(buf)
+            if trace is not None:
+                trace.nbytes = len(buf)
+                trace.mark(profiling.PHASE_DETECT)
+            if encoding == "binary":
+                return RenderedFile(
+                    fragments=(self.binfile_to_md(file, pathname),),
+                    truncated=True,
+                    excluded=False,
+                    encoding_tier=tier,
+                    trace=trace,
+                )
+            rendered = self.render_textfile(
+                file,
+                pathname,
+                encoding,
+                buf=buf,
+                encoding_tier=tier,
+                mdlang=fileclass.mdlang,
+                trace=trace,
+                # passed data may be older than the file
+                stream=data is None,
+            )
+            if content_hash and rendered.fragments:
+                rendered = dataclasses.replace(
+                    rendered, content_hash=content_hash, content_nbytes=len(buf)
+                )
+            return rendered
+
+    def render_copy(
+        self,
+        pathname: str,
+        original: str,
+        content_hash: str,
+        content_nbytes: int,
+        *,
+        trace: profiling.FileTrace | None = None,
+    ) -> RenderedFile:
+        mdchunk = TEMPLATE_COPY.substitute(pathname=pathname, original=original)
+        return RenderedFile(
+            fragments=(mdchunk,),
+            truncated=False,
+            excluded=False,
+            trace=trace,
+            content_hash=content_hash,
+            content_nbytes=content_nbytes,
+            copy_of=original,
+        )
 
     def file_to_md(self, file: Path, pathname: str) -> tuple[str, bool, bool]:
         """
-        Returns a tuple of (mdchunk, content_excluded)
+        Returns a tuple of (mdchunk, content_truncated, content_excluded)
 
         mdchunk: str
             The markdown content for the file
@@ -475,67 +1836,118 @@ class MdFormatter:
         content_excluded: bool
             True if the content was excluded, False otherwise
         """
-        truncated = False
-        excluded = False
-        has_md_lang = fileinfo.FILEEXT_TO_MDLANG.get(file.suffix.lower(), False)
-        if self.exclude_by_mime(file) and not has_md_lang:
-            truncated = False
-            excluded = True
-            return (
-                TEMPLATE_UNSUPPORTED_MIMETYPE.substitute(
-                    pathname=pathname,
-                    mimetype=self.guess_mime_type(file),
-                ),
-                truncated,
-                excluded,
-            )
-        encoding = self.detect_encoding(file)
-        if encoding == "binary":
-            truncated = True
-            excluded = False
-            return self.binfile_to_md(file, pathname), truncated, excluded
-
-        mdchunk, truncated = self.textfile_to_md(file, pathname, encoding)
-        return mdchunk, truncated, excluded
+        rendered = self.render_file(file, pathname)
+        return rendered.mdchunk, rendered.truncated, rendered.excluded
 
     def guess_mime_type(self, file: Path):
-        mimetype, _ = mimetypes.guess_type(file)
-        if not mimetype:
-            return ""
-        return mimetype
-
-    def exclude_by_mime(self, file: Path):
-        mimetype = self.guess_mime_type(file)
-        if mimetype in fileinfo.OK_MIMETYPES:
-            return False
-        supertype = mimetype.split("/")[0]
-        if supertype in fileinfo.IGNORE_MIME_SUPERTYPES:
-            return True
-        return False
+        return fileinfo.classify_file(file).mimetype
 
-    def detect_encoding(self, file_path: Path, *, max_bytes: int = 100_000):
-        if not charset_normalizer:
-            return "utf-8"
+    def exclude_by_mime(self, file: Path, *, mimetype: str | None = None):
+        if mimetype is None:
+            mimetype = self.guess_mime_type(file)
+        return fileinfo.excluded_by_mime(mimetype)
+
+    def detect_encoding(
+        self, file_path: Path, *, max_bytes: int = DETECT_ENCODING_MAX_BYTES
+    ):
+        encoding, _ = self.detect_encoding_tiered(file_path, max_bytes=max_bytes)
+        return encoding
+
+    def detect_encoding_tiered(
+        self, file_path: Path, *, max_bytes: int = DETECT_ENCODING_MAX_BYTES
+    ) -> tuple[str, str]:
         with open(file_path, "rb") as file:
             blob = file.read(max_bytes)
-            matches = charset_normalizer.from_bytes(blob)
-            if not matches:
-                return "binary"
-            best = matches.best()
-            if not best:
-                return "binary"
-            return best.encoding
+        return encoding_detect.detect_encoding(blob, complete=len(blob) < max_bytes)
+
+    def detect_buffer_encoding(
+        self,
+        buf: filebuf.FileBuffer,
+        *,
+        max_bytes: int = DETECT_ENCODING_MAX_BYTES,
+    ) -> tuple[str, str]:
+        blob = buf[:max_bytes]
+        return encoding_detect.detect_encoding(blob, complete=len(buf) <= max_bytes)
 
     def guess_md_lang(self, file_path: Path, _content: str):
-        suffix = file_path.suffix
-        if not suffix:
-            return ""
-        if suffix in fileinfo.FILEEXT_TO_MDLANG:
-            return fileinfo.FILEEXT_TO_MDLANG[suffix]
-        return fileinfo.FILEEXT_TO_MDLANG.get(suffix.lower(), "")
+        return fileinfo.classify_file(file_path).mdlang
 
     def make_tag_substr(self):
         tpl = TEMPLATE_GENERATOR_TAG.template.strip()
         spl = re.split(r"(\s+)", tpl)
         substr = "".join(spl[1:-1]).strip()
         return substr
+
+
+def stream_stamp(file: Path, buf: filebuf.FileBuffer) -> filebuf.FileStamp | None:
+    """
+    The stamp of a StreamedContent of `file` analyzed from `buf`, or None if
+    the file no longer has the size of `buf`. It is taken before the
+    content is analyzed, so a write to the file after that changes it.
+    """
+    try:
+        st = os.stat(file)
+    except OSError:
+        return None
+    if st.st_size != len(buf):
+        return None
+    return filebuf.file_stamp(st)
+
+
+def content_digest(buf: filebuf.FileBuffer) -> str:
+    import hashlib
+
+    return hashlib.blake2b(buf, digest_size=16).hexdigest()
+
+
+# Process pool workers receive the MdFormatter once, via the pool initializer,
+# rather than pickling it along with every file.
+_worker_mdfmt: MdFormatter | None = None
+
+
+def _init_render_worker(mdfmt: MdFormatter):
+    global _worker_mdfmt
+    _worker_mdfmt = mdfmt
+
+
+def _render_in_worker(file: Path, pathdesc: str) -> RenderedFile:
+    assert _worker_mdfmt is not None, "render worker was not initialized"
+    return _worker_mdfmt.render_file(file, pathdesc)
+
+
+def make_shared_pool(jobs: int, executor: str) -> "concurrent.futures.Executor":
+    """
+    A pool of `jobs` workers for several MdWriters (see MdWriter's pool),
+    which is shut down by the caller. Process workers are not initialized
+    with a formatter; each writer sends its own along with the files. They
+    are started here, so call this before starting threads: forking a
+    multi-threaded process may deadlock the children.
+    """
+    import concurrent.futures
+
+    if executor == EXECUTOR_THREAD:
+        return concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    pool.submit(int).result()
+    return pool
+
+
+# keys of the formatters sent to shared process pools, unique per process
+_shared_formatter_keys = itertools.count()
+# formatters received by this worker, by key, least recently used first
+_worker_shared_mdfmts: collections.OrderedDict[int, MdFormatter] = (
+    collections.OrderedDict()
+)
+
+
+def _render_in_shared_worker(
+    key: int, mdfmt_pickle: bytes, file: Path, pathdesc: str
+) -> RenderedFile:
+    mdfmt = _worker_shared_mdfmts.get(key)
+    if mdfmt is None:
+        mdfmt = _worker_shared_mdfmts[key] = pickle.loads(mdfmt_pickle)
+        if len(_worker_shared_mdfmts) > SHARED_FORMATTERS_KEPT:
+            _worker_shared_mdfmts.popitem(last=False)
+    else:
+        _worker_shared_mdfmts.move_to_end(key)
+    return mdfmt.render_file(file, pathdesc)
@@ -0,0 +1,215 @@
+import contextlib
+import os
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator
+
+import files2md
+
+# Phases of rendering one file, in the order MdFormatter.render_file()
+# passes through them; see FileTrace.mark().
+PHASE_CLASSIFY = "classify"
+PHASE_DETECT = "read+detect"
+PHASE_DECODE = "decode"
+PHASE_SUBSTITUTE = "substitute"
+PHASE_FORMAT = "format"
+
+DEFAULT_TOP_N = 10
+
+
+@dataclass
+class FileTrace:
+    """
+    Wall and CPU clock readings taken while one file is rendered, possibly
+    in a worker process. perf_counter_ns() is system-wide, so the readings
+    line up with those of the main process.
+    """
+
+    pid: int
+    tid: int
+    start_ns: int
+    cpu_start_ns: int
+    # (phase, wall clock at its end, thread CPU clock at its end)
+    marks: list[tuple[str, int, int]] = field(default_factory=list)
+    # size of the file
+    nbytes: int = 0
+
+    @classmethod
+    def start(cls) -> "FileTrace":
+        return cls(
+            pid=os.getpid(),
+            tid=threading.get_native_id(),
+            start_ns=time.perf_counter_ns(),
+            cpu_start_ns=time.thread_time_ns(),
+        )
+
+    def mark(self, phase: str):
+        self.marks.append((phase, time.perf_counter_ns(), time.thread_time_ns()))
+
+    @property
+    def end_ns(self) -> int:
+        return self.marks[-1][1] if self.marks else self.start_ns
+
+    @property
+    def cpu_ns(self) -> int:
+        return self.marks[-1][2] - self.cpu_start_ns if self.marks else 0
+
+
+@dataclass
+class StageStat:
+    name: str
+    # number of items (e.g. files) and bytes the stage processed, if known
+    items: int = 0
+    nbytes: int = 0
+
+
+@dataclass(frozen=True)
+class FileStat:
+    pathname: str
+    wall_s: float
+    cpu_s: float
+    nbytes: int
+
+
+class Profiler:
+    """
+    Collects the wall time, CPU time and bytes of each stage of a run and
+    of each rendered file as Chrome trace events, which write() saves in a
+    file that Perfetto (https://ui.perfetto.dev) or chrome://tracing can
+    open. With trace_memory, the tracemalloc peak of each stage is recorded
+    as well; it covers allocations of the main process only.
+    """
+
+    def __init__(self, *, trace_memory: bool = True):
+        self.origin_ns = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.tid = threading.get_native_id()
+        self.events: list[dict] = []
+        self.file_stats: list[FileStat] = []
+        self.named_pids: set[int] = set()
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.name_process(self.pid, "files2md")
+
+    def us(self, ns: int) -> float:
+        return (ns - self.origin_ns) / 1000
+
+    def name_process(self, pid: int, name: str):
+        self.named_pids.add(pid)
+        self.events.append(
+            {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}}
+        )
+
+    def complete_event(
+        self,
+        name: str,
+        cat: str,
+        start_ns: int,
+        end_ns: int,
+        *,
+        pid: int,
+        tid: int,
+        args: dict,
+    ):
+        self.events.append(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": self.us(start_ns),
+                "dur": (end_ns - start_ns) / 1000,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            }
+        )
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[StageStat]:
+        stat = StageStat(name)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start_ns = time.perf_counter_ns()
+        cpu_start_ns = time.process_time_ns()
+        try:
+            yield stat
+        finally:
+            end_ns = time.perf_counter_ns()
+            args: dict = {
+                "cpu_ms": (time.process_time_ns() - cpu_start_ns) / 1e6,
+                "items": stat.items,
+                "bytes": stat.nbytes,
+            }
+            if self.trace_memory:
+                args["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            self.complete_event(
+                name, "stage", start_ns, end_ns, pid=self.pid, tid=self.tid, args=args
+            )
+
+    def add_file(self, pathname: str, trace: FileTrace):
+        if trace.pid not in self.named_pids:
+            self.name_process(trace.pid, "render worker")
+        wall_ns = trace.end_ns - trace.start_ns
+        self.file_stats.append(
+            FileStat(pathname, wall_ns / 1e9, trace.cpu_ns / 1e9, trace.nbytes)
+        )
+        args = {"path": pathname, "cpu_ms": trace.cpu_ns / 1e6, "bytes": trace.nbytes}
+        self.complete_event(
+            pathname,
+            "file",
+            trace.start_ns,
+            trace.end_ns,
+            pid=trace.pid,
+            tid=trace.tid,
+            args=args,
+        )
+        start_ns, cpu_start_ns = trace.start_ns, trace.cpu_start_ns
+        for phase, end_ns, cpu_end_ns in trace.marks:
+            self.complete_event(
+                phase,
+                "phase",
+                start_ns,
+                end_ns,
+                pid=trace.pid,
+                tid=trace.tid,
+                args={"cpu_ms": (cpu_end_ns - cpu_start_ns) / 1e6},
+            )
+            start_ns, cpu_start_ns = end_ns, cpu_end_ns
+
+    def add_write(self, pathname: str, start_ns: int, nchars: int):
+        self.complete_event(
+            "write",
+            "write",
+            start_ns,
+            time.perf_counter_ns(),
+            pid=self.pid,
+            tid=self.tid,
+            args={"path": pathname, "chars": nchars},
+        )
+
+    def slowest_files(self, n: int = DEFAULT_TOP_N) -> list[FileStat]:
+        return sorted(self.file_stats, key=lambda s: s.wall_s, reverse=True)[:n]
+
+    def write(self, path: Path):
+        import json
+
+        trace = {
+            "traceEvents": self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {"files2md_version": files2md.__version__},
+        }
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(trace, fh)
+
+
+def maybe_stage(
+    profiler: Profiler | None, name: str
+) -> contextlib.AbstractContextManager[StageStat]:
+    """Profiler.stage(), or a no-op returning a throwaway StageStat."""
+    if profiler is None:
+        return contextlib.nullcontext(StageStat(name))
+    return profiler.stage(name)
@@ -0,0 +1,107 @@
+import collections
+import functools
+import os
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
+
+import files2md.filebuf as filebuf
+
+# concurrent.futures is imported where it is used; see md_transform.
+if TYPE_CHECKING:
+    import concurrent.futures
+
+DEFAULT_READ_THREADS = 4
+# files read ahead of the consumer, per read thread
+READ_AHEAD_FILES_PER_THREAD = 16
+DEFAULT_READ_AHEAD_BYTES = 64 * 2**20
+
+
+def iter_read_ahead(
+    files: Iterable[Path],
+    *,
+    threads: int = DEFAULT_READ_THREADS,
+    max_bytes: int = DEFAULT_READ_AHEAD_BYTES,
+    should_read: Callable[[Path], bool] = lambda _file: True,
+) -> Iterator[tuple[Path, Callable[[], bytes | None]]]:
+    """
+    Yields (file, get_data) pairs in the order of `files`, while a pool of
+    `threads` threads reads the following files, so that reads overlap with
+    each other and with the caller's processing of the data.
+
+    get_data() waits for and returns the content of the file, or None if
+    the file was not read: `should_read` returned False for it, it is large
+    enough to be mapped into memory instead (see filebuf.open_file_buffer),
+    or reading it failed. The caller then opens the file itself, and sees
+    any error.
+
+    Reading ahead pauses when threads * READ_AHEAD_FILES_PER_THREAD files,
+    or the data of files read up to `max_bytes`, are waiting for the
+    caller. The files being read may add up to `threads` times
+    filebuf.MMAP_THRESHOLD to that.
+    """
+    import concurrent.futures
+
+    max_files = threads * READ_AHEAD_FILES_PER_THREAD
+    lock = threading.Lock()
+    # bytes read but not yet claimed by get_data()
+    unclaimed_bytes = 0
+
+    def read(file: Path) -> bytes | None:
+        nonlocal unclaimed_bytes
+        data = read_small_file(file)
+        if data:
+            with lock:
+                unclaimed_bytes += len(data)
+        return data
+
+    def claim(future: "concurrent.futures.Future[bytes | None]") -> bytes | None:
+        nonlocal unclaimed_bytes
+        data = future.result()
+        if data:
+            with lock:
+                unclaimed_bytes -= len(data)
+        return data
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=threads, thread_name_prefix="files2md-read"
+    ) as executor:
+        pending: collections.deque[
+            tuple[Path, "concurrent.futures.Future[bytes | None]"]
+        ] = collections.deque()
+        files_iter = iter(files)
+        try:
+            while True:
+                while len(pending) < max_files and unclaimed_bytes < max_bytes:
+                    file = next(files_iter, None)
+                    if file is None:
+                        break
+                    if should_read(file):
+                        pending.append((file, executor.submit(read, file)))
+                    else:
+                        pending.append((file, completed(None)))
+                if not pending:
+                    break
+                file, future = pending.popleft()
+                yield file, functools.partial(claim, future)
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def read_small_file(file: Path) -> bytes | None:
+    try:
+        with open(file, "rb") as fh:
+            if os.fstat(fh.fileno()).st_size >= filebuf.MMAP_THRESHOLD:
+                return None
+            return fh.read()
+    except OSError:
+        return None
+
+
+def completed(data: bytes | None) -> "concurrent.futures.Future[bytes | None]":
+    import concurrent.futures
+
+    future: concurrent.futures.Future[bytes | None] = concurrent.futures.Future()
+    future.set_result(data)
+    return future
@@ -0,0 +1,341 @@
+import collections
+import contextlib
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from files2md.md_transform import RenderedFile, Utf8Content
+
+# beneath $XDG_CACHE_HOME, or ~/.cache if it is not set
+CACHE_DIR_NAME = "files2md"
+DEFAULT_CACHE_MAX_BYTES = 256 * 2**20
+CACHE_DB_NAME = "render-cache.sqlite3"
+# Bumped whenever the table layout changes; older databases are recreated.
+CACHE_SCHEMA_VERSION = 3
+# A file modified this recently may be modified again within the same mtime
+# tick without changing size, so its rendering is not stored (cf. git's
+# "racily clean" entries).
+RACY_MTIME_NS = 2 * 10**9
+COMMIT_EVERY_N_PUTS = 500
+BUSY_TIMEOUT_S = 30.0
+
+
+@dataclass(frozen=True)
+class CacheKey:
+    path: str
+    pathname: str
+    fingerprint: str
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+def stat_key(file: Path, pathname: str, fingerprint: str) -> CacheKey | None:
+    try:
+        st = file.stat()
+    except OSError:
+        return None
+    return CacheKey(
+        path=str(file),
+        pathname=pathname,
+        fingerprint=fingerprint,
+        size=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+        inode=st.st_ino,
+    )
+
+
+class RenderCache(contextlib.AbstractContextManager):
+    """
+    On-disk cache of rendered file sections.
+
+    Entries are keyed on the file's path, its pathname in the markdown and
+    the formatter's options fingerprint (see MdFormatter.options_fingerprint),
+    and validated against the file's size, mtime_ns and inode. The cache is
+    a SQLite database in WAL mode, so several runs can share one cache
+    directory (by default default_cache_dir()). Writes are batched, and the least
+    recently used entries are evicted on close() once the total size of the
+    cached sections exceeds max_bytes. Writers in several threads of one
+    run (see `files2md batch`) can share one RenderCache; its connection is
+    used by one thread at a time.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        *,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.pending_puts = 0
+        self.used_rowids: list[int] = []
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        import sqlite3
+
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(
+            cache_dir / CACHE_DB_NAME,
+            timeout=BUSY_TIMEOUT_S,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.init_schema()
+
+    def init_schema(self):
+        (user_version,) = self.db.execute("PRAGMA user_version").fetchone()
+        if user_version == CACHE_SCHEMA_VERSION:
+            return
+        with self.transaction():
+            self.db.execute("DROP TABLE IF EXISTS chunks")
+            self.db.execute(
+                """
+                CREATE TABLE chunks (
+                    path TEXT NOT NULL,
+                    pathname TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    mdchunk TEXT NOT NULL,
+                    truncated INTEGER NOT NULL,
+                    excluded INTEGER NOT NULL,
+                    encoding_tier TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    content_nbytes INTEGER NOT NULL,
+                    nbytes INTEGER NOT NULL,
+                    last_used INTEGER NOT NULL,
+                    PRIMARY KEY (path, pathname, fingerprint)
+                )
+                """
+            )
+            self.db.execute("CREATE INDEX chunks_last_used ON chunks (last_used)")
+            self.db.execute(f"PRAGMA user_version = {CACHE_SCHEMA_VERSION}")
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def key_for(self, file: Path, pathname: str, fingerprint: str) -> CacheKey | None:
+        return stat_key(file, pathname, fingerprint)
+
+    def lookup_rowid(self, key: CacheKey) -> int | None:
+        row = self.db.execute(
+            """
+            SELECT rowid FROM chunks
+            WHERE path = ? AND pathname = ? AND fingerprint = ?
+              AND size = ? AND mtime_ns = ? AND inode = ?
+            """,
+            (
+                key.path,
+                key.pathname,
+                key.fingerprint,
+                key.size,
+                key.mtime_ns,
+                key.inode,
+            ),
+        ).fetchone()
+        return row[0] if row else None
+
+    def contains(self, key: CacheKey) -> bool:
+        with self.lock:
+            return self.lookup_rowid(key) is not None
+
+    def get(self, key: CacheKey) -> RenderedFile | None:
+        with self.lock:
+            return self.locked_get(key)
+
+    def locked_get(self, key: CacheKey) -> RenderedFile | None:
+        rowid = self.lookup_rowid(key)
+        row = None
+        if rowid is not None:
+            row = self.db.execute(
+                """
+                SELECT mdchunk, truncated, excluded, encoding_tier,
+                       content_hash, content_nbytes
+                FROM chunks WHERE rowid = ?
+                """,
+                (rowid,),
+            ).fetchone()
+        if row is None:
+            # also covers entries evicted by a concurrent run since contains()
+            return None
+        self.used_rowids.append(rowid)
+        mdchunk, truncated, excluded, encoding_tier, content_hash, content_nbytes = row
+        return RenderedFile(
+            fragments=(mdchunk,),
+            truncated=bool(truncated),
+            excluded=bool(excluded),
+            encoding_tier=encoding_tier,
+            content_hash=content_hash,
+            content_nbytes=content_nbytes,
+        )
+
+    def put(self, key: CacheKey, rendered: RenderedFile):
+        if time.time_ns() - key.mtime_ns < RACY_MTIME_NS:
+            return
+        # too large to be stored; see md_transform.StreamedContent
+        if rendered.streamed:
+            return
+        with self.lock:
+            self.locked_put(key, rendered)
+
+    def locked_put(self, key: CacheKey, rendered: RenderedFile):
+        if not self.pending_puts:
+            self.db.execute("BEGIN IMMEDIATE")
+        self.db.execute(
+            """
+            INSERT OR REPLACE INTO chunks (
+                path, pathname, fingerprint, size, mtime_ns, inode,
+                mdchunk, truncated, excluded, encoding_tier, content_hash,
+                content_nbytes, nbytes, last_used
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                key.path,
+                key.pathname,
+                key.fingerprint,
+                key.size,
+                key.mtime_ns,
+                key.inode,
+                rendered.mdchunk,
+                rendered.truncated,
+                rendered.excluded,
+                rendered.encoding_tier,
+                rendered.content_hash,
+                rendered.content_nbytes,
+                len(rendered.mdchunk.encode("utf-8", "surrogatepass")),
+                time.time_ns(),
+            ),
+        )
+        self.pending_puts += 1
+        if self.pending_puts >= COMMIT_EVERY_N_PUTS:
+            self.flush()
+
+    def flush(self):
+        if self.pending_puts:
+            self.db.execute("COMMIT")
+            self.pending_puts = 0
+        if self.used_rowids:
+            now = time.time_ns()
+            with self.transaction():
+                self.db.executemany(
+                    "UPDATE chunks SET last_used = ? WHERE rowid = ?",
+                    ((now, rowid) for rowid in self.used_rowids),
+                )
+            self.used_rowids = []
+
+    def evict(self):
+        with self.transaction():
+            (total,) = self.db.execute(
+                "SELECT COALESCE(SUM(nbytes), 0) FROM chunks"
+            ).fetchone()
+            if total <= self.max_bytes:
+                return
+            excess = total - self.max_bytes
+            doomed: list[tuple[int]] = []
+            rows = self.db.execute(
+                "SELECT rowid, nbytes FROM chunks ORDER BY last_used"
+            )
+            for rowid, nbytes in rows:
+                if excess <= 0:
+                    break
+                doomed.append((rowid,))
+                excess -= nbytes
+            self.db.executemany("DELETE FROM chunks WHERE rowid = ?", doomed)
+
+    def close(self):
+        with self.lock:
+            try:
+                self.flush()
+                self.evict()
+            finally:
+                self.db.close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MemoryRenderCache:
+    """
+    In-memory cache of rendered file sections, with the keys and interface
+    of RenderCache, for a process that renders many times (see `files2md
+    serve`). Entries are replaced when the file's stat changes, and the
+    least recently used ones are evicted once the sections held exceed
+    max_bytes. Sections keep their fragments, so large files are still
+    streamed from the file when written. Safe to share between threads.
+    """
+
+    def __init__(self, *, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        # (key, section, size) by (path, pathname, fingerprint), least
+        # recently used first
+        self.entries: collections.OrderedDict[
+            tuple[str, str, str], tuple[CacheKey, RenderedFile, int]
+        ] = collections.OrderedDict()
+
+    def key_for(self, file: Path, pathname: str, fingerprint: str) -> CacheKey | None:
+        return stat_key(file, pathname, fingerprint)
+
+    def contains(self, key: CacheKey) -> bool:
+        with self.lock:
+            entry = self.entries.get((key.path, key.pathname, key.fingerprint))
+            return entry is not None and entry[0] == key
+
+    def get(self, key: CacheKey) -> RenderedFile | None:
+        entry_id = (key.path, key.pathname, key.fingerprint)
+        with self.lock:
+            entry = self.entries.get(entry_id)
+            if entry is None or entry[0] != key:
+                return None
+            self.entries.move_to_end(entry_id)
+            return entry[1]
+
+    def put(self, key: CacheKey, rendered: RenderedFile):
+        if time.time_ns() - key.mtime_ns < RACY_MTIME_NS:
+            return
+        entry_id = (key.path, key.pathname, key.fingerprint)
+        nbytes = held_bytes(rendered)
+        with self.lock:
+            old = self.entries.pop(entry_id, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self.entries[entry_id] = (key, rendered, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes and self.entries:
+                _, (_, _, evicted_nbytes) = self.entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def held_bytes(rendered: RenderedFile) -> int:
+    """Roughly the memory taken by the fragments of `rendered`."""
+    nbytes = 0
+    for fragment in rendered.fragments:
+        if isinstance(fragment, str):
+            nbytes += len(fragment)
+        elif isinstance(fragment, Utf8Content):
+            nbytes += len(fragment.data)
+    return nbytes
+
+
+def default_cache_dir() -> Path:
+    """The user's cache directory for files2md, e.g. ~/.cache/files2md."""
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    if xdg_cache_home and os.path.isabs(xdg_cache_home):
+        return Path(xdg_cache_home) / CACHE_DIR_NAME
+    return Path.home() / ".cache" / CACHE_DIR_NAME
@@ -0,0 +1,144 @@
+"""
+A library API for embedding files2md: iter_sections() renders the files of
+a few directories and yields their sections one at a time, to be streamed
+elsewhere (e.g. into an HTTP response or a queue) without writing a file.
+
+    for section in files2md.iter_sections(["/src/app"], max_lines_per_file=500):
+        print(section.pathname, section.language, section.truncated)
+        for chunk in section.iter_body():
+            ...
+
+To stream whole documents instead, pass an md_transform.MemoryOutputHandler
+to md_transform.MdWriter.
+"""
+
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import files2md.compact as compact
+import files2md.fileinfo as fileinfo
+import files2md.md_transform as md_transform
+import files2md.profiling as profiling
+
+
+@dataclass(frozen=True)
+class Section:
+    """One file section of the document."""
+
+    path: Path
+    # the file as named in the document, e.g. "project/src/main.py"
+    pathname: str
+    # markdown language of the code block, e.g. "python"; "" if unknown
+    language: str
+    rendered: md_transform.RenderedFile
+
+    @property
+    def truncated(self) -> bool:
+        """The body stops at max_lines_per_file."""
+        return self.rendered.truncated
+
+    @property
+    def excluded(self) -> bool:
+        """The content was left out for the file's MIME type."""
+        return self.rendered.excluded
+
+    @property
+    def copy_of(self) -> str:
+        """With dedupe, the pathname of the earlier file with the same content."""
+        return self.rendered.copy_of
+
+    @property
+    def has_body(self) -> bool:
+        """The section shows the content in a code block, e.g. not for binaries."""
+        return self.rendered.content is not None
+
+    def iter_body(self) -> Iterator[str]:
+        """
+        The content shown in the code block, after substitutions and
+        truncation. Large files are read and decoded again chunk by chunk as
+        this is iterated, rather than held in memory.
+        """
+        content = self.rendered.content
+        if content is None:
+            return
+        if isinstance(content, str):
+            yield content
+        else:
+            yield from content
+
+    def read_body(self) -> str:
+        return "".join(self.iter_body())
+
+    def iter_markdown(self) -> Iterator[str]:
+        """The whole section as it appears in the document."""
+        return self.rendered.iter_chunks()
+
+
+def iter_sections(
+    roots: Iterable[str | os.PathLike[str]],
+    *,
+    glob_patterns: Iterable[str] = ("*",),
+    exclude_patterns: Iterable[str] = (),
+    use_default_patterns: bool = True,
+    max_lines_per_file: int = 0,
+    mlpf_approx_pct: int = 25,
+    include_empty: bool = False,
+    sub_rules_file: str = "",
+    jobs: int = 1,
+    executor: str = md_transform.EXECUTOR_PROCESS,
+    read_threads: int = 0,
+    walk_threads: int = 0,
+    dedupe: bool = False,
+) -> Iterator[Section]:
+    """
+    Yields the sections of the files beneath the directories `roots`, in
+    the order of the document that `files2md -g GLOB ...` would write with
+    the same options; files without a section (e.g. empty ones, unless
+    include_empty) are skipped. Files are selected by
+    fileinfo.build_patterns(), so by default every file that
+    DEFAULT_PATTERNS does not exclude.
+
+    Files are rendered as the generator is advanced (with jobs > 1, a few
+    ahead of it); closing the generator early stops the workers.
+    """
+    import pathspec
+
+    import files2md.cli.walker as walker
+
+    root_paths = [Path(root).absolute() for root in roots]
+    patterns = fileinfo.build_patterns(
+        glob_patterns, exclude_patterns, use_default_patterns=use_default_patterns
+    )
+    spec = pathspec.PathSpec.from_lines("gitwildmatch", patterns)
+    files: list[Path] = []
+    for root in root_paths:
+        walked = walker.iter_walk_tree(root, spec, threads=walk_threads)
+        files.extend(root.joinpath(x.rel) for x in walked)
+    writer = md_transform.MdWriter(
+        output=md_transform.MemoryOutputHandler(),
+        project_name=", ".join(root.name for root in root_paths),
+        in_dirs=root_paths,
+        files=files,
+        max_lines_per_file=max_lines_per_file,
+        mlpf_approx_pct=mlpf_approx_pct,
+        include_empty=include_empty,
+        sub_rules_file=sub_rules_file,
+        jobs=jobs,
+        executor=executor,
+        read_threads=read_threads,
+        dedupe=dedupe,
+    )
+    describe = compact.PathDescriber(root_paths)
+    sorted_files, _ = compact.sort_paths(files)
+    stage = profiling.StageStat("sections")
+    for file, rendered in writer.iter_rendered(sorted_files, describe, stage):
+        if not rendered.fragments:
+            continue
+        yield Section(
+            path=file,
+            pathname=describe(file),
+            language=fileinfo.classify_file(file).mdlang,
+            rendered=rendered,
+        )
@@ -0,0 +1,158 @@
+import re
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import override
+
+# Characters that give a pattern or a replacement template a meaning beyond
+# its literal text.
+REGEX_METACHARS = frozenset(".^$*+?{}[]\\|()")
+
+# Linewise comments are supported in the substitution rules file via the `#` character.
+# Inline comments are not supported.
+# To begin a substitution with a literal `#` character, escape it with a backslash.
+# This works because Python's regex parser treats `\#` as a literal `#`.
+# Alternatively you could use a character class: `[#]`.
+# Separate the pattern and replacement with one or more tabs.
+RE_COMMENT_LINE = re.compile(r"^\s*#")
+RE_RULE_SEPARATOR = re.compile(r"\t+")
+
+
+class TextSubstituter(ABC):
+    pattern_str: str
+
+    @abstractmethod
+    def substitute(self, s: str) -> str:
+        pass
+
+    @abstractmethod
+    def substitute_count(self, s: str) -> tuple[str, int]:
+        pass
+
+
+class RETextSubstituter(TextSubstituter):
+    def __init__(self, pattern: str, repl: str):
+        self.pattern_str = pattern
+        self.pattern = re.compile(pattern)
+        self.repl = repl
+
+    @override
+    def substitute(self, s: str) -> str:
+        return self.pattern.sub(self.repl, s)
+
+    @override
+    def substitute_count(self, s: str) -> tuple[str, int]:
+        return self.pattern.subn(self.repl, s)
+
+
+class LiteralTextSubstituter(TextSubstituter):
+    """
+    Replaces a fixed string with another fixed string, with str.replace()
+    rather than the regex engine.
+    """
+
+    def __init__(self, literal: str, repl: str):
+        self.pattern_str = literal
+        self.literal = literal
+        self.repl = repl
+
+    @override
+    def substitute(self, s: str) -> str:
+        return s.replace(self.literal, self.repl)
+
+    @override
+    def substitute_count(self, s: str) -> tuple[str, int]:
+        count = s.count(self.literal)
+        if not count:
+            return s, 0
+        return s.replace(self.literal, self.repl), count
+
+
+def is_literal(s: str) -> bool:
+    return not REGEX_METACHARS.intersection(s)
+
+
+def make_substituter(pattern: str, repl: str) -> TextSubstituter:
+    if pattern and is_literal(pattern) and is_literal(repl):
+        return LiteralTextSubstituter(pattern, repl)
+    return RETextSubstituter(pattern, repl)
+
+
+def parse_rules_file(path: str) -> list[TextSubstituter]:
+    substituters = []
+    with open(path) as fh:
+        for line in fh:
+            if RE_COMMENT_LINE.match(line):
+                continue
+            line = line.rstrip("\r\n")
+            split = RE_RULE_SEPARATOR.split(line)
+            if len(split) != 2:
+                continue
+            substituters.append(make_substituter(split[0], split[1]))
+    return substituters
+
+
+@dataclass(frozen=True)
+class SubRuleStat:
+    # index of the rule in SubRules.substituters
+    rule_index: int
+    # number of replacements made
+    matches: int
+    # time spent applying the rule
+    seconds: float
+
+
+class SubRules:
+    """
+    Substitution rules compiled once for a whole run.
+
+    The rules are applied one after another, so a rule sees the output of
+    the rules before it. Before that, a single regex combining all rules
+    scans the content once, and content that no rule can match is returned
+    untouched without running the rules individually.
+    """
+
+    def __init__(self, substituters: list[TextSubstituter]):
+        self.substituters = substituters
+        self.prefilter = self.compile_prefilter()
+
+    def compile_prefilter(self) -> re.Pattern | None:
+        alternatives = []
+        for tuter in self.substituters:
+            if isinstance(tuter, LiteralTextSubstituter):
+                alternatives.append(re.escape(tuter.literal))
+            elif isinstance(tuter, RETextSubstituter):
+                # numbered groups and backreferences would be renumbered by
+                # the alternation, and inline global flags must come first
+                if tuter.pattern.groups or tuter.pattern.flags & ~re.UNICODE:
+                    return None
+                alternatives.append(f"(?:{tuter.pattern.pattern})")
+            else:
+                return None
+        if not alternatives:
+            return None
+        try:
+            return re.compile("|".join(alternatives))
+        except re.error:
+            return None
+
+    def __bool__(self):
+        return bool(self.substituters)
+
+    def apply(self, content: str) -> tuple[str, list[SubRuleStat]]:
+        """
+        Returns the substituted content and a SubRuleStat for each rule
+        that was applied; the list is empty if the prefilter ruled out all
+        rules.
+        """
+        stats: list[SubRuleStat] = []
+        if not self.substituters:
+            return content, stats
+        if self.prefilter is not None and not self.prefilter.search(content):
+            return content, stats
+        for rule_index, tuter in enumerate(self.substituters):
+            started = time.perf_counter()
+            content, matches = tuter.substitute_count(content)
+            seconds = time.perf_counter() - started
+            stats.append(SubRuleStat(rule_index, matches, seconds))
+        return content, stats
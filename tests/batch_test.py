@@ -0,0 +1,146 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from files2md import md_transform
+from files2md.cli import batch, cli_impl
+from tests.gitutil_test import make_repo
+from tests.md_transform_test import make_tree
+
+
+def write_manifest(tmp_path: Path, jobs: list[dict], suffix: str = ".json") -> Path:
+    manifest = tmp_path / f"manifest{suffix}"
+    if suffix == ".toml":
+        lines = ['[defaults]\nglob_patterns = ["*"]\n']
+        for job in jobs:
+            lines.append("[[jobs]]")
+            lines.extend(f"{k} = {json.dumps(v)}" for k, v in job.items())
+        manifest.write_text("\n".join(lines) + "\n")
+    else:
+        manifest.write_text(
+            json.dumps({"defaults": {"glob_patterns": ["*"]}, "jobs": jobs})
+        )
+    return manifest
+
+
+def run_batch(*argv: str):
+    cli_impl.main(["batch", *argv, "--no-cache", "-qqqqq"])
+
+
+@pytest.mark.parametrize(
+    "suffix, executor", [(".json", "process"), (".toml", "thread")]
+)
+def test_batch_matches_single_runs(tmp_path: Path, suffix: str, executor: str):
+    make_tree(tmp_path / "a")
+    make_tree(tmp_path / "b")
+    (tmp_path / "b" / "big.txt").write_text("line\n" * 2000)
+    jobs = [
+        {"in_dirs": ["a"], "out_file": "out/a.md", "max_lines_per_file": 10},
+        {"in_dirs": ["b"], "out_file": "out/b.md", "split": "4KB"},
+    ]
+    manifest = write_manifest(tmp_path, jobs, suffix)
+    (tmp_path / "out").mkdir()
+    run_batch(str(manifest), "-j", "2", "--executor", executor)
+    single = tmp_path / "single"
+    single.mkdir()
+    for options, name in ((["-l", "10"], "a"), (["-p", "4KB"], "b")):
+        cli_impl.main(
+            [
+                str(tmp_path / name),
+                "-g",
+                "*",
+                *options,
+                "-o",
+                str(single / f"{name}.md"),
+            ]
+            + ["--no-cache", "-qqqqq"]
+        )
+    batch_parts = sorted(p.name for p in (tmp_path / "out").iterdir())
+    assert batch_parts == sorted(p.name for p in single.iterdir())
+    assert len(batch_parts) > 2
+    for name in batch_parts:
+        assert (tmp_path / "out" / name).read_text() == (single / name).read_text()
+
+
+def test_batch_runs_largest_first_and_reports_failures(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    for name, size in (("small", 10), ("large", 10_000), ("medium", 1000)):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "f.txt").write_text("x" * size)
+    jobs = [
+        {"in_dirs": [name], "out_file": f"{name}.md"}
+        for name in ("small", "large", "medium")
+    ]
+    manifest = write_manifest(tmp_path, jobs)
+    started: list[str] = []
+    run_job = batch.run_job
+
+    def record_run_job(job: batch.BatchJob, **kwargs) -> batch.JobResult:
+        started.append(job.project_name)
+        if job.project_name == "medium":
+            raise_in_writer = {"sub_rules_file": str(tmp_path / "missing")}
+            vars(job.args).update(raise_in_writer)
+        return run_job(job, **kwargs)
+
+    monkeypatch.setattr(batch, "run_job", record_run_job)
+    with pytest.raises(SystemExit) as exc_info:
+        run_batch(str(manifest))
+    assert exc_info.value.code == 1
+    assert started == ["large", "medium", "small"]
+    assert (tmp_path / "small.md").exists() and (tmp_path / "large.md").exists()
+
+
+@pytest.mark.parametrize(
+    "jobs, error",
+    [
+        (
+            [{"in_dirs": ["a"], "out_file": "a.md", "bogus": 1}],
+            "unknown options: bogus",
+        ),
+        ([{"in_dirs": ["a"]}], "in_dirs and out_file are required"),
+        ([{"in_dirs": ["a"], "out_file": "a.md"}] * 2, "is written twice"),
+        ([], "no jobs"),
+    ],
+)
+def test_batch_rejects_invalid_manifests(tmp_path: Path, jobs: list[dict], error: str):
+    (tmp_path / "a").mkdir()
+    manifest = write_manifest(tmp_path, jobs)
+    with pytest.raises(SystemExit) as exc_info:
+        run_batch(str(manifest))
+    assert error in str(exc_info.value.code)
+
+
+def test_failed_job_closes_its_output(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    (tmp_path / "a").mkdir()
+    manifest = write_manifest(tmp_path, [{"in_dirs": ["a"], "out_file": "a.md"}])
+    outputs: list[md_transform.SingleFileOutputHandler] = []
+    open_output = cli_impl.open_output
+
+    def record_open_output(args):
+        outputs.append(open_output(args))
+        return outputs[-1]
+
+    def fail(*_args, **_kwargs):
+        raise ValueError("bad option")
+
+    monkeypatch.setattr(cli_impl, "open_output", record_open_output)
+    monkeypatch.setattr(md_transform.MdWriter, "__init__", fail)
+    with pytest.raises(SystemExit):
+        run_batch(str(manifest))
+    assert len(outputs) == 1 and outputs[0].ofh.closed
+
+
+def test_failed_collection_does_not_stop_other_jobs(tmp_path: Path):
+    make_repo(tmp_path / "repo", {"a.py": "print('a')\n"})
+    jobs = [
+        {"in_dirs": ["repo"], "out_file": "good.md"},
+        {"in_dirs": ["repo"], "out_file": "bad.md", "changed_since": "nonexistent-rev"},
+    ]
+    manifest = write_manifest(tmp_path, jobs)
+    with pytest.raises(SystemExit) as exc_info:
+        run_batch(str(manifest), "-j", "2")
+    assert exc_info.value.code == 1
+    assert "print('a')" in (tmp_path / "good.md").read_text()
+    assert not (tmp_path / "bad.md").exists()
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+from benchmarks import bench, synth_tree
+
+
+def read_tree(root: Path) -> dict[str, bytes]:
+    return {
+        p.relative_to(root).as_posix(): p.read_bytes()
+        for p in sorted(root.rglob("*"))
+        if p.is_file()
+    }
+
+
+def test_generate_tree_is_deterministic(tmp_path: Path):
+    spec = synth_tree.TreeSpec(file_count=50, ignored_files=10, seed=3)
+    a = synth_tree.generate_tree(tmp_path / "a", spec)
+    b = synth_tree.generate_tree(tmp_path / "b", spec)
+    assert read_tree(a.root) == read_tree(b.root)
+    assert len(a.files) == 50
+    assert len(a.ignored_files) == 10
+    assert a.total_bytes == sum(f.stat().st_size for f in a.files)
+    assert any(f.suffix == ".dat" for f in a.files)
+
+
+def test_run_bench(tmp_path: Path):
+    spec = synth_tree.TreeSpec(file_count=30, median_size=500, git=True)
+    results = bench.run_bench(spec, tmp_path)
+    stages = results["stages"]
+    assert list(stages) == [
+        "collect_paths",
+        "git_lsfiles_dirs",
+        "detect_encoding",
+        "read_file_lines",
+        "substitutions",
+        "write_single_file",
+        "write_split_files",
+    ]
+    assert stages["git_lsfiles_dirs"]["files"] == 31  # with .gitignore
+    assert stages["detect_encoding"]["files"] == 30
+    assert all(stage["seconds"] >= 0 for stage in stages.values())
@@ -0,0 +1,100 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from files2md import compact
+
+NAMES = [
+    "a/b",
+    "a-b/x",
+    "a.b",
+    "a/b/c",
+    "a/B",
+    "z",
+    "Grüße/köln.txt",
+    os.fsdecode(b"raw\xff/name"),
+]
+
+
+def describe_path_by_parents(path: Path, bases: list[Path]) -> str:
+    for base in bases:
+        if base in path.parents:
+            return f"{base.name}/{path.relative_to(base).as_posix()}"
+    return path.as_posix()
+
+
+def test_path_table_items():
+    roots = [Path("/r1"), Path("/r2/sub")]
+    table = compact.PathTable(roots)
+    paths = []
+    for i, name in enumerate(NAMES):
+        table.append_rel(i % 2, name)
+        paths.append(roots[i % 2].joinpath(name))
+    assert len(table) == len(paths)
+    assert list(table) == paths
+    assert table[-1] == paths[-1]
+    assert table[1:4] == paths[1:4]
+    with pytest.raises(IndexError):
+        table[len(paths)]
+
+
+def test_path_table_sorted():
+    roots = [Path("/r"), Path("/r-x"), Path("/r/a")]
+    paths = [root.joinpath(name) for root in roots for name in NAMES]
+    table = compact.PathTable.from_paths([*paths, paths[3], paths[0]], roots)
+    sorted_table, repeated = table.sorted()
+    assert list(sorted_table) == sorted([*paths, paths[3], paths[0]])
+    assert repeated == {paths[0], paths[3]}
+
+
+def test_path_table_from_paths_outside_roots():
+    paths = [Path("/r/a"), Path("/elsewhere/b"), Path("rel/c"), Path("/other")]
+    table = compact.PathTable.from_paths(paths, [Path("/r")])
+    assert list(table) == paths
+    assert table.roots == [Path("/r"), Path("/"), Path("")]
+
+
+@pytest.mark.parametrize(
+    "bases",
+    [
+        [Path("/r")],
+        [Path("/r/a"), Path("/r")],
+        [Path("/r"), Path("/r/a")],
+        [Path("/")],
+        [Path(".")],
+        [Path("/r-x"), Path("rel")],
+    ],
+)
+def test_path_describer_matches_parents(bases: list[Path]):
+    paths = [Path(p) for p in ["/r", "/r/a", "/r/a/b", "/r-x/y", "/q", "rel/c"]]
+    describe = compact.PathDescriber(bases)
+    for path in paths:
+        assert describe(path) == describe_path_by_parents(path, bases)
+
+
+def test_iter_unique():
+    paths = [Path("/r/a"), Path("/r/b"), Path("/r/a/c")]
+    files = [paths[0], *paths, paths[0]]
+    sorted_files, repeated = compact.sort_paths(files)
+    assert sorted_files == sorted(files)
+    assert list(compact.iter_unique(files, repeated)) == paths
+    table = compact.PathTable([Path("/r"), Path("/r/a")])
+    table.append_rel(0, "a/c")
+    table.append_rel(1, "c")
+    sorted_table, repeated = compact.sort_paths(table)
+    assert list(sorted_table) == [Path("/r/a/c")] * 2
+    assert list(compact.iter_unique(table, repeated)) == [Path("/r/a/c")]
+
+
+def test_summary_spill(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(compact, "SPILL_BATCH_ROWS", 2)
+    records = [
+        compact.FileRecord(Path("/r/b"), 20, True, False, "bom"),
+        compact.FileRecord(Path(os.fsdecode(b"/r/\xff")), 10, False, True, ""),
+        compact.FileRecord(Path("/r/a"), 20, False, False, "ascii"),
+    ]
+    with compact.SummarySpill() as spill:
+        for record in records:
+            spill.add(record)
+        assert list(spill.iter_by_char_count()) == [records[1], records[0], records[2]]
@@ -0,0 +1,43 @@
+import codecs
+
+import pytest
+
+from files2md import encoding_detect
+from files2md.encoding_detect import detect_encoding
+
+
+@pytest.mark.parametrize(
+    "blob, expected",
+    [
+        (b"", ("utf-8", encoding_detect.TIER_ASCII)),
+        (b"plain ascii\n", ("utf-8", encoding_detect.TIER_ASCII)),
+        ("naïve café\n".encode("utf-8"), ("utf-8", encoding_detect.TIER_UTF8)),
+        (b"\x7fELF\x02\x01\x00\x00", ("binary", encoding_detect.TIER_BINARY)),
+        (codecs.BOM_UTF8 + b"x", ("utf-8", encoding_detect.TIER_BOM)),
+        ("x".encode("utf-16"), ("utf-16", encoding_detect.TIER_BOM)),
+        ("x".encode("utf-32"), ("utf-32", encoding_detect.TIER_BOM)),
+    ],
+)
+def test_fast_tiers(blob: bytes, expected: tuple[str, str]):
+    assert detect_encoding(blob) == expected
+
+
+def test_truncated_utf8_prefix():
+    blob = "ü".encode("utf-8")[:1]
+    assert detect_encoding(b"abc" + blob, complete=False)[1] == "utf-8"
+    assert detect_encoding(b"abc" + blob, complete=True)[1] != "utf-8"
+
+
+def test_falls_back_to_charset_normalizer():
+    blob = "Größenverhältnisse für Übermäßiges\n".encode("latin-1") * 20
+    encoding, tier = detect_encoding(blob)
+    assert tier == encoding_detect.TIER_CHARSET_NORMALIZER
+    assert blob.decode(encoding) == blob.decode("latin-1")
+
+
+@pytest.mark.parametrize("encoding", ["utf-16-le", "utf-16-be", "utf-32-le"])
+def test_utf16_and_32_without_bom(encoding: str):
+    blob = "def naïve():\n    return 'café'\n".encode(encoding) * 20
+    detected, tier = detect_encoding(blob)
+    assert tier == encoding_detect.TIER_CHARSET_NORMALIZER
+    assert blob.decode(detected) == blob.decode(encoding)
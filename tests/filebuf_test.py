@@ -0,0 +1,89 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from files2md import filebuf
+
+SAMPLES = [
+    b"",
+    b"one line without newline",
+    b"a\nb\r\nc\rd\n\n",
+    b"\r\n" * 7 + b"\r",
+    "Grüße\r\naus\rKöln\n".encode("utf-8"),
+    b"invalid \xff\xfe utf-8\n",
+    "wide\r\nchars\n".encode("utf-16"),
+]
+
+
+@pytest.mark.parametrize("sample", SAMPLES)
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 1024])
+def test_decoded_lines_match_text_mode(tmp_path: Path, sample: bytes, chunk_size):
+    encoding = "utf-16" if sample.startswith(b"\xff\xfe") else "utf-8"
+    file = tmp_path / "sample.txt"
+    file.write_bytes(sample)
+    with open(file, encoding=encoding, errors="replace") as fh:
+        expected = list(fh)
+    actual = list(filebuf.iter_decoded_lines(sample, encoding, chunk_size=chunk_size))
+    assert actual == expected
+    chunks = filebuf.iter_decoded_chunks(sample, encoding, chunk_size=chunk_size)
+    assert "".join(chunks) == "".join(expected)
+
+
+def test_large_files_are_mapped(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(filebuf, "MMAP_THRESHOLD", 4)
+    file = tmp_path / "big.txt"
+    file.write_bytes(b"0123456789\n")
+    with filebuf.open_file_buffer(file) as buf:
+        assert not isinstance(buf, bytes)
+        assert list(filebuf.iter_decoded_lines(buf, "utf-8")) == ["0123456789\n"]
+    empty = tmp_path / "empty.txt"
+    empty.write_bytes(b"")
+    with filebuf.open_file_buffer(empty) as buf:
+        assert buf == b""
+
+
+@pytest.mark.parametrize("sample", [s for s in SAMPLES if s[:2] != b"\xff\xfe"])
+@pytest.mark.parametrize("chunk_size", [1, 2, 1024])
+def test_count_lines_matches_decoded_lines(sample: bytes, chunk_size: int):
+    expected = len(list(filebuf.iter_decoded_lines(sample, "utf-8")))
+    assert filebuf.count_lines(sample, chunk_size=chunk_size) == expected
+
+
+@pytest.mark.parametrize(
+    "encoding, expected",
+    [
+        ("utf-8", True),
+        ("utf-8-sig", True),
+        ("cp1252", True),
+        ("shift_jis", True),
+        ("utf-16", False),
+        ("utf_32_le", False),
+        ("no-such-codec", False),
+    ],
+)
+def test_is_ascii_compatible(encoding: str, expected: bool):
+    assert filebuf.is_ascii_compatible(encoding) == expected
+
+
+@pytest.mark.parametrize(
+    "failing", [(), ("copy_file_range",), ("copy_file_range", "sendfile")]
+)
+def test_copy_file_to_fd(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, failing: tuple[str, ...]
+):
+    def fail(*_args):
+        raise OSError("not supported")
+
+    for name in failing:
+        monkeypatch.setattr(os, name, fail)
+    src = tmp_path / "src.bin"
+    src.write_bytes(bytes(range(256)) * 5000)
+    dst = tmp_path / "dst.bin"
+    with open(dst, "wb") as fh:
+        fh.write(b"head")
+        fh.flush()
+        copied = filebuf.copy_file_to_fd(src, fh.fileno())
+        fh.write(b"tail")
+    assert dst.read_bytes() == b"head" + src.read_bytes() + b"tail"
+    assert copied == (0 if len(failing) == 2 else src.stat().st_size)
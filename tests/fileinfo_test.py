@@ -0,0 +1,32 @@
+from pathlib import PurePath
+
+import pytest
+
+from files2md import fileinfo
+
+
+@pytest.mark.parametrize(
+    "name, decision, mdlang, mimetype",
+    [
+        ("main.py", fileinfo.DECISION_TEXT, "python", "text/x-python"),
+        ("MAIN.PY", fileinfo.DECISION_TEXT, "python", "text/x-python"),
+        ("logo.png", fileinfo.DECISION_SKIP_BY_MIME, "", "image/png"),
+        ("data.json", fileinfo.DECISION_TEXT, "json", "application/json"),
+        ("notes.unknownext", fileinfo.DECISION_SNIFF, "", ""),
+        ("README", fileinfo.DECISION_SNIFF, "", ""),
+        (".bashrc", fileinfo.DECISION_TEXT, "bash", ""),
+        ("src.tar.gz", fileinfo.DECISION_SKIP_BY_MIME, "", "application/x-tar"),
+        ("log.gz", fileinfo.DECISION_SNIFF, "", ""),
+    ],
+)
+def test_classify_file(name: str, decision: str, mdlang: str, mimetype: str):
+    fileclass = fileinfo.classify_file(PurePath("/some/dir", name))
+    assert fileclass == fileinfo.FileClass(decision, mdlang, mimetype)
+
+
+def test_classify_file_memoized():
+    a = fileinfo.classify_file(PurePath("a.py"))
+    assert fileinfo.classify_file(PurePath("dir/B.Py")) is a
+    # the key of an unlisted file without a suffix is shared
+    assert fileinfo.file_class_key(PurePath("Makefile")) == ""
+    assert fileinfo.file_class_key(PurePath("x.TAR.gz")) == ".tar.gz"
@@ -1,7 +1,11 @@
 from pathlib import Path
 import files2md.cli.gitutil as gitutil
+from files2md.cli import cli_impl
 from files2md.cli.gitutil import StrPath, StrPathIter
 import os
+import subprocess
+
+import pytest
 
 
 def abs_paths(paths: list[str]) -> set[Path]:
@@ -22,3 +26,91 @@ def test_dir_find_dotgit_dirs():
             ".",
         ],
     )
+
+
+def git(repo: Path, *args: str):
+    subprocess.run(
+        ["git", "-c", "protocol.file.allow=always", *args],
+        cwd=repo,
+        check=True,
+        capture_output=True,
+    )
+
+
+def make_repo(repo: Path, files: dict[str, str]) -> Path:
+    repo.mkdir(parents=True, exist_ok=True)
+    git(repo, "init", "-q")
+    git(repo, "config", "user.email", "test@example.com")
+    git(repo, "config", "user.name", "test")
+    for name, content in files.items():
+        repo.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+        repo.joinpath(name).write_text(content)
+    git(repo, "add", "-A")
+    git(repo, "commit", "-q", "-m", "init")
+    return repo
+
+
+def test_git_lsfiles_dir(tmp_path: Path):
+    repo = make_repo(
+        tmp_path / "repo",
+        {"a.txt": "a", "deleted.txt": "d", ".gitignore": "*.log\n", "new\nline": "n"},
+    )
+    repo.joinpath("deleted.txt").unlink()
+    repo.joinpath("untracked.txt").write_text("u")
+    repo.joinpath("ignored.log").write_text("i")
+    assert gitutil.git_lsfiles_dir(repo) == [
+        repo / ".gitignore",
+        repo / "a.txt",
+        repo / "new\nline",
+        repo / "untracked.txt",
+    ]
+
+
+def test_git_lsfiles_dirs_nested_repos(tmp_path: Path):
+    sub = make_repo(tmp_path / "sub-origin", {"s.txt": "s"})
+    outer = make_repo(tmp_path / "outer", {"o.txt": "o"})
+    git(outer, "submodule", "add", "-q", str(sub), "sub")
+    git(outer, "commit", "-q", "-m", "add submodule")
+    make_repo(outer / "nested", {"n.txt": "n"})
+    # a directory that is not a repository is not descended into by git
+    make_repo(tmp_path / "plain" / "deep", {"d.txt": "d"})
+    assert gitutil.git_lsfiles_dirs([outer, tmp_path / "plain"]) == [
+        tmp_path / "outer" / ".gitmodules",
+        tmp_path / "outer" / "nested" / "n.txt",
+        tmp_path / "outer" / "o.txt",
+        tmp_path / "outer" / "sub" / "s.txt",
+        tmp_path / "plain" / "deep" / "d.txt",
+    ]
+
+
+def test_git_diff_dirs(tmp_path: Path):
+    repo = make_repo(
+        tmp_path / "repo",
+        {"a.txt": "a", "old.txt": "o" * 100, "gone.txt": "g", "same.txt": "s"},
+    )
+    git(repo, "mv", "old.txt", "new.txt")
+    git(repo, "rm", "-q", "gone.txt")
+    git(repo, "commit", "-q", "-m", "second")
+    repo.joinpath("a.txt").write_text("a2")
+    repo.joinpath("staged\nline").write_text("n")
+    git(repo, "add", "staged\nline")
+    G = gitutil.GitChange
+    assert gitutil.git_diff_dirs([tmp_path], rev="HEAD~1") == [
+        G("M", repo / "a.txt"),
+        G("D", repo / "gone.txt"),
+        G("R", repo / "new.txt", old_path=repo / "old.txt"),
+        G("A", repo / "staged\nline"),
+    ]
+    assert gitutil.git_diff_dirs([repo], staged=True) == [
+        G("A", repo / "staged\nline"),
+    ]
+
+
+def test_git_diff_dirs_reports_git_errors(tmp_path: Path):
+    repo = make_repo(tmp_path / "repo", {"a.txt": "a"})
+    with pytest.raises(gitutil.GitError, match=f"{repo}: .*nope"):
+        gitutil.git_diff_dirs([repo], rev="nope")
+    out_file = tmp_path / "out.md"
+    with pytest.raises(SystemExit, match="^files2md: --changed-since nope: "):
+        cli_impl.main([str(repo), "-o", str(out_file), "--changed-since", "nope"])
+    assert not out_file.exists()
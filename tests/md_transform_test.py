@@ -0,0 +1,394 @@
+import io
+import os
+from pathlib import Path
+
+import pytest
+
+from files2md import compact, md_transform
+
+
+def make_tree(root: Path) -> list[Path]:
+    files = {
+        "a.py": "print('hello')\n",
+        "b.md": "# title\n\n```\ncode\n```\n",
+        "sub/c.txt": "".join(f"line {i}\n" for i in range(50)),
+        "sub/d.bin": b"\x00\x01\x02\xff" * 64,
+        "sub/e.json": '{"k": "v"}\n',
+        "empty.txt": "",
+    }
+    paths = []
+    for name, content in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(content, bytes):
+            path.write_bytes(content)
+        else:
+            path.write_text(content, encoding="utf-8")
+        paths.append(path)
+    return paths
+
+
+def render(
+    root: Path, files: list[Path], **kwargs
+) -> tuple[str, md_transform.MdWriter]:
+    kwargs.setdefault("sub_rules_file", "")
+    kwargs.setdefault("max_lines_per_file", 10)
+    buf = io.StringIO()
+    writer = md_transform.MdWriter(
+        output=md_transform.SingleFileOutputHandler(buf),  # type: ignore
+        project_name=root.name,
+        in_dirs=[root],
+        files=files,
+        **kwargs,
+    )
+    writer.make_md()
+    return buf.getvalue(), writer
+
+
+@pytest.mark.parametrize("executor", md_transform.EXECUTORS)
+def test_parallel_output_matches_serial(tmp_path: Path, executor: str):
+    files = make_tree(tmp_path)
+    serial_md, serial = render(tmp_path, files)
+    parallel_md, parallel = render(tmp_path, files, jobs=3, executor=executor)
+    assert parallel_md == serial_md
+    assert parallel.summary == serial.summary
+
+
+def test_read_ahead_output_matches_serial(tmp_path: Path):
+    files = make_tree(tmp_path)
+    serial_md, serial = render(tmp_path, files)
+    read_ahead_md, read_ahead = render(tmp_path, files, read_threads=2)
+    assert read_ahead_md == serial_md
+    assert read_ahead.summary == serial.summary
+
+
+def test_compact_output_matches(tmp_path: Path):
+    files = make_tree(tmp_path)
+    files.append(files[0])
+    md, writer = render(tmp_path, files)
+    table = compact.PathTable.from_paths(files, [tmp_path])
+    with compact.SummarySpill() as spill:
+        compact_md, compact_writer = render(tmp_path, table, summary_spill=spill)
+        compact_records = list(compact_writer.summary.iter_by_char_count())
+    assert compact_md == md
+    assert compact_records == list(writer.summary.iter_by_char_count())
+    assert (
+        compact_writer.summary.suffix_to_file_count
+        == writer.summary.suffix_to_file_count
+    )
+
+
+def add_copies(root: Path) -> list[Path]:
+    copies = [root / "x" / "a.py", root / "y" / "copy.py"]
+    for copy in copies:
+        copy.parent.mkdir()
+        copy.write_text("print('hello')\n", encoding="utf-8")
+    return copies
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_dedupe_refers_to_first_copy(tmp_path: Path, jobs: int):
+    files = make_tree(tmp_path) + add_copies(tmp_path)
+    md, writer = render(tmp_path, files, dedupe=True, jobs=jobs, executor="thread")
+    assert md.count("print('hello')") == 1
+    assert md.count(f"(same content as `{tmp_path.name}/a.py`)") == 2
+    assert f"### `{tmp_path.name}/y/copy.py`" in md
+    assert writer.summary.duplicate_files == 2
+    assert writer.summary.duplicate_bytes == 2 * len("print('hello')\n")
+    plain_md, _ = render(tmp_path, files)
+    assert plain_md.count("print('hello')") == 3
+
+
+def naive_read_lines(text: str, max_lines: int, approx_pct: int):
+    lines = text.splitlines(True)
+    included, omitted = lines[:max_lines], lines[max_lines:]
+    if len(omitted) <= max_lines * approx_pct // 100:
+        return lines, 0
+    return included, len(omitted)
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "utf-16"])
+@pytest.mark.parametrize("line_count", [0, 1, 9, 10, 12, 13, 100])
+def test_read_buffer_lines_truncates(encoding: str, line_count: int):
+    text = "".join(f"line {i}\n" for i in range(line_count))
+    mdfmt = md_transform.MdFormatter(
+        tag_str="",
+        exclude_empty=True,
+        max_lines_per_file=10,
+        mlpf_approx_pct=25,
+        sub_rules_file="",
+    )
+    actual = mdfmt.read_buffer_lines(text.encode(encoding), encoding)
+    assert actual == naive_read_lines(text, 10, 25)
+
+
+def test_sub_rule_stats_reach_summary(tmp_path: Path):
+    rules = tmp_path / "rules.tsv"
+    rules.write_text("print\tPRINT\n", encoding="utf-8")
+    tree = tmp_path / "tree"
+    files = make_tree(tree)
+    md, writer = render(tree, files, sub_rules_file=str(rules), jobs=2)
+    assert "PRINT('hello')" in md
+    assert writer.summary.sub_rule_matches == {0: 1}
+
+
+def old_fence_for_content(content: str):
+    fence = "`" * md_transform.MIN_FENCE_LEN
+    for i in range(md_transform.MIN_FENCE_LEN, md_transform.MAX_FENCE_LEN + 1):
+        fence = "`" * i
+        if fence not in content:
+            break
+    return fence
+
+
+@pytest.mark.parametrize(
+    "content",
+    ["", " \n\t", "x", "`` ```", "````\n`````", "`" * 11, "`" * 20, "a\nb", "a\n"],
+)
+def test_analyze_content(content: str):
+    tag = "generated by files2md"
+    scanner = md_transform.compile_content_scanner(tag)
+    info = md_transform.analyze_content(content, scanner)
+    for chunk_size in (1, 2, 5):
+        chunks = [
+            content[i : i + chunk_size] for i in range(0, len(content), chunk_size)
+        ]
+        assert md_transform.analyze_chunks(chunks, scanner) == (info, len(content))
+    assert info.fence == old_fence_for_content(content)
+    assert info.is_blank == (not content.strip())
+    assert info.line_count == len(content.splitlines())
+    assert not info.has_tag
+    tagged = md_transform.analyze_content(
+        content + tag, md_transform.compile_content_scanner(tag)
+    )
+    assert tagged.has_tag
+
+
+@pytest.mark.parametrize("max_lines_per_file", [0, 10])
+def test_streamed_output_matches_buffered(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, max_lines_per_file: int
+):
+    files = make_tree(tmp_path)
+    buffered_md, buffered = render(
+        tmp_path, files, max_lines_per_file=max_lines_per_file
+    )
+    monkeypatch.setattr(md_transform, "STREAM_CONTENT_MIN_BYTES", 1)
+    streamed_md, streamed = render(
+        tmp_path, files, max_lines_per_file=max_lines_per_file
+    )
+    assert streamed_md == buffered_md
+    assert streamed.summary == buffered.summary
+    rendered = streamed.mdfmt.render_file(tmp_path / "a.py", "a.py")
+    assert rendered.streamed
+    assert rendered.char_count == len(rendered.mdchunk)
+
+
+@pytest.mark.parametrize("same_size", [False, True])
+def test_streamed_file_changed_before_writing(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, same_size: bool
+):
+    monkeypatch.setattr(md_transform, "STREAM_CONTENT_MIN_BYTES", 1)
+    file = tmp_path / "a.md"
+    file.write_text("plain text\n")
+    _, writer = render(tmp_path, [], max_lines_per_file=0)
+    rendered = writer.mdfmt.render_file(file, "a.md")
+    assert rendered.streamed
+    with writer.open_streamed(file, "a.md", rendered) as opened:
+        assert opened.content.fh is not None  # type: ignore
+        assert opened.mdchunk == rendered.mdchunk
+    st = file.stat()
+    file.write_text("````\n\n" if same_size else "a ```` run\n")
+    os.utime(file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    with pytest.raises(md_transform.ContentChangedError):
+        rendered.mdchunk
+    with writer.open_streamed(file, "a.md", rendered) as opened:
+        assert not opened.streamed
+        assert opened.mdchunk.startswith("\n### `a.md`\n`````markdown\n")
+        assert opened.mdchunk.endswith("\n`````\n\n")
+
+
+@pytest.mark.parametrize("stream_min_bytes", [md_transform.STREAM_CONTENT_MIN_BYTES, 1])
+def test_passthrough_output_matches_text(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, stream_min_bytes: int
+):
+    monkeypatch.setattr(md_transform, "STREAM_CONTENT_MIN_BYTES", stream_min_bytes)
+    root = tmp_path / "tree"
+    files = make_tree(root)
+    (root / "crlf.txt").write_bytes(b"a\r\nb\r\n")
+    (root / "latin1.txt").write_bytes("caf\xe9\n".encode("latin-1"))
+    files += [root / "crlf.txt", root / "latin1.txt"]
+    text_md, _ = render(root, files, max_lines_per_file=0)
+    out_file = tmp_path / "out.md"
+    with md_transform.MdWriter(
+        output=out_file,
+        project_name=root.name,
+        in_dirs=[root],
+        files=files,
+        sub_rules_file="",
+    ) as writer:
+        assert writer.output_handler.binary is not None  # type: ignore
+        writer.make_md()
+    assert out_file.read_text(encoding="utf-8") == text_md
+    rendered = writer.mdfmt.render_file(root / "a.py", "a.py")
+    content = rendered.fragments[1]
+    if stream_min_bytes == 1:
+        assert isinstance(content, md_transform.StreamedContent)
+        assert content.passthrough
+    else:
+        assert content == md_transform.Utf8Content(b"print('hello')\n", 15)
+    # "\r\n" is translated, so the bytes cannot be passed through
+    crlf = writer.mdfmt.render_file(root / "crlf.txt", "crlf.txt").fragments[1]
+    assert not isinstance(crlf, md_transform.Utf8Content)
+    assert not getattr(crlf, "passthrough", False)
+
+
+def test_bom_and_utf16_files_are_rendered_as_text(tmp_path: Path):
+    root = tmp_path / "tree"
+    root.mkdir()
+    (root / "bom.py").write_bytes("\ufeffprint('café')\n".encode("utf-8"))
+    (root / "u16.txt").write_bytes("naïve text\n".encode("utf-16-le") * 20)
+    files = sorted(root.iterdir())
+    text_md, _ = render(root, files, max_lines_per_file=0)
+    # the UTF-8 BOM is kept in the content, and UTF-16 is not taken for binary
+    assert "```python\n\ufeffprint('café')\n" in text_md
+    assert "naïve text\n" * 20 in text_md
+    out_file = tmp_path / "out.md"
+    with md_transform.MdWriter(
+        output=out_file,
+        project_name=root.name,
+        in_dirs=[root],
+        files=files,
+        sub_rules_file="",
+    ) as writer:
+        writer.make_md()
+    assert out_file.read_text(encoding="utf-8") == text_md
+
+
+def test_split_section():
+    content = "".join(f"line {i} " + "é" * (i % 50) + "\n" for i in range(400))
+    content += "x" * 5000 + "\n"
+    mdchunk = md_transform.TEMPLATE_FILE.substitute(
+        pathname="a.txt", fence="```", mdlang="text", content=content, omission_msg=""
+    )
+    pieces = md_transform.split_section(mdchunk, 2000)
+    assert len(pieces) > 1
+    assert all(len(piece.encode("utf-8")) <= 2000 for piece in pieces)
+    assert pieces[0].startswith("\n### `a.txt`\n```text\n")
+    for piece in pieces[1:]:
+        assert piece.startswith("\n### `a.txt` (continued)\n```text\n")
+    for piece in pieces[:-1]:
+        assert piece.endswith("\n```\n")
+    assert md_transform.split_section(mdchunk, len(mdchunk.encode())) == [mdchunk]
+
+
+def test_split_output_parts_fit(tmp_path: Path):
+    src = tmp_path / "src"
+    files = make_tree(src)
+    big = src / "big.txt"
+    big.write_text("".join(f"big line {i}\n" for i in range(1000)))
+    files.append(big)
+    single_md, _ = render(src, files, max_lines_per_file=0)
+
+    handler = md_transform.SplitFileOutputHandler(
+        initial_path=tmp_path / "out.md", bytes_per_file=1000
+    )
+    writer = md_transform.MdWriter(
+        output=handler,
+        project_name=src.name,
+        in_dirs=[src],
+        files=files,
+        sub_rules_file="",
+    )
+    with writer:
+        writer.make_md()
+    parts = handler.get_filepaths()
+    assert parts[0] == tmp_path / "out-1.md"
+    assert handler.get_file_ids() == {md_transform.file_id(p) for p in parts}
+    assert all(part.stat().st_size <= 1000 for part in parts[1:])
+    joined = "".join(part.read_text() for part in parts)
+    # the parts only add the continuation headings and fences
+    assert len(joined) > len(single_md)
+    assert joined.replace("big.txt` (continued)", "").count("big.txt") == 2
+
+
+def test_split_output_streams_sections(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(md_transform, "STREAM_CONTENT_MIN_BYTES", 1)
+    src = tmp_path / "src"
+    files = make_tree(src)
+    big = src / "big.txt"
+    big.write_text("".join(f"big line {i} é\n" for i in range(1000)))
+    files.append(big)
+
+    def render_split(name: str, buffered: bool) -> list[str]:
+        handler = md_transform.SplitFileOutputHandler(
+            initial_path=tmp_path / name, bytes_per_file=1000
+        )
+        if buffered:
+            # as `files2md client` passes sections on, text a chunk at a time
+            handler.write_section = lambda rendered: handler.writelines(
+                rendered.iter_chunks()
+            )
+        writer = md_transform.MdWriter(
+            output=handler,
+            project_name=src.name,
+            in_dirs=[src],
+            files=files,
+            sub_rules_file="",
+        )
+        with writer:
+            writer.make_md()
+        return [part.read_text() for part in handler.get_filepaths()]
+
+    streamed = render_split("streamed.md", buffered=False)
+    assert len(streamed) > 10
+    assert streamed == render_split("buffered.md", buffered=True)
+
+
+def test_split_handler_accepts_kb_per_file(tmp_path: Path):
+    with pytest.deprecated_call():
+        handler = md_transform.SplitFileOutputHandler(
+            initial_path=tmp_path / "out.md", kb_per_file=2
+        )
+    handler.on_complete()
+    assert handler.bytes_per_file == 2000
+
+
+def test_output_files_are_not_rendered(tmp_path: Path):
+    files = make_tree(tmp_path)
+    out = tmp_path / "out.md"
+    link = tmp_path / "link.md"
+    with open(out, "w", encoding="utf-8") as ofh:
+        os.link(out, link)
+        handler = md_transform.SingleFileOutputHandler(ofh)
+        assert handler.get_file_ids() == {md_transform.file_id(out)}
+        writer = md_transform.MdWriter(
+            output=handler,
+            project_name=tmp_path.name,
+            in_dirs=[tmp_path],
+            files=[*files, out, link],
+            sub_rules_file="",
+        )
+        writer.make_md()
+    md = out.read_text(encoding="utf-8")
+    assert f"### `{tmp_path.name}/a.py`" in md
+    assert f"### `{tmp_path.name}/out.md`" not in md
+    assert f"### `{tmp_path.name}/link.md`" not in md
+    assert len(writer.summary.included_files) == len(files)
+
+
+def test_removed_files_are_listed(tmp_path: Path):
+    files = make_tree(tmp_path)
+    removed = [
+        md_transform.RemovedFile(tmp_path / "gone.py"),
+        md_transform.RemovedFile(tmp_path / "old.py", renamed_to=files[0]),
+    ]
+    out, _ = render(tmp_path, files[:1], removed_files=removed)
+    name = tmp_path.name
+    renamed = files[0].relative_to(tmp_path).as_posix()
+    listing = out.split("## File listing:\n")[1].split("\n\n")[0]
+    assert listing.splitlines() == [
+        f"`{name}/{renamed}`",
+        f"`{name}/gone.py` (deleted)",
+        f"`{name}/old.py` (renamed to `{name}/{renamed}`)",
+    ]
+    assert out.count("### `") == 1
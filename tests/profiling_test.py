@@ -0,0 +1,53 @@
+import json
+import tracemalloc
+from pathlib import Path
+
+from files2md import profiling
+from tests.md_transform_test import make_tree, render
+
+
+def test_profiler_records_files_and_phases(tmp_path: Path):
+    files = make_tree(tmp_path)
+    profiler = profiling.Profiler(trace_memory=False)
+    profiled_md, writer = render(tmp_path, files, profiler=profiler)
+    assert profiled_md == render(tmp_path, files)[0]
+
+    file_events = [e for e in profiler.events if e.get("cat") == "file"]
+    assert len(file_events) == len(files)
+    phases = [e for e in profiler.events if e.get("cat") == "phase"]
+    for file_event in file_events:
+        start, end = file_event["ts"], file_event["ts"] + file_event["dur"]
+        inner = [p for p in phases if start <= p["ts"] and p["ts"] < end]
+        assert inner[0]["name"] == profiling.PHASE_CLASSIFY
+    (stage,) = [e for e in profiler.events if e.get("cat") == "stage"]
+    assert stage["name"] == "make_md"
+    assert stage["args"]["items"] == len(files)
+
+    slowest = profiler.slowest_files(3)
+    assert len(slowest) == 3
+    assert slowest[0].wall_s >= slowest[-1].wall_s
+    assert writer.summary.included_files
+
+
+def test_profiler_stage_memory_and_write(tmp_path: Path):
+    profiler = profiling.Profiler()
+    try:
+        with profiler.stage("alloc") as stat:
+            data = bytearray(2**20)
+            stat.nbytes = len(data)
+    finally:
+        tracemalloc.stop()
+    out = tmp_path / "trace.json"
+    profiler.write(out)
+    trace = json.loads(out.read_text())
+    (event,) = [e for e in trace["traceEvents"] if e.get("name") == "alloc"]
+    assert event["ph"] == "X"
+    assert event["args"]["bytes"] == 2**20
+    assert event["args"]["tracemalloc_peak_bytes"] >= 2**20
+
+
+def test_no_trace_without_profile(tmp_path: Path):
+    files = make_tree(tmp_path)
+    _, writer = render(tmp_path, files)
+    rendered = writer.mdfmt.render_file(files[0], "a.py")
+    assert rendered.trace is None
@@ -0,0 +1,58 @@
+from pathlib import Path
+
+import pytest
+
+from files2md import filebuf, readahead
+
+
+def make_files(root: Path, count: int) -> list[Path]:
+    files = []
+    for i in range(count):
+        file = root / f"f{i:03}.txt"
+        file.write_bytes(b"x" * i)
+        files.append(file)
+    return files
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_read_ahead_keeps_order(tmp_path: Path, threads: int):
+    files = make_files(tmp_path, 100)
+    pairs = list(readahead.iter_read_ahead(files, threads=threads))
+    assert [file for file, _ in pairs] == files
+    assert [get_data() for _, get_data in pairs] == [b"x" * i for i in range(100)]
+
+
+def test_read_ahead_skips_files(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(filebuf, "MMAP_THRESHOLD", 50)
+    files = make_files(tmp_path, 60)
+    missing = tmp_path / "missing.txt"
+    read_ahead = readahead.iter_read_ahead(
+        [*files, missing], threads=2, should_read=lambda file: file != files[1]
+    )
+    data = {file: get_data() for file, get_data in read_ahead}
+    assert data[files[0]] == b""
+    assert data[files[1]] is None  # should_read
+    assert data[files[49]] == b"x" * 49
+    assert data[files[50]] is None  # mapped instead
+    assert data[missing] is None
+
+
+def test_read_ahead_is_bounded(tmp_path: Path):
+    files = make_files(tmp_path, 100)
+    taken = []
+
+    def iter_files():
+        for file in files:
+            taken.append(file)
+            yield file
+
+    read_ahead = readahead.iter_read_ahead(iter_files(), threads=1)
+    next(read_ahead)
+    assert len(taken) == readahead.READ_AHEAD_FILES_PER_THREAD
+
+    taken.clear()
+    read_ahead = readahead.iter_read_ahead(iter_files(), threads=1, max_bytes=1)
+    for yielded, (_, get_data) in enumerate(read_ahead, 1):
+        get_data()
+        assert len(taken) - yielded < readahead.READ_AHEAD_FILES_PER_THREAD
+    assert taken == files
@@ -0,0 +1,149 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from files2md import md_transform
+from files2md.render_cache import MemoryRenderCache, RenderCache, default_cache_dir
+
+from .md_transform_test import add_copies, make_tree, render
+
+
+def age_files(files: list[Path], seconds: int = 60):
+    past = time.time() - seconds
+    for file in files:
+        os.utime(file, (past, past))
+
+
+def test_cached_run_matches_uncached(tmp_path: Path):
+    tree = tmp_path / "tree"
+    files = make_tree(tree)
+    age_files(files)
+    uncached_md, _ = render(tree, files)
+    with RenderCache(tmp_path / "cache") as cache:
+        first_md, first = render(tree, files, render_cache=cache)
+    with RenderCache(tmp_path / "cache") as cache:
+        second_md, second = render(tree, files, render_cache=cache)
+    assert first_md == second_md == uncached_md
+    assert first.summary.cache_misses == len(files)
+    assert second.summary.cache_hits == len(files)
+    assert second.summary.cache_misses == 0
+
+
+def test_changed_file_is_rerendered(tmp_path: Path):
+    tree = tmp_path / "tree"
+    files = make_tree(tree)
+    age_files(files)
+    with RenderCache(tmp_path / "cache") as cache:
+        render(tree, files, render_cache=cache)
+    (tree / "a.py").write_text("print('changed')\n", encoding="utf-8")
+    with RenderCache(tmp_path / "cache") as cache:
+        md, writer = render(tree, files, render_cache=cache, jobs=2, executor="thread")
+    assert "print('changed')" in md
+    assert writer.summary.cache_misses == 1
+    assert writer.summary.cache_hits == len(files) - 1
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{}, {"read_threads": 2}, {"jobs": 3, "executor": "thread"}]
+)
+def test_files_are_looked_up_as_they_are_written(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, kwargs: dict
+):
+    monkeypatch.setattr(md_transform, "CACHE_LOOKUP_AHEAD", 2)
+    tree = tmp_path / "tree"
+    files = make_tree(tree) + add_copies(tree)
+    age_files(files)
+    uncached_md, _ = render(tree, files)
+    with RenderCache(tmp_path / "cache") as cache:
+        render(tree, files[::2], render_cache=cache)
+    looked_up: list[Path] = []
+    lookups_at_write: list[int] = []
+    write_section = md_transform.SingleFileOutputHandler.write_section
+
+    def record_write(handler, rendered):
+        lookups_at_write.append(len(looked_up))
+        write_section(handler, rendered)
+
+    monkeypatch.setattr(
+        md_transform.SingleFileOutputHandler, "write_section", record_write
+    )
+    with RenderCache(tmp_path / "cache") as cache:
+        key_for = cache.key_for
+        monkeypatch.setattr(
+            cache,
+            "key_for",
+            lambda file, *args: looked_up.append(file) or key_for(file, *args),
+        )
+        md, writer = render(tree, files, render_cache=cache, **kwargs)
+    assert md == uncached_md
+    assert writer.summary.cache_hits == len(files[::2])
+    assert len(looked_up) == len(lookups_at_write) == len(files)
+    assert all(n <= i + 2 for i, n in enumerate(lookups_at_write, 1))
+
+
+def test_options_change_the_fingerprint(tmp_path: Path):
+    tree = tmp_path / "tree"
+    files = make_tree(tree)
+    age_files(files)
+    with RenderCache(tmp_path / "cache") as cache:
+        render(tree, files, render_cache=cache)
+        _, writer = render(tree, files, render_cache=cache, include_empty=True)
+    assert writer.summary.cache_hits == 0
+
+
+def test_dedupe_uses_cached_hashes(tmp_path: Path):
+    tree = tmp_path / "tree"
+    files = make_tree(tree) + add_copies(tree)
+    age_files(files)
+    uncached_md, _ = render(tree, files, dedupe=True)
+    with RenderCache(tmp_path / "cache") as cache:
+        first_md, _ = render(tree, files, render_cache=cache, dedupe=True)
+    with RenderCache(tmp_path / "cache") as cache:
+        second_md, second = render(tree, files, render_cache=cache, dedupe=True)
+    assert first_md == second_md == uncached_md
+    assert second.summary.cache_hits == len(files)
+    assert second.summary.duplicate_files == 2
+
+
+def test_eviction_bounds_cache_size(tmp_path: Path):
+    tree = tmp_path / "tree"
+    files = make_tree(tree)
+    age_files(files)
+    with RenderCache(tmp_path / "cache", max_bytes=100) as cache:
+        render(tree, files, render_cache=cache)
+    with RenderCache(tmp_path / "cache") as cache:
+        (total,) = cache.db.execute("SELECT SUM(nbytes) FROM chunks").fetchone()
+    assert total <= 100
+
+
+def test_memory_cache_checks_stat_and_evicts(tmp_path: Path):
+    tree = tmp_path / "tree"
+    files = make_tree(tree)
+    age_files(files)
+    cache = MemoryRenderCache()
+    uncached_md, _ = render(tree, files)
+    render(tree, files, render_cache=cache)
+    md, writer = render(tree, files, render_cache=cache)
+    assert md == uncached_md
+    assert writer.summary.cache_hits == len(files)
+    (tree / "a.py").write_text("print('changed')\n", encoding="utf-8")
+    age_files([tree / "a.py"], seconds=30)
+    md, writer = render(tree, files, render_cache=cache)
+    assert "print('changed')" in md
+    assert writer.summary.cache_misses == 1
+    small = MemoryRenderCache(max_bytes=100)
+    render(tree, files, render_cache=small)
+    assert 0 < small.nbytes <= 100
+    assert len(small) < len(files)
+
+
+def test_default_cache_dir_is_a_user_cache_dir(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert default_cache_dir() == tmp_path / "files2md"
+    monkeypatch.setenv("XDG_CACHE_HOME", "relative")
+    monkeypatch.setenv("HOME", str(tmp_path))
+    assert default_cache_dir() == tmp_path / ".cache" / "files2md"
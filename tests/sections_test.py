@@ -0,0 +1,71 @@
+from pathlib import Path
+
+import pytest
+
+import files2md
+from files2md import md_transform, sections
+
+
+def make_tree(root: Path):
+    root.joinpath("pkg").mkdir(parents=True)
+    root.joinpath("pkg", "main.py").write_text("".join(f"x = {i}\n" for i in range(20)))
+    root.joinpath("notes.md").write_text("notes\n")
+    root.joinpath("empty.txt").write_text("")
+    root.joinpath("blob.dat").write_bytes(bytes(range(256)))
+    root.joinpath("big.txt").write_text("line\n" * 1000)
+
+
+def test_iter_sections(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(md_transform, "STREAM_CONTENT_MIN_BYTES", 4096)
+    make_tree(tmp_path)
+    found = {s.pathname: s for s in files2md.iter_sections([tmp_path])}
+    name = tmp_path.name
+    assert list(found) == [
+        f"{name}/big.txt",
+        f"{name}/blob.dat",
+        f"{name}/notes.md",
+        f"{name}/pkg/main.py",
+    ]
+    main = found[f"{name}/pkg/main.py"]
+    assert main.path == tmp_path / "pkg" / "main.py"
+    assert main.language == "python"
+    assert main.read_body() == main.path.read_text()
+    assert not main.truncated
+    assert not found[f"{name}/blob.dat"].has_body
+    big = found[f"{name}/big.txt"]
+    assert big.rendered.streamed
+    assert big.read_body() == big.path.read_text()
+
+
+def test_iter_sections_match_document(tmp_path: Path):
+    make_tree(tmp_path)
+    handler = md_transform.MemoryOutputHandler()
+    writer = md_transform.MdWriter(
+        output=handler,
+        project_name=tmp_path.name,
+        in_dirs=[tmp_path],
+        files=sorted(p for p in tmp_path.rglob("*") if p.is_file()),
+        max_lines_per_file=10,
+        sub_rules_file="",
+    )
+    writer.make_md()
+    document = handler.getvalue()
+    header_end = document.index("## Filenames and content:\n") + 26
+    found = list(sections.iter_sections([tmp_path], max_lines_per_file=10))
+    assert "".join("".join(s.iter_markdown()) for s in found) == document[header_end:]
+    assert [s.truncated for s in found] == [True, True, False, True]
+
+
+def test_memory_output_handler_sink(tmp_path: Path):
+    make_tree(tmp_path)
+    chunks: list[str] = []
+    writer = md_transform.MdWriter(
+        output=md_transform.MemoryOutputHandler(chunks.append),
+        project_name=tmp_path.name,
+        in_dirs=[tmp_path],
+        files=[tmp_path / "notes.md"],
+        sub_rules_file="",
+    )
+    writer.make_md()
+    assert len(chunks) > 1
+    assert "".join(chunks).endswith("```markdown\nnotes\n\n```\n\n")
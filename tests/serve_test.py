@@ -0,0 +1,102 @@
+import concurrent.futures
+import contextlib
+import threading
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from files2md import md_transform
+from files2md.cli import cli_impl, serve
+from tests.gitutil_test import make_repo
+from tests.md_transform_test import make_tree
+from tests.render_cache_test import age_files
+
+
+@contextlib.contextmanager
+def start_server(
+    socket_path: Path, pool: "concurrent.futures.Executor | None" = None
+) -> Iterator[serve.RenderServer]:
+    with serve.RenderServer(socket_path, cache_max_bytes=2**20, pool=pool) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            yield server
+        finally:
+            server.shutdown()
+            thread.join()
+
+
+@pytest.fixture
+def server(tmp_path: Path) -> Iterator[serve.RenderServer]:
+    with start_server(tmp_path / "s.sock") as server:
+        yield server
+
+
+def run_client(server: serve.RenderServer, *argv: str):
+    cli_impl.main(["client", "--socket", server.server_address, *argv, "-qqqqq"])  # type: ignore
+
+
+def test_client_output_matches_local_run(tmp_path: Path, server: serve.RenderServer):
+    root = tmp_path / "root"
+    age_files(make_tree(root))
+    options = [str(root), "-g", "*", "-l", "10", "-f"]
+    cli_impl.main([*options, "-o", str(tmp_path / "local.md"), "--no-cache", "-qqqqq"])
+    local_md = (tmp_path / "local.md").read_text()
+    for _ in range(2):
+        run_client(server, *options, "-o", str(tmp_path / "remote.md"))
+        assert (tmp_path / "remote.md").read_text() == local_md
+    assert len(server.render_cache) == 6
+    changed = root / "a.py"
+    changed.write_text("print('changed')\n")
+    age_files([changed], seconds=30)
+    run_client(server, *options, "-o", str(tmp_path / "remote.md"))
+    assert "print('changed')" in (tmp_path / "remote.md").read_text()
+
+
+def test_client_splits_output(tmp_path: Path, server: serve.RenderServer):
+    root = tmp_path / "root"
+    make_tree(root)
+    options = [str(root), "-g", "*", "-f", "-p", "1KB"]
+    cli_impl.main([*options, "-o", str(tmp_path / "local.md"), "--no-cache", "-qqqqq"])
+    run_client(server, *options, "-o", str(tmp_path / "remote.md"))
+    local_parts = sorted(tmp_path.glob("local*"))
+    remote_parts = sorted(tmp_path.glob("remote*"))
+    assert len(local_parts) == len(remote_parts) > 1
+    for local, remote in zip(local_parts, remote_parts):
+        assert local.read_text() == remote.read_text()
+
+
+def test_client_reports_server_errors(tmp_path: Path, server: serve.RenderServer):
+    root = make_repo(tmp_path / "root", {"a.py": "a"})
+    with pytest.raises(SystemExit, match="--changed-since nope: .*nope"):
+        run_client(
+            server, str(root), "-o", str(tmp_path / "o.md"), "--changed-since", "nope"
+        )
+
+
+@pytest.mark.parametrize("shared_pool", [False, True])
+def test_requests_do_not_fork_workers(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, shared_pool: bool
+):
+    executors: list[str] = []
+    make_executor = md_transform.MdWriter.make_executor
+
+    def record_make_executor(writer: md_transform.MdWriter):
+        executors.append(writer.executor)
+        return make_executor(writer)
+
+    monkeypatch.setattr(md_transform.MdWriter, "make_executor", record_make_executor)
+    root = tmp_path / "root"
+    make_tree(root)
+    options = [str(root), "-g", "*", "-f", "-j", "2", "--executor", "process"]
+    cli_impl.main([*options, "-o", str(tmp_path / "local.md"), "--no-cache", "-qqqqq"])
+    executors.clear()
+    with contextlib.ExitStack() as stack:
+        pool = None
+        if shared_pool:
+            pool = stack.enter_context(concurrent.futures.ThreadPoolExecutor(2))
+        server = stack.enter_context(start_server(tmp_path / "s.sock", pool))
+        run_client(server, *options, "-o", str(tmp_path / "remote.md"))
+    assert (tmp_path / "remote.md").read_text() == (tmp_path / "local.md").read_text()
+    assert executors == ([] if shared_pool else [md_transform.EXECUTOR_THREAD])
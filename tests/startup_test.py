@@ -0,0 +1,10 @@
+import pytest
+
+from benchmarks import startup
+
+
+@pytest.mark.parametrize("argv", startup.STARTUP_ARGVS)
+def test_startup_does_not_import_heavy_modules(argv: list[str]):
+    self_us = startup.measure_imports(argv)
+    assert "files2md.cli.cli_impl" in self_us
+    assert startup.heavy_imports(self_us) == []
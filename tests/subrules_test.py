@@ -0,0 +1,59 @@
+from pathlib import Path
+
+from files2md import subrules
+
+
+def write_rules(tmp_path: Path, text: str) -> str:
+    path = tmp_path / "rules.tsv"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_parse_rules_file(tmp_path: Path):
+    rules = subrules.parse_rules_file(
+        write_rules(
+            tmp_path,
+            "# comment\n"
+            "secret\tREDACTED\n"
+            "\\#define\t#def\n"
+            "(\\w+)@example\\.com\t\\1@REDACTED\n"
+            "no separator\n",
+        )
+    )
+    assert [type(r) for r in rules] == [
+        subrules.LiteralTextSubstituter,
+        subrules.RETextSubstituter,
+        subrules.RETextSubstituter,
+    ]
+
+
+def test_rules_apply_in_order():
+    rules = subrules.SubRules(
+        [
+            subrules.make_substituter("cat", "dog"),
+            subrules.make_substituter("d[o]g", "wolf"),
+        ]
+    )
+    content, stats = rules.apply("cat and dog")
+    assert content == "wolf and wolf"
+    assert [(s.rule_index, s.matches) for s in stats] == [(0, 1), (1, 2)]
+
+
+def test_prefilter_skips_unmatched_content():
+    rules = subrules.SubRules(
+        [
+            subrules.make_substituter("secret", "REDACTED"),
+            subrules.make_substituter(r"\d{4}-\d{4}", "XXXX"),
+        ]
+    )
+    assert rules.prefilter is not None
+    assert rules.apply("nothing to see") == ("nothing to see", [])
+    content, stats = rules.apply("pin 1234-5678")
+    assert content == "pin XXXX"
+    assert [s.matches for s in stats] == [0, 1]
+
+
+def test_prefilter_disabled_for_groups():
+    rules = subrules.SubRules([subrules.make_substituter(r"(a)(b)", r"\2\1")])
+    assert rules.prefilter is None
+    assert rules.apply("abab")[0] == "baba"
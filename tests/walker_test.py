@@ -0,0 +1,89 @@
+import os
+from pathlib import Path
+
+import pathspec
+import pytest
+
+from files2md import fileinfo
+from files2md.cli import walker
+
+TREE = [
+    "README.md",
+    "main.py",
+    "lib/util.py",
+    "lib/data.bin",
+    "node_modules/pkg/index.js",
+    "node_modules/pkg/README",
+    "src/node_modules/deep.py",
+    ".git/config",
+    ".git/objects/ab/cdef",
+    ".venv/lib/site.py",
+    "dist/out.js",
+    "docs/dist/page.md",
+    ".mypy_cache/x.json",
+]
+
+PATTERN_SETS = [
+    [],
+    ["*"],
+    ["*.py"],
+    ["/lib/"],
+    ["src/"],
+    ["!*.py", "*"],
+    ["docs/**"],
+    ["node_modules/pkg/*"],
+]
+
+
+def make_tree(root: Path):
+    for rel in TREE:
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(rel, encoding="utf-8")
+    os.symlink(root / "lib", root / "lib_link")
+    os.symlink(root / "missing", root / "broken_link")
+
+
+@pytest.mark.parametrize("user_patterns", PATTERN_SETS)
+@pytest.mark.parametrize("threads", [0, 4])
+def test_walk_matches_match_tree(tmp_path: Path, user_patterns, threads: int):
+    make_tree(tmp_path)
+    spec = pathspec.PathSpec.from_lines(
+        "gitwildmatch", fileinfo.DEFAULT_PATTERNS + user_patterns
+    )
+    expected = list(spec.match_tree(tmp_path))
+    walked = walker.walk_tree(tmp_path, spec, threads=threads)
+    assert [w.rel for w in walked] == expected
+    for w in walked:
+        assert w.stat.st_size == w.path.stat().st_size
+
+
+def test_excluded_dirs_are_not_scanned(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    make_tree(tmp_path)
+    scanned = []
+    real_scandir = os.scandir
+
+    def scandir(path):
+        scanned.append(Path(path).relative_to(tmp_path).as_posix())
+        return real_scandir(path)
+
+    monkeypatch.setattr(walker.os, "scandir", scandir)
+    spec = pathspec.PathSpec.from_lines(
+        "gitwildmatch", fileinfo.DEFAULT_PATTERNS + ["/lib/"]
+    )
+    walker.walk_tree(tmp_path, spec)
+    assert "node_modules" not in scanned
+    assert ".git" not in scanned
+    assert ".venv" not in scanned
+    assert "lib" in scanned
+
+
+def test_symlink_loop_raises_like_pathspec(tmp_path: Path):
+    (tmp_path / "a").mkdir()
+    os.symlink(tmp_path, tmp_path / "a" / "loop")
+    spec = pathspec.PathSpec.from_lines("gitwildmatch", ["*"])
+    with pytest.raises(pathspec.util.RecursionError):
+        list(spec.match_tree(tmp_path))
+    for threads in [0, 2]:
+        with pytest.raises(pathspec.util.RecursionError):
+            walker.walk_tree(tmp_path, spec, threads=threads)
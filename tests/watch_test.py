@@ -0,0 +1,82 @@
+import os
+from pathlib import Path
+
+from files2md.cli import watch
+from tests.md_transform_test import make_tree, render
+
+
+def make_watcher(root: Path, out_file: Path) -> watch.Watcher:
+    return watch.Watcher(
+        collect_files=lambda: sorted(p for p in root.rglob("*") if p.is_file()),
+        writer_kwargs=lambda files: dict(
+            project_name=root.name,
+            in_dirs=[root],
+            files=files,
+            max_lines_per_file=10,
+            sub_rules_file="",
+        ),
+        out_file=out_file,
+        interval=0.01,
+        debounce=0.01,
+        verbosity=0,
+    )
+
+
+def test_watcher_rerenders_changed_files(tmp_path: Path):
+    root = tmp_path / "root"
+    make_tree(root)
+    out_file = tmp_path / "out.md"
+    watcher = make_watcher(root, out_file)
+
+    writer = watcher.build(watcher.poll())
+    assert writer.rerendered_count == len(watcher.states)
+    files = sorted(watcher.states)
+    assert out_file.read_text() == render(root, files)[0]
+
+    changed = root / "a.py"
+    changed.write_text("print('changed')\n")
+    os.utime(changed, ns=(1, 1))
+    (root / "b.md").unlink()
+    (root / "new.txt").write_text("new\n")
+    writer = watcher.build(watcher.wait_for_change())
+    assert writer.rerendered_count == 2
+    files = sorted(watcher.states)
+    assert out_file.read_text() == render(root, files)[0]
+    assert not list(tmp_path.glob(".files2md-*"))
+
+
+def test_watcher_keeps_unchanged_output(tmp_path: Path):
+    root = tmp_path / "root"
+    make_tree(root)
+    out_file = tmp_path / "out.md"
+    watcher = make_watcher(root, out_file)
+    watcher.build(watcher.poll())
+    inode = out_file.stat().st_ino
+    writer = watcher.build(watcher.poll())
+    assert writer.rerendered_count == 0
+    assert out_file.stat().st_ino == inode
+
+
+def test_watcher_survives_file_removed_before_build(tmp_path: Path):
+    root = tmp_path / "root"
+    make_tree(root)
+    out_file = tmp_path / "out.md"
+    watcher = make_watcher(root, out_file)
+    watcher.build(watcher.poll())
+    published = out_file.read_text()
+    built_states = watcher.states
+
+    changed = root / "a.py"
+    changed.write_text("print('changed')\n")
+    os.utime(changed, ns=(1, 1))
+    states = watcher.poll()
+    changed.unlink()
+    assert watcher.try_build(states) == states
+    assert watcher.states == built_states
+    assert out_file.read_text() == published
+    assert not list(tmp_path.glob(".files2md-*"))
+
+    writer = watcher.build(watcher.wait_for_change(since=states))
+    assert changed not in watcher.states
+    assert writer.rerendered_count == 0
+    assert out_file.read_text() == render(root, sorted(watcher.states))[0]